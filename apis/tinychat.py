@@ -1,6 +1,9 @@
 import time
 import util.web
 
+# The tinychat site, e.g pointed at a mock.server.MockServer for testing.
+BASE_URL = 'https://tinychat.com'
+
 
 def rtc_version(room):
     """
@@ -11,7 +14,7 @@ def rtc_version(room):
     :return: The current tinychat rtc version, or None on parse failure.
     :rtype: str | None
     """
-    _url = 'https://tinychat.com/room/{0}'.format(room)
+    _url = '{0}/room/{1}'.format(BASE_URL, room)
     response = util.web.http_get(url=_url)
 
     if response['content'] is not None:
@@ -28,7 +31,7 @@ def get_connect_token(room):
     :return: The token and the wss endpoint.
     :rtype: dict | None
     """
-    _url = 'https://tinychat.com/api/v1.0/room/token/{0}'.format(room)
+    _url = '{0}/api/v1.0/room/token/{1}'.format(BASE_URL, room)
 
     response = util.web.http_get(_url, json=True)
     if response['json'] is not None:
@@ -49,7 +52,7 @@ def user_info(account):
     :return: A dictionary containing info about the user account.
     :rtype: dict | None
     """
-    url = 'https://tinychat.com/api/v1.0/user/profile?username={0}&'.format(account)
+    url = '{0}/api/v1.0/user/profile?username={1}&'.format(BASE_URL, account)
     response = util.web.http_get(url, json=True)
 
     if response['json'] is not None:
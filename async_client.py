@@ -0,0 +1,552 @@
+# -*- coding: utf-8 -*-
+"""
+Host many rooms on a single thread.
+
+TinychatRTCClient.connect blocks a thread per room reading the websocket. AsyncTinychatRTCClient
+instead registers its websocket with an EventLoop, which waits on all the room sockets at once
+and dispatches frames as they become readable. The blocking HTTP calls (connect token, rtc version)
+and the websocket handshake are run in a small worker pool, and their results are handed back to
+the loop thread, so all event handlers still run on the loop thread.
+
+Usage:
+    loop = async_client.EventLoop()
+    for room in rooms:
+        loop.add(AsyncTinychatRTCClient(room=room))
+    loop.run()
+"""
+import ssl
+import time
+import heapq
+import errno
+import itertools
+import select
+import socket
+import logging
+import threading
+import traceback
+
+import websocket
+
+import writer
+import pinylib
+import apis.tinychat
+from util.workers import WorkerPool
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+log = logging.getLogger(__name__)
+
+# Raised reading a ssl socket without a whole record, python 2.7.9 and up.
+_SSLWantReadError = getattr(ssl, 'SSLWantReadError', ())
+
+
+def _would_block(error):
+    """
+    Tells if a read failed only because the rest of the frame has not arrived yet.
+
+    :param error: The error raised reading the websocket.
+    :type error: Exception
+    :rtype: bool
+    """
+    if isinstance(error, (websocket.WebSocketTimeoutException, _SSLWantReadError)):
+        return True
+    return isinstance(error, socket.error) and bool(error.args) and error.args[0] in (errno.EAGAIN,
+                                                                                      errno.EWOULDBLOCK)
+
+
+class TimerHandle(object):
+    """ A call scheduled with EventLoop.call_later. """
+
+    def __init__(self, when, fn, args):
+        self.when = when
+        self.fn = fn
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        """ Cancel the call. """
+        self.cancelled = True
+
+
+class EventLoop(object):
+    """ A select/poll based loop reading the websockets of many clients on one thread. """
+
+    def __init__(self, http_workers=8, poll_interval=0.05):
+        """
+        Create the event loop.
+
+        :param http_workers: The number of threads used for blocking HTTP calls and handshakes.
+        :type http_workers: int
+        :param poll_interval: The maximum seconds to wait for socket activity, before
+        checking for completed background calls.
+        :type poll_interval: float
+        """
+        self.poll_interval = poll_interval
+        self.clients = []
+        self.is_running = False
+        self.frames = 0
+        # the time the last poll returned, when the frames it returned were picked up.
+        self.polled_at = time.time()
+        self._pool = WorkerPool(workers=http_workers, name='loop-http')
+        self._ready = queue.Queue()
+        self._readers = {}
+        self._ssl_readers = {}
+        self._writers = []
+        self._timers = []
+        self._timer_seq = itertools.count()
+        self._poller = select.poll() if hasattr(select, 'poll') else None
+
+        # wakes up the loop when a background call completes. Without socketpair
+        # (windows on python 2) completed calls wait for the poll_interval.
+        self._waker = self._wake_w = None
+        if hasattr(socket, 'socketpair'):
+            self._waker, self._wake_w = socket.socketpair()
+            self._waker.setblocking(False)
+            self._wake_w.setblocking(False)
+            self.add_reader(self._waker, None)
+
+    def add(self, client):
+        """
+        Add a client to the loop and start connecting it.
+
+        :param client: The client to add.
+        :type client: AsyncTinychatRTCClient
+        """
+        client.loop = self
+        self.clients.append(client)
+        client.connect()
+
+    def remove(self, client):
+        """
+        Disconnect a client and remove it from the loop.
+
+        A client still connecting, or waiting to reconnect, stops doing so.
+
+        :param client: The client to remove.
+        :type client: AsyncTinychatRTCClient
+        """
+        client.disconnect()
+        if client in self.clients:
+            self.clients.remove(client)
+
+    def call_soon_threadsafe(self, fn, *args):
+        """
+        Schedule a call on the loop thread. This can be called from any thread.
+
+        :param fn: The callable.
+        :type fn: callable
+        """
+        self._ready.put((fn, args))
+        if self._wake_w is not None:
+            try:
+                self._wake_w.send(b'\0')
+            except socket.error:  # the buffer is full, the loop is woken anyway.
+                pass
+
+    def call_later(self, delay, fn, *args):
+        """
+        Schedule a call on the loop thread after a delay. This must be called from the loop thread.
+
+        :param delay: Seconds to wait.
+        :type delay: int | float
+        :param fn: The callable.
+        :type fn: callable
+        :return: A handle with a cancel() method.
+        :rtype: TimerHandle
+        """
+        handle = TimerHandle(time.time() + delay, fn, args)
+        heapq.heappush(self._timers, (handle.when, next(self._timer_seq), handle))
+        return handle
+
+    def run_in_executor(self, fn, args, callback):
+        """
+        Run a blocking call in the worker pool, and call callback with the
+        result on the loop thread. If the call fails, callback gets None.
+
+        :param fn: The blocking callable.
+        :type fn: callable
+        :param args: The arguments for fn.
+        :type args: tuple
+        :param callback: The callable receiving the result.
+        :type callback: callable
+        """
+        self.add_future(self._pool.submit(fn, *args), callback)
+
+    def add_future(self, future, callback):
+        """
+        Call callback with the result of a future on the loop thread, once it is done.
+        If the future failed, callback gets None.
+
+        :param future: The future, e.g of a call running in another thread.
+        :type future: util.workers.Future
+        :param callback: The callable receiving the result.
+        :type callback: callable
+        """
+        future.add_done_callback(
+            lambda f: self.call_soon_threadsafe(callback, None if f.exception() else f.result()))
+
+    def add_reader(self, sock, client):
+        """
+        Start watching a client socket for incoming data.
+
+        :return: The file descriptor, used to remove the reader.
+        :rtype: int
+        """
+        fd = sock.fileno()
+        self._readers[fd] = (sock, client)
+        if hasattr(sock, 'pending'):
+            self._ssl_readers[fd] = (sock, client)
+        if self._poller is not None:
+            self._poller.register(fd, select.POLLIN | select.POLLPRI)
+        return fd
+
+    def remove_reader(self, fd):
+        """
+        Stop watching a client socket.
+
+        The websocket drops its socket when the connection is closed,
+        so the reader is removed by the file descriptor returned from add_reader.
+        """
+        if fd in self._readers:
+            del self._readers[fd]
+            self._ssl_readers.pop(fd, None)
+            if self._poller is not None:
+                self._poller.unregister(fd)
+
+    def add_writer(self, frame_writer):
+        """ Flush a client's outbound queue on the loop thread. """
+        self._writers.append(frame_writer)
+
+    def remove_writer(self, frame_writer):
+        """ Stop flushing a client's outbound queue. """
+        if frame_writer in self._writers:
+            self._writers.remove(frame_writer)
+
+    def stop(self):
+        """ Stop the loop after the current iteration. """
+        self.is_running = False
+
+    def run(self):
+        """ Run the loop until stopped. """
+        self.is_running = True
+        while self.is_running:
+            self._run_ready()
+            self._run_timers()
+            timeout = self._flush_writers()
+            if self._timers:
+                timeout = max(0, min(timeout, self._timers[0][0] - time.time()))
+            clients = self._poll(timeout)
+            self.polled_at = time.time()
+            for client in clients:
+                if client is None:
+                    self._drain_waker()
+                    continue
+                self.frames += 1
+                self._read(client)
+
+        for client in list(self.clients):
+            self.remove(client)
+
+    def _run_ready(self):
+        while True:
+            try:
+                fn, args = self._ready.get_nowait()
+            except queue.Empty:
+                break
+            self._call(fn, args)
+
+    @staticmethod
+    def _call(fn, args):
+        try:
+            fn(*args)
+        except Exception as e:
+            log.error('loop callback error: %s' % e, exc_info=True)
+            if pinylib.CONFIG.DEBUG_MODE:
+                traceback.print_exc()
+
+    def _read(self, client):
+        """ Let a client read a frame. A client failing to handle it is closed, the other rooms keep running. """
+        try:
+            client._on_readable()
+        except Exception as e:
+            log.error('%s failed handling a frame, closing it: %s' % (client.room_name, e), exc_info=True)
+            if pinylib.CONFIG.DEBUG_MODE:
+                traceback.print_exc()
+            self.remove(client)
+
+    def _drain_waker(self):
+        try:
+            while self._waker.recv(4096):
+                pass
+        except socket.error:
+            pass
+
+    def _run_timers(self):
+        now = time.time()
+        while self._timers and self._timers[0][0] <= now:
+            handle = heapq.heappop(self._timers)[2]
+            if not handle.cancelled:
+                self._call(handle.fn, handle.args)
+
+    def _flush_writers(self):
+        """
+        Write queued outbound messages, as far as pacing allows.
+
+        :return: The seconds to wait for socket activity, before a paced message is due.
+        :rtype: float
+        """
+        timeout = self.poll_interval
+        for frame_writer in self._writers:
+            if len(frame_writer):
+                frame_writer.flush()
+                delay = frame_writer.next_write_delay()
+                if delay is not None and delay < timeout:
+                    timeout = delay
+        return timeout
+
+    def _poll(self, timeout):
+        """
+        Wait for readable sockets.
+
+        Data already decrypted by the ssl layer does not make the socket readable,
+        so sockets with pending ssl data are returned without waiting.
+
+        :param timeout: The maximum seconds to wait.
+        :type timeout: float
+        :return: The clients that have data to read.
+        :rtype: list
+        """
+        if not self._readers:
+            time.sleep(timeout)
+            return []
+
+        if self._ssl_readers:
+            pending = [client for sock, client in self._ssl_readers.values() if sock.pending()]
+            if pending:
+                return pending
+
+        try:
+            if self._poller is not None:
+                events = self._poller.poll(timeout * 1000)
+                return [self._readers[fd][1] for fd, _ in events if fd in self._readers]
+            socks = [sock for sock, _ in self._readers.values()]
+            readable, _, _ = select.select(socks, [], [], timeout)
+            return [self._readers[sock.fileno()][1] for sock in readable]
+        except (select.error, socket.error) as e:
+            if e.args[0] != errno.EINTR:
+                raise
+            return []
+
+
+class _Connecting(object):
+    """ A connect in progress. Callbacks of a connect that was given up on are ignored. """
+
+    def __init__(self):
+        self.ws = None
+        self.rtc_version = None
+        self.has_version = False
+        self.handshake_started = None
+
+
+class AsyncTinychatRTCClient(pinylib.TinychatRTCClient):
+    """
+    A TinychatRTCClient driven by an EventLoop.
+
+    The event handlers and message builders are the same as TinychatRTCClient,
+    so bots subclassing TinychatRTCClient can subclass this instead.
+    """
+
+    def __init__(self, room, nickname='', account=None, password=None, loop=None):
+        super(AsyncTinychatRTCClient, self).__init__(room, nickname=nickname,
+                                                     account=account, password=password)
+        self.loop = loop
+        # seconds a write may block the loop, reads never block it.
+        self.write_timeout = 10
+        self._fails = 0
+        self._fd = None
+        self._reconnect_timer = None
+        self._connecting = None
+
+    def connect(self):
+        """ Start connecting. This returns immediately, the steps are completed by the loop. """
+        if self.loop is None:
+            raise RuntimeError('the client has not been added to an EventLoop')
+        if not self._reconnector.is_running:
+            self._reconnector.start()
+        self._reconnect_timer = None
+        self._begin_connect()
+
+        # the token and the rtc version are fetched at the same time,
+        # and the websocket is opened as soon as the token arrives.
+        self._connecting = attempt = _Connecting()
+        self.loop.run_in_executor(apis.tinychat.get_connect_token, (self.room_name,),
+                                  lambda connect_args: self._on_connect_token(attempt, connect_args))
+        rtc_version = self.rtc_versions.peek(self.room_name)
+        if rtc_version is not None:
+            self._on_rtc_version(attempt, rtc_version)
+        else:
+            # the fetch is shared by the rooms connecting at the same time, and does not take a worker.
+            self.loop.add_future(self.rtc_versions.get_future(self.room_name),
+                                 lambda version: self._on_rtc_version(attempt, version))
+
+    def disconnect(self):
+        """ Disconnect from the server. """
+        if self._reconnect_timer is not None:
+            self._reconnect_timer.cancel()
+            self._reconnect_timer = None
+        super(AsyncTinychatRTCClient, self).disconnect()
+
+    def reconnect(self):
+        """ Close the connection, and schedule a connect after the backoff delay. """
+        self._close()
+        if not self._reconnector.is_running:
+            self._reconnector.start()
+        delay = self._reconnector.lost()
+        if delay is None:
+            self.console_write(pinylib.COLOR['bright_red'], 'Giving up reconnecting after %s attempts.' %
+                               self._reconnector.max_attempts)
+            return
+        self._reconnects.inc()
+        if self._reconnector.attempt > 1:
+            # the rtc version might be the reason the previous attempt failed.
+            self.rtc_versions.invalidate()
+
+        log.info('reconnecting to %s in %.2f seconds, attempt %s' %
+                 (self.room_name, delay, self._reconnector.attempt))
+        self._reconnect_timer = self.loop.call_later(delay, self.connect)
+
+    def _close(self):
+        if self._connecting is not None and self._connecting.ws is not None:
+            # opened, but still waiting for the rtc version.
+            self._connecting.ws.abort()
+        self._connecting = None
+        if self._fd is not None:
+            self.loop.remove_reader(self._fd)
+            self._fd = None
+        super(AsyncTinychatRTCClient, self)._close()
+
+    def _start_writer(self):
+        """ Queue outbound messages, flushed by the loop instead of a writer thread. """
+        self._stop_writer()
+        self._writer = writer.FrameWriter(self._ws.send, rate=pinylib.CONFIG.SEND_RATE,
+                                          burst=pinylib.CONFIG.SEND_BURST,
+                                          max_queue=pinylib.CONFIG.SEND_QUEUE_SIZE)
+        self.loop.add_writer(self._writer)
+
+    def _stop_writer(self):
+        if self._writer is not None:
+            self.loop.remove_writer(self._writer)
+        super(AsyncTinychatRTCClient, self)._stop_writer()
+
+    def _user_info_callback(self, _user, tc_info):
+        """ Hand the profile info over to the loop thread, so on_user_info runs there like all other handlers. """
+        self.loop.call_soon_threadsafe(self.on_user_info, _user, tc_info)
+
+    def _on_connect_token(self, attempt, connect_args):
+        if attempt is not self._connecting:
+            return
+        self._mark_phase('token')
+        self._connect_args = connect_args
+        if connect_args is None:
+            e = 'No connect details received. details: %s' % connect_args
+            log.error(e)
+            if pinylib.CONFIG.DEBUG_MODE:
+                print(e)
+            self.reconnect()
+        else:
+            attempt.handshake_started = time.time()
+            self.loop.run_in_executor(self._open_websocket, (), lambda ws: self._on_websocket(attempt, ws))
+
+    def _on_rtc_version(self, attempt, rtc_version):
+        if attempt is not self._connecting:
+            return
+        self._mark_phase('version')
+        attempt.rtc_version = rtc_version
+        attempt.has_version = True
+        if attempt.ws is not None:
+            self._join(attempt)
+
+    def _open_websocket(self):
+        ws = websocket.create_connection(
+            self._connect_args['endpoint'],
+            header=pinylib.TC_HEADER,
+            origin='https://tinychat.com'
+        )
+        ws.settimeout(self.write_timeout)
+        return ws
+
+    def _on_websocket(self, attempt, ws):
+        if attempt is not self._connecting:
+            # disconnected, or reconnecting, while the handshake was running.
+            if ws is not None:
+                ws.abort()
+            return
+        if ws is None or not ws.connected:
+            log.error('websocket handshake failed for: %s' % self.room_name)
+            self.reconnect()
+            return
+
+        self._mark_phase('handshake', attempt.handshake_started)
+        attempt.ws = ws
+        if attempt.has_version:
+            self._join(attempt)
+
+    def _join(self, attempt):
+        self._connecting = None
+        self._ws = attempt.ws
+        log.info('connecting to: %s' % self.room_name)
+        self._start_writer()
+        self._send_join(attempt.rtc_version)
+        self.is_connected = True
+        self._fails = 0
+        self._fd = self.loop.add_reader(self._ws.sock, self)
+        # _join runs on the loop thread, which reads the replies.
+        self._pending.reader = threading.current_thread()
+        self._reconnector.opened()
+
+    def _on_readable(self):
+        """ Called by the loop when the websocket has data. Reads and dispatches one frame. """
+        if not self.is_connected:
+            # closed by the server (on_closed) or by a handler.
+            self._close()
+            self._reconnector.stop()
+            return
+
+        try:
+            data = self._recv_frame()
+        except Exception as e:
+            if _would_block(e):
+                # the rest of the frame is read when the socket is readable again.
+                return
+            log.error('data read error %s: %s' % (self._fails, e), exc_info=True)
+            self._fails += 1
+            if self._fails == 2 or isinstance(e, websocket.WebSocketConnectionClosedException):
+                if pinylib.CONFIG.DEBUG_MODE:
+                    traceback.print_exc()
+                self.reconnect()
+        else:
+            self._fails = 0
+            if data:
+                # frames of other rooms read in the same iteration count towards the lag.
+                self._handle_frame(data, self.loop.polled_at)
+
+    def _recv_frame(self):
+        """
+        Read a frame without blocking the loop.
+
+        The socket is read with a timeout of 0, so a read of a frame that has only partly arrived
+        raises a would block error. The websocket keeps the part read, and the next read continues the frame.
+        Writes keep write_timeout.
+
+        :return: The frame data, or None for a control frame.
+        :rtype: bytes | str | None
+        """
+        sock = self._ws.sock
+        sock.settimeout(0)
+        try:
+            return super(AsyncTinychatRTCClient, self)._recv_frame()
+        finally:
+            sock.settimeout(self.write_timeout)
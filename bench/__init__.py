@@ -0,0 +1,5 @@
+"""
+Benchmarks for pinylib. Run a benchmark from the pinylib folder, e.g python -m bench.dispatch
+
+python -m bench.suite runs the synthetic benchmarks and writes the results as json.
+"""
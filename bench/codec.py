@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+""" Measures the microseconds per frame of each installed json codec on realistic tinychat frames. """
+import timeit
+
+from util import codec
+
+
+def _user(handle):
+    return {
+        'achievement_url': '',
+        'avatar': 'https://avatars.tinychat.com/default/%s.png' % handle,
+        'featured': False,
+        'giftpoints': handle % 50,
+        'handle': handle,
+        'lurker': handle % 7 == 0,
+        'mod': handle % 25 == 0,
+        'nick': u'guest-%s' % handle,
+        'owner': False,
+        'session_id': '%s-%s' % (handle, 'b5a2f'),
+        'subscription': 0,
+        'username': 'account%s' % handle if handle % 3 == 0 else ''
+    }
+
+
+def _ban(ban_id):
+    return {'id': ban_id, 'nick': u'nick%s' % ban_id, 'username': '', 'moderator': 'mod',
+            'reason': '', 'success': True, 'req': ban_id}
+
+
+def frames():
+    """
+    Create the benchmark frames.
+
+    :return: A list of (name, frame) tuples.
+    :rtype: list
+    """
+    return [
+        ('msg', {'tc': 'msg', 'handle': 1234, 'text': u'hello everyone, how are you all doing today? ☺'}),
+        ('ping', {'tc': 'ping'}),
+        ('join', dict(_user(4321), tc='join')),
+        ('userlist 100', {'tc': 'userlist', 'users': [_user(h) for h in range(100)]}),
+        ('userlist 1000', {'tc': 'userlist', 'users': [_user(h) for h in range(1000)]}),
+        ('userlist 5000', {'tc': 'userlist', 'users': [_user(h) for h in range(5000)]}),
+        ('banlist 500', {'tc': 'banlist', 'req': 3, 'success': True, 'items': [_ban(b) for b in range(500)]})
+    ]
+
+
+def _time(fn, arg, min_time=0.2):
+    """ Best microseconds per call, running enough calls to last at least min_time. """
+    number = 1
+    while timeit.timeit(lambda: fn(arg), number=number) < min_time / 5:
+        number *= 10
+    best = min(timeit.repeat(lambda: fn(arg), number=number, repeat=5))
+    return best / number * 1e6
+
+
+def run():
+    """
+    Time loads (from utf-8 bytes, as read from the websocket) and dumps of every frame with every codec.
+
+    :return: A list of (frame name, codec name, loads us, dumps us) tuples.
+    :rtype: list
+    """
+    results = []
+    for name, frame in frames():
+        raw = codec.get_codec('json').dumps(frame).encode('utf-8')
+        for c in codec.available():
+            results.append((name, c.name, _time(c.loads, raw), _time(c.dumps, frame)))
+    return results
+
+
+def main():
+    print ('selected codec: %s' % codec.CODEC.name)
+    print ('%-14s %-11s %12s %12s' % ('frame', 'codec', 'loads us', 'dumps us'))
+    for name, codec_name, loads_us, dumps_us in run():
+        print ('%-14s %-11s %12.2f %12.2f' % (name, codec_name, loads_us, dumps_us))
+
+
+if __name__ == '__main__':
+    main()
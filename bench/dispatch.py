@@ -0,0 +1,189 @@
+""" Measures the per frame cost of dispatching events to their handlers. """
+import random
+import timeit
+
+import pinylib
+
+# Relative frequency of events in a busy room.
+EVENT_MIX = (
+    ('msg', 60),
+    ('ping', 2),
+    ('join', 6),
+    ('quit', 6),
+    ('nick', 4),
+    ('pvtmsg', 4),
+    ('publish', 3),
+    ('unpublish', 3),
+    ('yut_play', 3),
+    ('yut_pause', 2),
+    ('yut_stop', 2),
+    ('sysmsg', 2),
+    ('room_settings', 1),
+    ('stream_moder_close', 1),
+    ('ban', 1)
+)
+
+
+def make_frame(event, handle):
+    """
+    Create a decoded frame for an event.
+
+    :param event: The event name.
+    :type event: str
+    :param handle: The ID (handle) of the user the event is about.
+    :type handle: int
+    :return: The decoded frame.
+    :rtype: dict
+    """
+    item = {'id': 'dQw4w9WgXcQ', 'duration': 212, 'offset': 0, 'title': 'video'}
+    frames = {
+        'msg': {'tc': 'msg', 'handle': handle, 'text': 'hello world'},
+        'ping': {'tc': 'ping'},
+        'join': {'tc': 'join', 'handle': handle, 'nick': 'guest-%s' % handle, 'username': ''},
+        'quit': {'tc': 'quit', 'handle': handle},
+        'nick': {'tc': 'nick', 'handle': handle, 'nick': 'nick-%s' % handle},
+        'pvtmsg': {'tc': 'pvtmsg', 'handle': handle, 'text': 'hi there'},
+        'publish': {'tc': 'publish', 'handle': handle},
+        'unpublish': {'tc': 'unpublish', 'handle': handle},
+        'yut_play': {'tc': 'yut_play', 'handle': handle, 'item': item},
+        'yut_pause': {'tc': 'yut_pause', 'handle': handle, 'item': item},
+        'yut_stop': {'tc': 'yut_stop', 'item': item},
+        'sysmsg': {'tc': 'sysmsg', 'text': 'green room enabled'},
+        'room_settings': {'tc': 'room_settings', 'room': {'topic': ''}},
+        'stream_moder_close': {'tc': 'stream_moder_close', 'handle': handle, 'success': True},
+        'ban': {'tc': 'ban', 'id': handle, 'nick': 'nick', 'success': True}
+    }
+    return frames[event]
+
+
+def event_stream(count, seed=1):
+    """
+    Create a reproducible stream of decoded frames following EVENT_MIX.
+
+    :param count: The number of frames.
+    :type count: int
+    :param seed: The random seed.
+    :type seed: int
+    :return: A list of decoded frames.
+    :rtype: list
+    """
+    rnd = random.Random(seed)
+    population = []
+    for event, weight in EVENT_MIX:
+        population.extend([event] * weight)
+    return [make_frame(rnd.choice(population), rnd.randint(1, 500)) for _ in range(count)]
+
+
+class NullClient(pinylib.TinychatRTCClient):
+    """ A client where every handler does nothing, so only the dispatch is measured. """
+
+    def __init__(self):
+        for _, method_name, _ in pinylib.EVENTS:
+            if not method_name.startswith('_'):
+                setattr(self, method_name, self._noop)
+        # the handlers called by the frame handlers in EVENTS, on_ping would send a pong.
+        for method_name in ('on_ping', 'on_joined', 'on_room_info', 'on_userlist'):
+            setattr(self, method_name, self._noop)
+        super(NullClient, self).__init__('benchmark')
+
+    def _noop(self, *args):
+        pass
+
+
+def legacy_dispatch(client, json_data):
+    """ The if/elif chain dispatch as it was before the event registry. """
+    event = json_data['tc']
+
+    if event == 'ping':
+        client.on_ping()
+    elif event == 'closed':
+        client.on_closed(json_data['error'])
+    elif event == 'joined':
+        client.on_joined(json_data['self'])
+        client.on_room_info(json_data['room'])
+    elif event == 'room_settings':
+        client.on_room_settings(json_data['room'])
+    elif event == 'userlist':
+        for _user in json_data['users']:
+            client.on_userlist(_user)
+    elif event == 'join':
+        client.on_join(json_data)
+    elif event == 'nick':
+        client.on_nick(json_data['handle'], json_data['nick'])
+    elif event == 'quit':
+        client.on_quit(json_data['handle'])
+    elif event == 'ban':
+        client.on_ban(json_data)
+    elif event == 'unban':
+        client.on_unban(json_data)
+    elif event == 'banlist':
+        client.on_banlist(json_data)
+    elif event == 'msg':
+        client.on_msg(json_data['handle'], json_data['text'])
+    elif event == 'pvtmsg':
+        client.on_pvtmsg(json_data['handle'], json_data['text'])
+    elif event == 'publish':
+        client.on_publish(json_data['handle'])
+    elif event == 'unpublish':
+        client.on_unpublish(json_data['handle'])
+    elif event == 'sysmsg':
+        client.on_sysmsg(json_data['text'])
+    elif event == 'password':
+        client.on_password()
+    elif event == 'pending_moderation':
+        client.on_pending_moderation(json_data)
+    elif event == 'stream_moder_allow':
+        client.on_stream_moder_allow(json_data)
+    elif event == 'stream_moder_close':
+        client.on_stream_moder_close(json_data)
+    elif event == 'captcha':
+        client.on_captcha(json_data['key'])
+    elif event == 'yut_playlist':
+        client.on_yut_playlist(json_data)
+    elif event == 'yut_play':
+        client.on_yut_play(json_data)
+    elif event == 'yut_pause':
+        client.on_yut_pause(json_data)
+    elif event == 'yut_stop':
+        client.on_yut_stop(json_data)
+
+
+def run(frames=100000, repeat=7):
+    """
+    Time both dispatch methods over the same stream of frames.
+
+    :param frames: The number of frames in the stream.
+    :type frames: int
+    :param repeat: The number of timing runs, the best is reported.
+    :type repeat: int
+    :return: The nanoseconds per frame for each dispatch method.
+    :rtype: dict
+    """
+    client = NullClient()
+    stream = event_stream(frames)
+
+    def legacy():
+        for json_data in stream:
+            legacy_dispatch(client, json_data)
+
+    def registry():
+        dispatch = client._dispatch
+        for json_data in stream:
+            dispatch(json_data)
+
+    results = {}
+    for name, fn in (('legacy', legacy), ('registry', registry)):
+        best = min(timeit.repeat(fn, number=1, repeat=repeat))
+        results[name] = best / frames * 1e9
+    return results
+
+
+def main():
+    results = run()
+    for name in ('legacy', 'registry'):
+        print ('%-10s %8.1f ns/frame' % (name, results[name]))
+    print ('speedup    %8.2fx' % (results['legacy'] / results['registry']))
+
+
+if __name__ == '__main__':
+    main()
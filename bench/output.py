@@ -0,0 +1,83 @@
+""" Measures the cost of console output, chat logging and debug logging per event. """
+import os
+import sys
+import shutil
+import logging
+import tempfile
+import timeit
+
+import config
+import pinylib
+
+FRAME = b'{"tc":"msg","handle":1234,"text":"hello world, how is everyone doing today?"}'
+
+
+def _best(fn, number=2000, repeat=3):
+    """ Best microseconds per call. """
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+
+def run(number=2000):
+    """
+    Time console_write with and without colors and chat logging, and the debug log call
+    the read loop makes for every frame, with the logger disabled and writing to a file.
+
+    console_write only queues the line, the _written timings include writing it on the log sink thread.
+    Console output goes to os.devnull, so the terminal speed is not measured.
+
+    :param number: The number of calls timed per measurement.
+    :type number: int
+    :return: Microseconds per call of each kind of output.
+    :rtype: dict
+    """
+    client = pinylib.TinychatRTCClient('bench')
+    saved = (sys.stdout, config.CONSOLE_COLORS, config.CHAT_LOGGING, config.CONFIG_PATH)
+    path = tempfile.mkdtemp()
+    devnull = open(os.devnull, 'w')
+    logger = logging.getLogger('pinylib')
+    level = logger.level
+    results = {}
+    try:
+        sys.stdout = devnull
+        config.CONFIG_PATH = path + '/'
+        write = lambda: client.console_write(pinylib.COLOR['cyan'], 'guest-1234:1234 hello world')
+
+        def written():
+            for _ in range(number):
+                write()
+            client.log_sink.flush()
+
+        for name, colors, chat_logging in (('console_write', False, False),
+                                           ('console_write_colors', True, False),
+                                           ('console_write_chat_log', True, True)):
+            config.CONSOLE_COLORS, config.CHAT_LOGGING = colors, chat_logging
+            results[name + '_us'] = _best(write, number)
+            client.log_sink.flush()
+            results[name + '_written_us'] = _best(written, 1) / number
+
+        logger.setLevel(logging.WARNING)
+        results['debug_log_disabled_us'] = _best(lambda: logger.debug('DATA: %s', FRAME), number)
+        handler = logging.FileHandler(os.path.join(path, 'debug.log'))
+        logger.addHandler(handler)
+        logger.setLevel(logging.DEBUG)
+        try:
+            results['debug_log_file_us'] = _best(lambda: logger.debug('DATA: %s', FRAME), number)
+        finally:
+            logger.removeHandler(handler)
+            handler.close()
+    finally:
+        client.log_sink.flush()
+        sys.stdout, config.CONSOLE_COLORS, config.CHAT_LOGGING, config.CONFIG_PATH = saved
+        logger.setLevel(level)
+        devnull.close()
+        shutil.rmtree(path, ignore_errors=True)
+    return results
+
+
+def main():
+    for key, value in sorted(run().items()):
+        print ('%-28s %10.2f' % (key, value))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+"""
+Measures the inbound event pipeline, raw frame to handler, for a room of a given size.
+
+Frames go through _handle_frame, the path the read loop takes for every frame:
+the unsubscribe prefilter, json decoding, dispatch and the default event handlers.
+"""
+import os
+import sys
+import time
+import random
+
+import pinylib
+from mock import protocol
+from bench.dispatch import EVENT_MIX
+from bench.replay import prepare
+
+
+class RoomStream(object):
+    """ Generates raw frames of a room, consistent with the users in it. """
+
+    def __init__(self, room_size=1000, seed=1):
+        """
+        :param room_size: The number of users in the room.
+        :type room_size: int
+        :param seed: The random seed.
+        :type seed: int
+        """
+        self.room_size = room_size
+        self._rnd = random.Random(seed)
+        self._handles = list(range(2, room_size + 2))
+        self._next_handle = room_size + 2
+        self._next_ban = 1
+        self._population = []
+        for event, weight in EVENT_MIX:
+            self._population.extend([event] * weight)
+
+    def userlist(self):
+        """ The userlist frame of the room. """
+        return protocol.encode_event('userlist', users=[self._user(h) for h in self._handles])
+
+    def joined(self):
+        """ The joined frame of the client, handle 1. """
+        client = self._user(1)
+        client['mod'] = True
+        return protocol.encode_event('joined', {'self': client, 'room': {'name': 'bench', 'topic': ''}})
+
+    def frames(self, count):
+        """
+        Create the next frames.
+
+        :param count: The number of frames.
+        :type count: int
+        :return: A list of raw frames.
+        :rtype: list
+        """
+        return [self._next() for _ in range(count)]
+
+    def _user(self, handle):
+        return {'handle': handle, 'nick': 'guest-%s' % handle, 'username': 'acc%s' % handle if handle % 5 else '',
+                'mod': handle % 50 == 0, 'lurker': handle % 7 == 0, 'owner': False}
+
+    def _next(self):
+        event = self._rnd.choice(self._population)
+        handle = self._rnd.choice(self._handles)
+        item = {'id': 'dQw4w9WgXcQ', 'duration': 212, 'offset': 0, 'title': 'video'}
+
+        if event == 'join':
+            handle = self._next_handle
+            self._next_handle += 1
+            self._handles.append(handle)
+            return protocol.encode_event('join', **self._user(handle))
+        if event == 'quit' and len(self._handles) > 1:
+            self._handles.remove(handle)
+            return protocol.encode_event('quit', handle=handle)
+        if event == 'ban':
+            ban_id = self._next_ban
+            self._next_ban += 1
+            return protocol.encode_event('ban', id=ban_id, nick='guest-%s' % handle, username='',
+                                         moderator='bench', reason='', success=True)
+        if event == 'nick':
+            return protocol.encode_event('nick', handle=handle, nick='nick-%s' % self._rnd.randint(1, 1 << 30))
+        if event in ('msg', 'pvtmsg'):
+            return protocol.encode_event(event, handle=handle, text='hello world, how is everyone doing today?')
+        if event in ('yut_play', 'yut_pause'):
+            return protocol.encode_event(event, handle=handle, item=item)
+        if event == 'yut_stop':
+            return protocol.encode_event(event, item=item)
+        if event == 'sysmsg':
+            return protocol.encode_event(event, text='green room enabled')
+        if event == 'room_settings':
+            return protocol.encode_event(event, room={'topic': ''})
+        if event == 'stream_moder_close':
+            return protocol.encode_event(event, handle=handle, success=True)
+        if event == 'ping':
+            return protocol.encode_event('ping')
+        return protocol.encode_event(event, handle=handle)
+
+
+def _client(stream):
+    client = prepare(pinylib.TinychatRTCClient('bench'))
+    client._handle_frame(stream.joined().encode('utf-8'))
+    client._handle_frame(stream.userlist().encode('utf-8'))
+    return client
+
+
+def _cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+
+def run(room_size=1000, frames=50000, rate=None, seed=1):
+    """
+    Feed a stream of raw frames through a client.
+
+    :param room_size: The number of users in the room.
+    :type room_size: int
+    :param frames: The number of frames.
+    :type frames: int
+    :param rate: Frames per second, None to feed them as fast as possible.
+    :type rate: int | float | None
+    :param seed: The random seed.
+    :type seed: int
+    :return: The throughput, or the cpu use and lag at the given rate.
+    :rtype: dict
+    """
+    stream = RoomStream(room_size, seed)
+    client = _client(stream)
+    data = [frame.encode('utf-8') for frame in stream.frames(frames)]
+    handle_frame = client._handle_frame
+
+    started = time.time()
+    cpu_start = _cpu_time()
+    max_lag = 0.0
+    if rate is None:
+        for frame in data:
+            handle_frame(frame)
+    else:
+        interval = 1.0 / rate
+        for i, frame in enumerate(data):
+            due = started + i * interval
+            now = time.time()
+            if now < due:
+                time.sleep(due - now)
+            elif now - due > max_lag:
+                max_lag = now - due
+            handle_frame(frame)
+    duration = time.time() - started
+    cpu = _cpu_time() - cpu_start
+
+    result = {
+        'room_size': room_size,
+        'frames': frames,
+        'seconds': duration,
+        'events_per_second': frames / duration,
+        'us_per_event': duration / frames * 1e6,
+        'users_after': len(client.users.all)
+    }
+    if rate is not None:
+        result.update({'rate': rate, 'cpu_percent': cpu / duration * 100, 'max_lag': max_lag})
+    return result
+
+
+def main():
+    room_size = int(sys.argv[1]) if len(sys.argv) > 1 else 1000
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else None
+    result = run(room_size=room_size, frames=int(rate * 10) if rate else 50000, rate=rate)
+    for key in sorted(result):
+        print ('%-18s %s' % (key, result[key]))
+
+
+if __name__ == '__main__':
+    main()
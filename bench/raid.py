@@ -0,0 +1,100 @@
+""" Measures flood control under a synthetic 1000 messages per second flood. """
+import time
+import random
+
+import flood
+
+# A raid of guests and a few accounts, each user over the limits, and the regular users of the room.
+RULES = [
+    ('user', 'bucket', 1, 1, 'drop'),
+    ('user', 'window', 10, 10, 'kick'),
+    ('account', 'window', 20, 10, 'ban'),
+    ('room', 'window', 100, 5, 'warn')
+]
+
+
+def _messages(rate, seconds, users, raiders, raid_share, rnd):
+    """ (time, handle, account, is raider) of each message, in time order. """
+    messages = []
+    step = 1.0 / rate
+    start = 1500000000.0
+    for i in range(int(rate * seconds)):
+        if rnd.random() < raid_share:
+            handle = users + rnd.randint(1, raiders)
+            account = 'raid%s' % (handle % 10) if handle % 4 == 0 else ''
+            messages.append((start + i * step, handle, account, True))
+        else:
+            handle = rnd.randint(1, users)
+            messages.append((start + i * step, handle, 'acc%s' % handle if handle % 3 == 0 else '', False))
+    return messages
+
+
+def _legacy(messages):
+    """ The one message per second check of on_msg before flood control. """
+    msg_times = {}
+    handled = 0
+    for ts, handle, _, _ in messages:
+        if ts - msg_times.get(handle, 0.0) >= 1:
+            handled += 1
+        msg_times[handle] = ts
+    return handled
+
+
+def run(rate=1000, seconds=60, users=1000, raiders=200, raid_share=0.95, seed=1):
+    """
+    Check a flood of messages, most from raiders, against the rules, and count what gets through.
+
+    :param rate: Messages per second.
+    :type rate: int
+    :param seconds: The length of the flood.
+    :type seconds: int
+    :param users: The number of regular users.
+    :type users: int
+    :param raiders: The number of raiders.
+    :type raiders: int
+    :param raid_share: The share of the messages sent by raiders.
+    :type raid_share: float
+    :param seed: The random seed.
+    :type seed: int
+    :return: Microseconds per check, the share of messages handled, and the actions taken.
+    :rtype: dict
+    """
+    rnd = random.Random(seed)
+    messages = _messages(rate, seconds, users, raiders, raid_share, rnd)
+    results = {'messages': len(messages)}
+
+    started = time.time()
+    _legacy(messages)
+    results['legacy_us'] = (time.time() - started) / len(messages) * 1e6
+
+    for name, rules, max_keys in (('default', [('user', 'bucket', 1, 1, 'drop'), ('room', 'window', 100, 5, 'warn')],
+                                   10000),
+                                  ('raid', RULES, 10000),
+                                  ('raid_small', RULES, 100)):
+        control = flood.FloodControl(rules, max_keys=max_keys, idle=300, cooldown=10)
+        handled = {True: 0, False: 0}
+        sent = {True: 0, False: 0}
+        check = control.check
+        started = time.time()
+        for ts, handle, account, raider in messages:
+            verdict = check(handle, account, ts)
+            sent[raider] += 1
+            if verdict is None or verdict[0] == flood.ACTION_WARN:
+                handled[raider] += 1
+        results[name + '_us'] = (time.time() - started) / len(messages) * 1e6
+        results[name + '_raid_handled'] = float(handled[True]) / max(1, sent[True])
+        results[name + '_regular_handled'] = float(handled[False]) / max(1, sent[False])
+        stats = control.stats
+        results[name + '_keys'] = stats['keys']
+        for action, count in stats['actions'].items():
+            results['%s_%s' % (name, action)] = count
+    return results
+
+
+def main():
+    for key, value in sorted(run().items()):
+        print ('%-28s %12.3f' % (key, value))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+""" Measures duplicate detection with 10k chat messages per minute, a share of them from a raid. """
+import time
+import random
+
+import duplicates
+
+TEMPLATES = [
+    'join the best room on the site, free cams all night',
+    'this room is dead, everyone come to our room instead',
+    'click the link in my profile for free gift points',
+    'the owner of this room is a fraud, everyone leave now',
+    'raid raid raid, this room has been taken over by us'
+]
+
+
+def _mutate(text, rnd):
+    """ Change a raid message a little, like raid bots do. """
+    words = text.split()
+    change = rnd.randint(0, 3)
+    if change == 0:
+        words[rnd.randrange(len(words))] = words[rnd.randrange(len(words))].upper()
+    elif change == 1:
+        i = rnd.randrange(len(words))
+        words[i] = words[i] + rnd.choice('!?.,')
+    elif change == 2:
+        words.append(str(rnd.randint(1, 9999)))
+    else:
+        i = rnd.randrange(len(words))
+        word = words[i]
+        j = rnd.randrange(len(word))
+        words[i] = word[:j] + rnd.choice('abcdefghijklmnopqrstuvwxyz') + word[j + 1:]
+    return ' '.join(words)
+
+
+def run(per_minute=10000, minutes=10, raid_share=0.2, users=2000, seed=1):
+    """
+    Check a stream of regular and raid messages. Every raid message is sent by a new handle.
+
+    :param per_minute: Messages per minute.
+    :type per_minute: int
+    :param minutes: Minutes of messages.
+    :type minutes: int
+    :param raid_share: The share of raid messages.
+    :type raid_share: float
+    :param users: The number of regular users.
+    :type users: int
+    :param seed: The random seed.
+    :type seed: int
+    :return: Microseconds per message, the share of raid and regular messages flagged, and the state kept.
+    :rtype: dict
+    """
+    rnd = random.Random(seed)
+    vocabulary = [''.join(rnd.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rnd.randint(2, 8)))
+                  for _ in range(3000)]
+    count = per_minute * minutes
+    step = 60.0 / per_minute
+    messages = []
+    raider = users
+    for i in range(count):
+        if rnd.random() < raid_share:
+            raider += 1
+            messages.append((1500000000.0 + i * step, raider, _mutate(rnd.choice(TEMPLATES), rnd), True))
+        else:
+            text = ' '.join(rnd.choice(vocabulary) for _ in range(rnd.randint(2, 12)))
+            messages.append((1500000000.0 + i * step, rnd.randint(1, users), text, False))
+
+    detector = duplicates.DuplicateDetector(min_handles=3, window=60, max_messages=20000)
+    flagged = {True: 0, False: 0}
+    sent = {True: 0, False: 0}
+    most = 0
+    started = time.time()
+    for ts, handle, text, raid in messages:
+        sent[raid] += 1
+        if detector.check(handle, text, ts) is not None:
+            flagged[raid] += 1
+        if len(detector) > most:
+            most = len(detector)
+    elapsed = time.time() - started
+
+    stats = detector.stats
+    return {
+        'messages': count,
+        'check_us': elapsed / count * 1e6,
+        'cpu_share': elapsed / (minutes * 60.0),
+        'raid_flagged': float(flagged[True]) / max(1, sent[True]),
+        'regular_flagged': float(flagged[False]) / max(1, sent[False]),
+        'near_matches': stats['near_matches'],
+        'exact_matches': stats['exact_matches'],
+        'max_messages_kept': most,
+        'bands': stats['bands']
+    }
+
+
+def main():
+    for key, value in sorted(run().items()):
+        print ('%-28s %12.4f' % (key, value))
+
+
+if __name__ == '__main__':
+    main()
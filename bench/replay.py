@@ -0,0 +1,145 @@
+"""
+Replays a frame recording through the dispatch and event handlers of a client.
+
+Record frames with TinychatRTCClient.start_recording (or RECORD_FRAMES in config), then
+e.g python -m bench.replay rooms/myroom/recordings/2020-01-01_12-00-00.rec
+"""
+import time
+import argparse
+
+import pinylib
+import recorder
+from util import codec
+
+
+class _NullSocket(object):
+    """ Discards the messages sent by the handlers. """
+    connected = True
+
+    def send(self, data):
+        pass
+
+
+class _NullEnricher(object):
+    """ Skips the profile lookups of joining users. """
+
+    def submit(self, _user, callback=None):
+        return False
+
+
+def prepare(client, quiet=True):
+    """
+    Make a client safe to replay into. Nothing is sent or fetched.
+
+    :param client: The client.
+    :type client: pinylib.TinychatRTCClient
+    :param quiet: Do not write to the console.
+    :type quiet: bool
+    :return: The client.
+    :rtype: pinylib.TinychatRTCClient
+    """
+    client._ws = _NullSocket()
+    client._writer = None
+    client.is_connected = True
+    client.enricher = _NullEnricher()
+    if quiet:
+        client.console_write = lambda color, message: None
+    return client
+
+
+def _percentile(ordered, percent):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percent / 100.0))]
+
+
+def replay(file_name, client=None, realtime=False):
+    """
+    Feed the inbound frames of a recording to a client, timing the handling of each frame.
+
+    :param file_name: The path and file name of the recording.
+    :type file_name: str
+    :param client: The client, prepared with prepare. If None a quiet TinychatRTCClient is used.
+    :type client: pinylib.TinychatRTCClient | None
+    :param realtime: Replay at the recorded speed, instead of as fast as possible.
+    :type realtime: bool
+    :return: The replay stats. Handler latency is in microseconds.
+    :rtype: dict
+    """
+    if client is None:
+        client = prepare(pinylib.TinychatRTCClient('replay'))
+
+    latencies = {}
+    frames = 0
+    skipped = 0
+    handle_frame = client._handle_frame
+    started = time.time()
+    offset = None
+    last = 0.0
+    for direction, seconds, data in recorder.read_recording(file_name):
+        if direction != recorder.INBOUND:
+            skipped += 1
+            continue
+
+        if realtime:
+            if offset is None or seconds < last:
+                # the first frame, or the start of an appended session.
+                offset = time.time() - seconds
+            last = seconds
+            wait = offset + seconds - time.time()
+            if wait > 0:
+                time.sleep(wait)
+
+        event = pinylib.peek_event(data)
+        if event is None:
+            # not in the compact form tinychat sends, decoded outside the timing.
+            event = codec.loads(data).get('tc', '?').encode('utf-8')
+        t = time.time()
+        handle_frame(data)
+        elapsed = time.time() - t
+
+        frames += 1
+        if event in latencies:
+            latencies[event].append(elapsed)
+        else:
+            latencies[event] = [elapsed]
+
+    duration = time.time() - started
+    events = {}
+    for event, times in latencies.items():
+        times.sort()
+        name = event.decode('utf-8')
+        events[name] = {
+            'count': len(times),
+            'avg_us': sum(times) / len(times) * 1e6,
+            'p50_us': _percentile(times, 50) * 1e6,
+            'p99_us': _percentile(times, 99) * 1e6,
+            'max_us': times[-1] * 1e6
+        }
+    return {
+        'frames': frames,
+        'outbound_skipped': skipped,
+        'seconds': duration,
+        'events_per_second': frames / duration if duration else 0.0,
+        'events': events
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay a frame recording through the event handlers.')
+    parser.add_argument('file_name', help='the recording')
+    parser.add_argument('--realtime', action='store_true', help='replay at the recorded speed')
+    parser.add_argument('--verbose', action='store_true', help='let the handlers write to the console')
+    args = parser.parse_args()
+
+    client = prepare(pinylib.TinychatRTCClient('replay'), quiet=not args.verbose)
+    stats = replay(args.file_name, client=client, realtime=args.realtime)
+
+    print ('%s frames in %.2f seconds, %.0f events/s' %
+           (stats['frames'], stats['seconds'], stats['events_per_second']))
+    print ('%-20s %8s %10s %10s %10s %10s' % ('event', 'count', 'avg us', 'p50 us', 'p99 us', 'max us'))
+    for name, s in sorted(stats['events'].items(), key=lambda item: -item[1]['count']):
+        print ('%-20s %8s %10.1f %10.1f %10.1f %10.1f' %
+               (name, s['count'], s['avg_us'], s['p50_us'], s['p99_us'], s['max_us']))
+
+
+if __name__ == '__main__':
+    main()
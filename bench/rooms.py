@@ -0,0 +1,146 @@
+"""
+Compares memory and CPU use of N rooms with the threaded client and the event loop client.
+
+Each client type runs in its own process, connected to a local mock server,
+e.g python -m bench.rooms 300 20 0.5 (rooms, seconds, seconds between messages per room)
+"""
+import os
+import sys
+import time
+import threading
+import multiprocessing
+
+try:
+    import resource
+except ImportError:  # windows
+    resource = None
+
+import pinylib
+import rtc_cache
+import async_client
+import apis.tinychat
+from mock import MockServer, MessageStorm
+
+
+def _serve(port, msg_interval):
+    MockServer(port=port, scenarios=[MessageStorm(rate=1.0 / msg_interval, users=100)]).serve_forever()
+
+
+def _quiet(base):
+    """ Create a client class counting frames instead of writing to the console. """
+
+    class QuietClient(base):
+        frames = 0
+
+        def console_write(self, color, message):
+            pass
+
+        def _handle_frame(self, data, received=None):
+            self.frames += 1
+            super(QuietClient, self)._handle_frame(data, received)
+
+    return QuietClient
+
+
+def _cpu_time():
+    t = os.times()
+    return t[0] + t[1]
+
+
+def _run_rooms(mode, rooms, duration, url, results):
+    apis.tinychat.BASE_URL = url
+    # not persisting the mock version.
+    rtc_cache._shared = rtc_cache.RtcVersionCache(file_path=None)
+
+    if mode == 'threaded':
+        client_class = _quiet(pinylib.TinychatRTCClient)
+        clients = [client_class(room='room%s' % i, nickname='bench') for i in range(rooms)]
+        for client in clients:
+            t = threading.Thread(target=client.connect)
+            t.daemon = True
+            t.start()
+    else:
+        client_class = _quiet(async_client.AsyncTinychatRTCClient)
+        clients = [client_class(room='room%s' % i, nickname='bench') for i in range(rooms)]
+        loop = async_client.EventLoop()
+        for client in clients:
+            loop.add(client)
+        t = threading.Thread(target=loop.run)
+        t.daemon = True
+        t.start()
+
+    deadline = time.time() + 60
+    while sum(c.is_connected for c in clients) < rooms and time.time() < deadline:
+        time.sleep(0.1)
+    connected = sum(c.is_connected for c in clients)
+    # let the joined and userlist frames of the last rooms settle.
+    time.sleep(3)
+
+    frames_start = sum(c.frames for c in clients)
+    cpu_start = _cpu_time()
+    time.sleep(duration)
+    cpu = _cpu_time() - cpu_start
+    frames = sum(c.frames for c in clients) - frames_start
+
+    results.put({
+        'mode': mode,
+        'connected': connected,
+        'threads': threading.active_count(),
+        'max_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss if resource else None,
+        'cpu_seconds': cpu,
+        'cpu_percent': cpu / duration * 100,
+        'frames_per_second': frames / float(duration)
+    })
+    results.close()
+    results.join_thread()
+    # the client threads block on reads, so skip the interpreter shutdown.
+    os._exit(0)
+
+
+def run(rooms=100, duration=10, msg_interval=0.5, port=18765):
+    """
+    Run both client types against the mock server.
+
+    :param rooms: The number of rooms to connect.
+    :type rooms: int
+    :param duration: Seconds to measure, after all rooms have connected.
+    :type duration: int
+    :param msg_interval: Seconds between chat messages sent to each room.
+    :type msg_interval: float
+    :param port: The mock server port.
+    :type port: int
+    :return: A list with the results for each client type.
+    :rtype: list
+    """
+    server = multiprocessing.Process(target=_serve, args=(port, msg_interval))
+    server.daemon = True
+    server.start()
+    time.sleep(0.5)
+    url = 'http://127.0.0.1:%s' % port
+
+    results = []
+    try:
+        for mode in ('threaded', 'async'):
+            queue = multiprocessing.Queue()
+            p = multiprocessing.Process(target=_run_rooms, args=(mode, rooms, duration, url, queue))
+            p.start()
+            results.append(queue.get(timeout=duration + 120))
+            p.join()
+    finally:
+        server.terminate()
+    return results
+
+
+def main():
+    rooms = int(sys.argv[1]) if len(sys.argv) > 1 else 100
+    duration = int(sys.argv[2]) if len(sys.argv) > 2 else 10
+    msg_interval = float(sys.argv[3]) if len(sys.argv) > 3 else 0.5
+    print ('%s rooms, %s seconds, %s seconds between messages' % (rooms, duration, msg_interval))
+    print ('%-9s %9s %8s %12s %8s %10s' % ('mode', 'connected', 'threads', 'max rss kb', 'cpu %', 'frames/s'))
+    for r in run(rooms=rooms, duration=duration, msg_interval=msg_interval):
+        print ('%-9s %9s %8s %12s %8.1f %10.1f' % (r['mode'], r['connected'], r['threads'], r['max_rss_kb'],
+                                                   r['cpu_percent'], r['frames_per_second']))
+
+
+if __name__ == '__main__':
+    main()
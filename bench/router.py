@@ -0,0 +1,66 @@
+""" Measures command lookup in the command router, against an if chain over the command names. """
+import random
+import timeit
+
+import command_router
+import user
+
+
+def _best(fn, number, repeat=3):
+    """ Best microseconds per call. """
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+
+def run(sizes=(10, 150, 1000), number=20000, seed=1):
+    """
+    Time dispatching commands and plain messages, for routers of several sizes.
+
+    The chain is what a bot message_handler does, split the message and compare the command to each name.
+
+    :param sizes: The numbers of commands.
+    :type sizes: tuple
+    :param number: Messages timed per measurement.
+    :type number: int
+    :param seed: The random seed.
+    :type seed: int
+    :return: Microseconds per message, and per lookup of a command name, by number of commands.
+    :rtype: dict
+    """
+    rnd = random.Random(seed)
+    sender = user.User(handle=1, nick='bench')
+    results = {}
+    for size in sizes:
+        names = set()
+        while len(names) < size:
+            names.add(''.join(rnd.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rnd.randint(2, 8))))
+        names = sorted(names)
+        router = command_router.CommandRouter(prefix='!')
+        for name in names:
+            router.add(name, lambda _user, *args: None, args=(command_router.REST,), required=0)
+        messages = ['!%s some arguments here' % rnd.choice(names) for _ in range(1000)]
+
+        def chain(msg):
+            parts = msg.split(' ')
+            cmd = parts[0].lower().strip()
+            for name in names:
+                if cmd == '!' + name:
+                    return True
+            return False
+
+        routed = iter(messages * (number // 100))
+        chained = iter(messages * (number // 100))
+        results['router_%s_us' % size] = _best(lambda: router.dispatch(sender, next(routed)), number)
+        results['chain_%s_us' % size] = _best(lambda: chain(next(chained)), number)
+        words = iter([msg[1:].split(' ', 1)[0] for msg in messages] * (number // 100))
+        results['resolve_%s_us' % size] = _best(lambda: router.resolve(next(words)), number)
+        results['router_%s_message_us' % size] = _best(lambda: router.dispatch(sender, 'just chatting'), number)
+    return results
+
+
+def main():
+    for key, value in sorted(run().items()):
+        print ('%-28s %10.3f' % (key, value))
+
+
+if __name__ == '__main__':
+    main()
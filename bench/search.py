@@ -0,0 +1,133 @@
+""" Measures the size of the full text index, and the time to index and to query messages. """
+import random
+import itertools
+import shutil
+import timeit
+import tempfile
+
+import text_index
+
+
+def _words(size, rnd):
+    """ A vocabulary, and zipf like weights for picking words from it. """
+    words = []
+    letters = 'abcdefghijklmnopqrstuvwxyz'
+    for i in range(size):
+        words.append(''.join(rnd.choice(letters) for _ in range(rnd.randint(2, 9))))
+    weights = [1.0 / (rank + 1) for rank in range(size)]
+    return words, weights
+
+
+def _best(fn, number, repeat=3):
+    """ Best microseconds per call. """
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+
+def run(messages=100000, rooms=20, nicks=2000, vocabulary=20000, days=30, queries=200, seed=1):
+    """
+    Index synthetic chat messages spread over rooms and days, and time term, phrase and filtered queries.
+
+    Messages are indexed into one segment per day, like a bot writing the index over a month,
+    and the queries are timed again after the segments are merged.
+
+    :param messages: The number of messages.
+    :type messages: int
+    :param rooms: The number of rooms.
+    :type rooms: int
+    :param nicks: The number of users.
+    :type nicks: int
+    :param vocabulary: The number of distinct words.
+    :type vocabulary: int
+    :param days: The days the messages are spread over.
+    :type days: int
+    :param queries: The number of queries timed per kind.
+    :type queries: int
+    :param seed: The random seed.
+    :type seed: int
+    :return: The index size and microseconds per message or query.
+    :rtype: dict
+    """
+    rnd = random.Random(seed)
+    words, weights = _words(vocabulary, rnd)
+    cumulative = []
+    total = 0
+    for weight in weights:
+        total += weight
+        cumulative.append(total)
+
+    def pick():
+        x = rnd.random() * total
+        lo, hi = 0, len(cumulative) - 1
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if cumulative[mid] < x:
+                lo = mid + 1
+            else:
+                hi = mid
+        return words[lo]
+
+    start = 1500000000.0
+    step = days * 86400.0 / messages
+    docs = []
+    for i in range(messages):
+        text = ' '.join(pick() for _ in range(rnd.randint(3, 15)))
+        docs.append(('room%s' % rnd.randint(1, rooms), start + i * step, 'nick%s' % rnd.randint(1, nicks),
+                     'acc%s' % rnd.randint(1, nicks), text))
+    raw = sum(len(doc[4]) for doc in docs)
+
+    # common and rare terms, and phrases of two words taken from the messages.
+    common = words[:50]
+    rare = words[vocabulary // 2:]
+    phrases = []
+    for doc in docs[::max(1, messages // queries)][:queries]:
+        tokens = doc[4].split()
+        phrases.append('"%s %s"' % (tokens[0], tokens[1]))
+    last_week = start + (days - 7) * 86400.0
+
+    path = tempfile.mkdtemp()
+    results = {'messages': messages, 'raw_bytes': raw}
+    try:
+        index = text_index.InvertedIndex(path, flush_docs=messages + 1, flush_interval=float('inf'),
+                                           merge_factor=0)
+        per_day = messages // days
+
+        def build():
+            for i, doc in enumerate(docs):
+                index.add(*doc)
+                if (i + 1) % per_day == 0:
+                    index.flush()
+            index.flush()
+
+        results['add_us'] = min(timeit.repeat(build, number=1, repeat=1)) / messages * 1e6
+
+        def timings(prefix):
+            terms = (rnd.choice(rare) for _ in itertools.count())
+            pairs = ('%s %s' % (rnd.choice(common), rnd.choice(common)) for _ in itertools.count())
+            phrase = itertools.cycle(phrases)
+            results[prefix + 'rare_term_us'] = _best(lambda: index.query(next(terms)), queries)
+            results[prefix + 'common_terms_us'] = _best(lambda: index.query(next(pairs)), queries)
+            results[prefix + 'phrase_us'] = _best(lambda: index.query(next(phrase)), queries)
+            results[prefix + 'filtered_us'] = _best(
+                lambda: index.query(next(pairs), rooms=['room1'], start=last_week), queries)
+
+        timings('')
+        stats = index.stats
+        results['segments'] = stats['segments']
+        results['index_bytes'] = stats['bytes']
+        results['merge_s'] = min(timeit.repeat(index.merge, number=1, repeat=1))
+        timings('merged_')
+        results['merged_index_bytes'] = index.stats['bytes']
+        results['bytes_per_message'] = float(results['merged_index_bytes']) / messages
+        index.close()
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+    return results
+
+
+def main():
+    for key, value in sorted(run().items()):
+        print ('%-28s %14.2f' % (key, value))
+
+
+if __name__ == '__main__':
+    main()
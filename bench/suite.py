@@ -0,0 +1,142 @@
+"""
+Runs the synthetic benchmarks and writes the results as json, to compare runs across commits.
+
+e.g python -m bench.suite -o before.json, then after a change python -m bench.suite -o after.json
+and python -m bench.suite --compare before.json after.json
+"""
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+
+from util import codec
+from bench import dispatch, pipeline, users, output, search, raid, raid_text, router, word_filter
+
+
+def _commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.STDOUT).decode('utf-8').strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes=(10000, 100000), room_sizes=(100, 1000, 10000), rates=(), frames=50000, messages=100000, log=None):
+    """
+    Run the benchmarks.
+
+    :param sizes: The Users sizes.
+    :type sizes: tuple
+    :param room_sizes: The room sizes of the event pipeline benchmark.
+    :type room_sizes: tuple
+    :param rates: Events per second to measure the pipeline cpu use at, in a room of 1000 users.
+    :type rates: tuple
+    :param frames: The number of frames of the event pipeline benchmark.
+    :type frames: int
+    :param messages: The number of messages of the full text index benchmark.
+    :type messages: int
+    :param log: Called with a progress message.
+    :type log: callable | None
+    :return: The run info and the results of each benchmark.
+    :rtype: dict
+    """
+    log = log or (lambda message: None)
+    results = {
+        'commit': _commit(),
+        'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'codec': codec.CODEC.name,
+        'benchmarks': {}
+    }
+    benchmarks = results['benchmarks']
+
+    log('dispatch')
+    benchmarks['dispatch'] = dispatch.run()
+    for room_size in room_sizes:
+        log('pipeline, %s users' % room_size)
+        benchmarks['pipeline_%s' % room_size] = pipeline.run(room_size=room_size, frames=frames)
+    for rate in rates:
+        log('pipeline, %s events/s' % rate)
+        benchmarks['pipeline_rate_%s' % rate] = pipeline.run(room_size=1000, frames=int(rate * 5), rate=rate)
+    for size in sizes:
+        log('users, %s users' % size)
+        benchmarks['users_%s' % size] = users.run(size=size)
+    log('user roles')
+    benchmarks['user_roles'] = users.run_roles()
+    log('output')
+    benchmarks['output'] = output.run()
+    log('search, %s messages' % messages)
+    benchmarks['search'] = search.run(messages=messages)
+    log('flood control')
+    benchmarks['flood'] = raid.run()
+    log('commands')
+    benchmarks['commands'] = router.run()
+    log('duplicates')
+    benchmarks['duplicates'] = raid_text.run()
+    log('content filter')
+    benchmarks['content_filter'] = word_filter.run()
+    return results
+
+
+def compare(before, after):
+    """
+    Compare the numeric results of two runs.
+
+    :param before: The results of the first run.
+    :type before: dict
+    :param after: The results of the second run.
+    :type after: dict
+    :return: A list of (benchmark, metric, before, after, after / before) tuples.
+    :rtype: list
+    """
+    rows = []
+    for name in sorted(before['benchmarks']):
+        if name not in after['benchmarks']:
+            continue
+        a, b = before['benchmarks'][name], after['benchmarks'][name]
+        for metric in sorted(a):
+            if metric in b and isinstance(a[metric], float) and isinstance(b[metric], float):
+                rows.append((name, metric, a[metric], b[metric], b[metric] / a[metric] if a[metric] else None))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the pinylib benchmarks.')
+    parser.add_argument('-o', '--output', help='write the json results to a file, instead of stdout')
+    parser.add_argument('--quick', action='store_true', help='smaller sizes, for a fast check')
+    parser.add_argument('--rates', default='', help='comma separated events/s to measure cpu use at')
+    parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'), help='compare two result files')
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            before = json.load(f)
+        with open(args.compare[1]) as f:
+            after = json.load(f)
+        print ('%s -> %s' % (before.get('commit'), after.get('commit')))
+        for name, metric, a, b, ratio in compare(before, after):
+            print ('%-20s %-30s %14.3f %14.3f %8s' % (name, metric, a, b, '%.2fx' % ratio if ratio else '-'))
+        return
+
+    rates = tuple(float(r) for r in args.rates.split(',') if r)
+    log = lambda message: sys.stderr.write(message + '\n')
+    if args.quick:
+        results = run(sizes=(10000,), room_sizes=(1000,), rates=rates, frames=10000, messages=20000,
+                      log=log)
+    else:
+        results = run(rates=rates, log=log)
+
+    text = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print (text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+""" Measures the user registry and the banlist of user.Users, for rooms of 10k to 100k users. """
+import sys
+import random
+import timeit
+
+import user
+
+
+def _user_info(handle):
+    return {'handle': handle, 'nick': 'guest-%s' % handle, 'username': 'acc%s' % handle if handle % 5 else '',
+            'mod': handle % 50 == 0, 'lurker': handle % 7 == 0, 'owner': False}
+
+
+def _ban_info(ban_id):
+    return {'id': ban_id, 'nick': 'banned-%s' % (ban_id % 1000), 'username': '', 'moderator': 'bench',
+            'reason': '', 'success': True, 'req': ban_id}
+
+
+def _best(fn, number, repeat=3):
+    """ Best microseconds per call. """
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+
+def run(size=10000, bans=1000, lookups=1000, seed=1):
+    """
+    Time the Users operations at a room size.
+
+    :param size: The number of users.
+    :type size: int
+    :param bans: The number of banlist entries.
+    :type bans: int
+    :param lookups: The number of searches timed per method.
+    :type lookups: int
+    :param seed: The random seed.
+    :type seed: int
+    :return: Microseconds per call of each operation.
+    :rtype: dict
+    """
+    rnd = random.Random(seed)
+    infos = [_user_info(h) for h in range(1, size + 1)]
+    handles = [rnd.randint(1, size) for _ in range(lookups)]
+    nicks = ['guest-%s' % h for h in handles]
+    ban_ids = [rnd.randint(1, bans) for _ in range(lookups)]
+    ban_nicks = ['banned-%s' % (b % 1000) for b in ban_ids]
+
+    users = user.Users()
+
+    def add():
+        users.clear()
+        for info in infos:
+            users.add(info)
+
+    def delete():
+        for info in infos:
+            users.delete(info['handle'])
+
+    results = {'size': size, 'bans': bans}
+    # add and delete are timed per user, over the whole room.
+    results['add_us'] = min(timeit.repeat(add, number=1, repeat=3)) / size * 1e6
+    times = []
+    for _ in range(3):
+        add()
+        times.append(timeit.timeit(delete, number=1))
+    results['delete_us'] = min(times) / size * 1e6
+
+    add()
+    results['search_us'] = _best(lambda: [users.search(h) for h in handles], 1) / lookups
+    nick_lookups = nicks[:max(1, lookups // 10)]
+    results['search_by_nick_us'] = _best(lambda: [users.search_by_nick(n) for n in nick_lookups], 1) / \
+        len(nick_lookups)
+    folded = [n.upper() for n in nicks]
+    results['search_by_nick_ignore_case_us'] = _best(
+        lambda: [users.search_by_nick(n, ignore_case=True) for n in folded], 1) / lookups
+    accounts = ['ACC%s' % h for h in handles]
+    results['search_by_account_us'] = _best(lambda: [users.search_by_account(a) for a in accounts], 1) / lookups
+    results['mods_us'] = _best(lambda: users.mods, 5)
+    results['norms_us'] = _best(lambda: users.norms, 5)
+    results['lurkers_us'] = _best(lambda: users.lurkers, 5)
+    results['signed_in_us'] = _best(lambda: users.signed_in, 5)
+
+    for ban_id in range(1, bans + 1):
+        users.add_banned_user(_ban_info(ban_id))
+    results['search_banlist_us'] = _best(lambda: [users.search_banlist(b) for b in ban_ids], 1) / lookups
+    ban_nick_lookups = ban_nicks[:max(1, lookups // 10)]
+    results['search_banlist_by_nick_us'] = _best(
+        lambda: [users.search_banlist_by_nick(n) for n in ban_nick_lookups], 1) / len(ban_nick_lookups)
+    req_lookups = ban_ids[:len(ban_nick_lookups)]
+    results['search_banlist_by_req_id_us'] = _best(
+        lambda: [users.search_banlist_by_req_id(r) for r in req_lookups], 1) / len(req_lookups)
+    return results
+
+
+def _scan(users, test):
+    """ A role list the way Users built one before the role views, by walking every user. """
+    _found = []
+    for handle in users.all:
+        if test(users.all[handle]):
+            _found.append(users.all[handle])
+    return _found
+
+
+def run_roles(size=5000, seed=1):
+    """
+    Time the role views against walking the users for each role, and the cost of a role change.
+
+    :param size: The number of users.
+    :type size: int
+    :param seed: The random seed.
+    :type seed: int
+    :return: Microseconds per call of each role, by the view and by a walk.
+    :rtype: dict
+    """
+    rnd = random.Random(seed)
+    users = user.Users()
+    for h in range(1, size + 1):
+        users.add(_user_info(h))
+    results = {'size': size}
+    for name, test in user._ROLES:
+        view = getattr(users, name)
+        results['%s_len_us' % name] = _best(lambda: len(getattr(users, name)), 10000)
+        results['%s_scan_len_us' % name] = _best(lambda: len(_scan(users, test)), 5)
+        results['%s_iter_us' % name] = _best(lambda: [u for u in getattr(users, name)], 5)
+        results['%s_scan_iter_us' % name] = _best(lambda: [u for u in _scan(users, test)], 5)
+        results['%s_count' % name] = len(view)
+
+    handles = [rnd.randint(1, size) for _ in range(1000)]
+
+    def publish():
+        for h in handles:
+            u = users.search(h)
+            u.is_broadcasting = True
+            u.is_broadcasting = False
+
+    results['publish_unpublish_us'] = _best(publish, 1) / len(handles)
+    return results
+
+
+def main():
+    sizes = [int(s) for s in sys.argv[1:]] or [10000, 100000]
+    for size in sizes:
+        result = run(size=size)
+        print ('%s users' % size)
+        for key in sorted(result):
+            if key.endswith('_us'):
+                print ('  %-30s %12.3f' % (key, result[key]))
+    result = run_roles()
+    print ('roles, %s users' % result['size'])
+    for key in sorted(result):
+        if key.endswith('_us'):
+            print ('  %-30s %12.3f' % (key, result[key]))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+""" Measures the content filter against a loop over the word list, for lists of 100 to 10k words. """
+import re
+import random
+import timeit
+
+import content_filter
+
+
+def _word(rnd):
+    return ''.join(rnd.choice('abcdefghijklmnopqrstuvwxyz') for _ in range(rnd.randint(4, 10)))
+
+
+def _best(fn, number, repeat=3):
+    """ Best microseconds per call. """
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+
+def run(sizes=(100, 1000, 10000), messages=1000, seed=1):
+    """
+    Time the content filter and a loop over the list, per message, at each list size.
+
+    Lists are one fifth phrases of two words. Messages are 5 to 20 words, one in ten has a listed word,
+    and one in ten has an accent.
+
+    :param sizes: The list sizes.
+    :type sizes: tuple
+    :param messages: The number of messages timed.
+    :type messages: int
+    :param seed: The random seed.
+    :type seed: int
+    :return: Microseconds per message of the filter and the loop, and the build time, per list size.
+    :rtype: dict
+    """
+    rnd = random.Random(seed)
+    vocabulary = [_word(rnd) for _ in range(5000)]
+    results = {}
+    for size in sizes:
+        words = []
+        for i in range(size):
+            words.append(_word(rnd) if i % 5 else '%s %s' % (_word(rnd), _word(rnd)))
+        texts = []
+        for i in range(messages):
+            text = [rnd.choice(vocabulary) for _ in range(rnd.randint(5, 20))]
+            if i % 10 == 0:
+                text.insert(rnd.randint(0, len(text)), rnd.choice(words))
+            if i % 10 == 5:
+                text.append(u'caf\xe9')
+            texts.append(u' '.join(text))
+
+        cf = content_filter.ContentFilter(reload_interval=0)
+        cf.set_list('bench', words)
+        results['build_%s_s' % size] = min(timeit.repeat(lambda: (cf.set_list('bench', words), cf.build()),
+                                                          number=1, repeat=3))
+        found = [0]
+
+        def filtered():
+            for text in texts:
+                if cf.search(text):
+                    found[0] += 1
+
+        results['filter_%s_us' % size] = _best(filtered, 1) / messages
+        results['filter_%s_matched' % size] = found[0] / 3.0
+
+        # the loop a bot does today, a word boundary regex per word.
+        patterns = [re.compile(r'\b%s\b' % re.escape(word), re.IGNORECASE) for word in words]
+
+        def looped():
+            for text in texts[:100]:
+                for pattern in patterns:
+                    if pattern.search(text):
+                        break
+
+        results['loop_%s_us' % size] = _best(looped, 1, repeat=1) / 100
+    return results
+
+
+def main():
+    for key, value in sorted(run().items()):
+        print ('%-28s %12.3f' % (key, value))
+
+
+if __name__ == '__main__':
+    main()
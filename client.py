@@ -2,6 +2,7 @@ import logging
 import threading
 import time
 import pinylib
+import command_router
 
 log = logging.getLogger(__name__)
 
@@ -46,46 +47,61 @@ def main():
     while not client.is_connected:
         time.sleep(2)
 
+    console = console_commands(client)
     while client.is_connected:
         chat_msg = raw_input()
         if chat_msg.startswith('/'):
-            msg_parts = chat_msg.split(' ')
-            cmd = msg_parts[0].lower().strip()
-            if cmd == '/q':
-                client.disconnect()
-            elif cmd == '/a':
-                if len(client.users.signed_in) == 0:
-                    print ('No signed in users in the room.')
-                else:
-                    for user in client.users.signed_in:
-                        print ('%s:%s' % (user.nick, user.account))
-            elif cmd == '/u':
-                for user in client.users.all:
-                    print ('%s: %s' % (client.users.all[user].nick, client.users.all[user].user_level))
-            elif cmd == '/m':
-                if len(client.users.mods) == 0:
-                    print ('No moderators in the room.')
-                else:
-                    for mod in client.users.mods:
-                        print (mod.nick)
-            elif cmd == '/n':
-                if len(client.users.norms) == 0:
-                    print ('No normal users in the room.')
-                else:
-                    for norm in client.users.norms:
-                        print (norm.nick)
-            elif cmd == '/l':
-                if len(client.users.lurkers) == 0:
-                    print ('No lurkers in the room.')
-                else:
-                    for lurker in client.users.lurkers:
-                        print (lurker.nick)
-            elif cmd == '/p':
-                if len(msg_parts) >= 2:
-                    bot.send_room_password_msg(msg_parts[1])
+            if not console.dispatch(None, chat_msg):
+                print ('Unknown command: %s' % chat_msg.split(' ')[0])
         else:
             client.send_chat_msg(chat_msg)
 
+
+def console_commands(client):
+    """
+    The commands of the console.
+
+    :param client: The client.
+    :type client: pinylib.TinychatRTCClient
+    :return: The console commands.
+    :rtype: command_router.CommandRouter
+    """
+    console = command_router.CommandRouter(prefix='/', prefix_match=False)
+
+    # The users change on the read thread, so these print copies of them.
+    def print_users(users, nobody):
+        users = list(users)
+        if len(users) == 0:
+            print (nobody)
+        for user in users:
+            print (user.nick)
+
+    def signed_in(_):
+        users = list(client.users.signed_in)
+        if len(users) == 0:
+            print ('No signed in users in the room.')
+        else:
+            for user in users:
+                print ('%s:%s' % (user.nick, user.account))
+
+    def user_levels(_):
+        for user in list(client.users.all.values()):
+            print ('%s: %s' % (user.nick, user.user_level))
+
+    console.add('q', lambda _: client.disconnect())
+    console.add('a', signed_in)
+    console.add('u', user_levels)
+    console.add('m', lambda _: print_users(client.users.mods, 'No moderators in the room.'))
+    console.add('n', lambda _: print_users(client.users.norms, 'No normal users in the room.'))
+    console.add('l', lambda _: print_users(client.users.lurkers, 'No lurkers in the room.'))
+    console.add('p', lambda _, password: client.send_room_password_msg(password), args=(str,))
+    console.on_error = command_error
+    return console
+
+
+def command_error(_, cmd, error):
+    print ('%s' % error)
+
 if __name__ == '__main__':
     if pinylib.CONFIG.DEBUG_TO_FILE:
         formater = '%(asctime)s : %(levelname)s : %(filename)s : %(lineno)d : %(funcName)s() : %(name)s : %(message)s'
@@ -0,0 +1,366 @@
+"""
+Routes bot commands in chat messages to their handlers.
+
+Commands are found in a trie of their names and aliases, so finding a command takes the time of
+reading its name, whatever the number of commands. A unique start of a name also finds it,
+e.g !ki for !kick, unless prefix matching is turned off.
+
+In a client subclass:
+
+    class MyBot(pinylib.TinychatRTCClient):
+
+        @command_router.command('kick', aliases=('k',), level=3, args=(str,))
+        def do_kick(self, user, nick):
+            ...
+"""
+import time
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+# The user levels, a user can use a command of their level or above.
+LEVEL_CLIENT = 0
+LEVEL_OWNER = 1
+LEVEL_MOD = 3
+LEVEL_USER = 5
+
+# An argument converter taking the rest of the message, e.g args=(int, REST)
+REST = object()
+
+
+class CommandError(Exception):
+    """ Base class of the reasons a command was not run. """
+    pass
+
+
+class PermissionDenied(CommandError):
+    """ The user level is above the level of the command. """
+    pass
+
+
+class CoolingDown(CommandError):
+    """ The command was used less than its cooldown ago. """
+    pass
+
+
+class UsageError(CommandError):
+    """ Missing or invalid arguments. """
+    pass
+
+
+def command(name, aliases=(), level=LEVEL_USER, cooldown=0, args=(), required=None, doc=None):
+    """
+    Mark a method of a client subclass as a command, added to its router when the client is created.
+
+    The method is called with the user and the converted arguments. See CommandRouter.add for the parameters.
+    """
+    def decorator(fn):
+        specs = getattr(fn, '_commands', [])
+        specs.append(dict(name=name, aliases=aliases, level=level, cooldown=cooldown, args=args,
+                          required=required, doc=doc))
+        fn._commands = specs
+        return fn
+    return decorator
+
+
+class Command(object):
+    """ A command, with its permission level, cooldown, arguments and stats. """
+
+    def __init__(self, name, handler, aliases=(), level=LEVEL_USER, cooldown=0, args=(), required=None, doc=None):
+        self.name = name
+        self.handler = handler
+        self.aliases = tuple(aliases)
+        self.level = level
+        self.cooldown = cooldown
+        self.args = tuple(args)
+        self.required = len(self.args) if required is None else required
+        self.doc = doc if doc is not None else (handler.__doc__ or '').strip()
+        self.last_used = 0.0
+
+        self.calls = 0
+        self.errors = 0
+        self.denied = 0
+        self.cooling = 0
+        self.usage_errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+
+    @property
+    def usage(self):
+        """ The name and arguments, e.g kick <str> """
+        names = []
+        for i, converter in enumerate(self.args):
+            name = 'text' if converter is REST else getattr(converter, '__name__', 'arg')
+            names.append(('<%s>' if i < self.required else '[%s]') % name)
+        return ' '.join([self.name] + names)
+
+    def parse(self, text):
+        """
+        Convert the arguments of a command.
+
+        :param text: The text after the command name.
+        :type text: str
+        :return: The converted arguments.
+        :rtype: list
+        """
+        values = []
+        rest = text.strip()
+        for i, converter in enumerate(self.args):
+            if not rest:
+                if i < self.required:
+                    raise UsageError('missing arguments, usage: %s' % self.usage)
+                break
+            if converter is REST:
+                values.append(rest)
+                rest = ''
+                break
+            parts = rest.split(None, 1)
+            rest = parts[1] if len(parts) > 1 else ''
+            try:
+                values.append(converter(parts[0]))
+            except (ValueError, TypeError):
+                raise UsageError('invalid argument %s, usage: %s' % (parts[0], self.usage))
+        return values
+
+    @property
+    def stats(self):
+        """
+        Returns the number of calls, errors and refusals, and the total and maximum seconds of the handler.
+
+        :rtype: dict
+        """
+        return {
+            'calls': self.calls,
+            'errors': self.errors,
+            'denied': self.denied,
+            'cooling_down': self.cooling,
+            'usage_errors': self.usage_errors,
+            'seconds': self.seconds,
+            'max_seconds': self.max_seconds
+        }
+
+
+class _Node(object):
+    __slots__ = ('children', 'command', 'below')
+
+    def __init__(self):
+        self.children = {}
+        # the command of the name ending here, and the names below by command.
+        self.command = None
+        self.below = {}
+
+
+class CommandRouter(object):
+    """ Commands by name and alias, in a trie. """
+
+    def __init__(self, prefix='!', prefix_match=True):
+        """
+        :param prefix: The text a command starts with, e.g '!'
+        :type prefix: str
+        :param prefix_match: Find a command by a unique start of its name or alias.
+        :type prefix_match: bool
+        """
+        self.prefix = prefix
+        self.prefix_match = prefix_match
+        self.commands = {}
+        self._root = _Node()
+        self._lock = threading.Lock()
+        self.on_error = None
+
+    def __len__(self):
+        return len(self.commands)
+
+    def __contains__(self, name):
+        return name.lower() in self.commands
+
+    def add(self, name, handler, aliases=(), level=LEVEL_USER, cooldown=0, args=(), required=None, doc=None):
+        """
+        Add a command, replacing a command of the same name.
+
+        :param name: The name, without the prefix.
+        :type name: str
+        :param handler: Called with the user and the converted arguments.
+        :type handler: callable
+        :param aliases: Other names of the command.
+        :type aliases: tuple
+        :param level: The highest user level allowed to use it, see User.user_level.
+        :type level: int
+        :param cooldown: Seconds before the command can be used again, 0 for none.
+        :type cooldown: int | float
+        :param args: A converter per argument, e.g (str, int), REST for the rest of the message.
+        :type args: tuple
+        :param required: The number of required arguments, defaults to all.
+        :type required: int | None
+        :param doc: The help text, defaults to the handler docstring.
+        :type doc: str | None
+        :return: The command.
+        :rtype: Command
+        """
+        cmd = Command(name.lower(), handler, [alias.lower() for alias in aliases], level, cooldown, args,
+                      required, doc)
+        with self._lock:
+            for word in (cmd.name,) + cmd.aliases:
+                node = self._find(word)
+                if node is not None and node.command is not None and node.command.name != cmd.name:
+                    raise ValueError('%s is already used by the command %s' % (word, node.command.name))
+            if cmd.name in self.commands:
+                self._remove(self.commands[cmd.name])
+            self.commands[cmd.name] = cmd
+            for word in (cmd.name,) + cmd.aliases:
+                self._insert(word, cmd)
+        return cmd
+
+    def add_commands(self, obj):
+        """
+        Add the methods of an object marked with the command decorator.
+
+        :param obj: The object, e.g a client.
+        :type obj: object
+        :return: The number of commands added.
+        :rtype: int
+        """
+        added = 0
+        for attr in dir(type(obj)):
+            specs = getattr(getattr(type(obj), attr, None), '_commands', None)
+            if not specs:
+                continue
+            for spec in specs:
+                self.add(handler=getattr(obj, attr), **spec)
+                added += 1
+        return added
+
+    def remove(self, name):
+        """
+        Remove a command and its aliases.
+
+        :param name: The name of the command.
+        :type name: str
+        :return: True if removed, False if there was no such command.
+        :rtype: bool
+        """
+        with self._lock:
+            cmd = self.commands.get(name.lower())
+            if cmd is None:
+                return False
+            self._remove(cmd)
+            return True
+
+    def _insert(self, word, cmd):
+        node = self._root
+        node.below[cmd] = node.below.get(cmd, 0) + 1
+        for ch in word:
+            child = node.children.get(ch)
+            if child is None:
+                child = node.children[ch] = _Node()
+            node = child
+            node.below[cmd] = node.below.get(cmd, 0) + 1
+        node.command = cmd
+
+    def _remove(self, cmd):
+        del self.commands[cmd.name]
+        for word in (cmd.name,) + cmd.aliases:
+            path = [self._root]
+            for ch in word:
+                path.append(path[-1].children[ch])
+            path[-1].command = None
+            for node in path:
+                node.below[cmd] -= 1
+                if not node.below[cmd]:
+                    del node.below[cmd]
+            for i in range(len(word), 0, -1):
+                if not path[i].below:
+                    del path[i - 1].children[word[i - 1]]
+
+    def _find(self, word):
+        node = self._root
+        for ch in word:
+            node = node.children.get(ch)
+            if node is None:
+                return None
+        return node
+
+    def resolve(self, word):
+        """
+        Find a command by name, alias or, with prefix matching, a unique start of them.
+
+        :param word: The command name, without the prefix.
+        :type word: str
+        :return: The command, or None if not found or not unique.
+        :rtype: Command | None
+        """
+        node = self._find(word.lower())
+        if node is None:
+            return None
+        if node.command is not None:
+            return node.command
+        if self.prefix_match and len(node.below) == 1:
+            return next(iter(node.below))
+        return None
+
+    def dispatch(self, _user, text, now=None):
+        """
+        Run the command in a message, if it has one.
+
+        :param _user: The user sending the message, None for the console, which may use any command.
+        :type _user: User | None
+        :param text: The message.
+        :type text: str
+        :param now: The time of the message, None for now.
+        :type now: float | None
+        :return: True if the message was a command, run or refused, else False.
+        :rtype: bool
+        """
+        if not text.startswith(self.prefix) or not self.commands:
+            return False
+        parts = text[len(self.prefix):].split(None, 1)
+        if not parts:
+            return False
+        cmd = self.resolve(parts[0])
+        if cmd is None:
+            return False
+
+        if now is None:
+            now = time.time()
+        try:
+            if _user is not None and _user.user_level > cmd.level:
+                cmd.denied += 1
+                raise PermissionDenied('%s needs level %s' % (cmd.name, cmd.level))
+            if cmd.cooldown and now - cmd.last_used < cmd.cooldown:
+                cmd.cooling += 1
+                raise CoolingDown('%s can be used again in %.0f seconds' %
+                                  (cmd.name, cmd.cooldown - (now - cmd.last_used)))
+            try:
+                args = cmd.parse(parts[1] if len(parts) > 1 else '')
+            except UsageError:
+                cmd.usage_errors += 1
+                raise
+        except CommandError as e:
+            if self.on_error is not None:
+                self.on_error(_user, cmd, e)
+            return True
+
+        cmd.last_used = now
+        started = time.time()
+        try:
+            cmd.handler(_user, *args)
+        except Exception as e:
+            cmd.errors += 1
+            log.error('command %s failed: %s' % (cmd.name, e), exc_info=True)
+        finally:
+            elapsed = time.time() - started
+            cmd.calls += 1
+            cmd.seconds += elapsed
+            if elapsed > cmd.max_seconds:
+                cmd.max_seconds = elapsed
+        return True
+
+    @property
+    def stats(self):
+        """
+        Returns the stats of each command.
+
+        :return: Command.stats by command name.
+        :rtype: dict
+        """
+        return dict((name, cmd.stats) for name, cmd in self.commands.items())
@@ -6,6 +6,105 @@ PASSWORD = ''
 FALLBACK_RTC_VERSION = '2.0.22-4'
 # Log chat messages and events.
 CHAT_LOGGING = False
+# Store chat events in the indexed history, in the history folder of the room, see history.py
+CHAT_HISTORY = False
+# Bytes of chat events compressed together into a block of the history.
+CHAT_HISTORY_BLOCK_SIZE = 65536
+# Maximum seconds chat events are buffered, before they are written to the history.
+CHAT_HISTORY_FLUSH_INTERVAL = 60
+# Index chat messages for full text search, in the index folder of CONFIG_PATH, see text_index.py
+CHAT_INDEX = False
+# Indexed chat messages kept in memory, before they are written to a segment of the index.
+CHAT_INDEX_FLUSH_DOCS = 10000
+# Maximum seconds indexed chat messages are kept in memory.
+CHAT_INDEX_FLUSH_INTERVAL = 300
+# Maximum seconds console output and chat log lines wait, before a background thread writes them.
+LOG_FLUSH_INTERVAL = 0.2
+# Write console output and chat log lines as soon as this many are waiting.
+LOG_FLUSH_SIZE = 500
+# Maximum console output and chat log lines waiting to be written, 0 for no limit.
+LOG_QUEUE_SIZE = 10000
+# When LOG_QUEUE_SIZE lines are waiting, 'drop' further lines or 'block' until there is room.
+LOG_FULL_POLICY = 'drop'
+# Rate limits for chat and private messages, see flood.py. Each rule is (scope, kind, limit, seconds, action),
+# scope is 'user', 'account' or 'room', kind is 'bucket' or 'window', action is 'warn', 'drop', 'kick' or 'ban'.
+# A 'room' rule can only 'warn' or 'drop', the user crossing a room wide limit is not always the flooder.
+FLOOD_RULES = [
+    ('user', 'bucket', 1, 1, 'drop'),
+    ('room', 'window', 100, 5, 'warn')
+]
+# Maximum users or accounts flood control keeps the state of, per rule.
+FLOOD_MAX_KEYS = 10000
+# Seconds without messages after which flood control drops the state of a user or account.
+FLOOD_IDLE = 300
+# Seconds before a flood warn, kick or ban is repeated for the same user, account or room.
+FLOOD_COOLDOWN = 10
+# Act on the same or nearly the same chat message sent by this many users, see duplicates.py. 0 to not check.
+DUPLICATE_USERS = 3
+# Seconds chat messages are kept to find duplicates.
+DUPLICATE_WINDOW = 60
+# How similar near duplicates are, from 0 to 1, estimated from the 3 letter sequences of the messages.
+DUPLICATE_SIMILARITY = 0.7
+# Chat messages shorter than this are not checked for duplicates.
+DUPLICATE_MIN_LENGTH = 12
+# Maximum chat messages kept to find duplicates, per room.
+DUPLICATE_MAX_MESSAGES = 20000
+# What to do with duplicates: 'warn', 'drop', 'kick' or 'ban' each user who sent them.
+DUPLICATE_ACTION = 'warn'
+# The text bot commands start with, see command_router.py
+COMMAND_PREFIX = '!'
+# Find a command by a unique start of its name, e.g !ki for !kick
+COMMAND_PREFIX_MATCH = True
+# Word lists of the content filter, by category, each a file in CONFIG_PATH, see content_filter.py
+# e.g {'spam': 'spam_words.txt', 'slurs': 'banned_words.txt'}
+FILTER_LISTS = {}
+# What to do with a message with words of a category: 'warn', 'drop', 'kick' or 'ban'. The default is 'drop'.
+FILTER_ACTIONS = {}
+# Minimum seconds between checks for changed word list files, 0 to not check.
+FILTER_RELOAD_INTERVAL = 30
+# Worker threads fetching profile info of users joining.
+ENRICH_WORKERS = 2
+# Maximum queued profile info lookups, further lookups are dropped.
+ENRICH_QUEUE_SIZE = 500
+# Maximum messages sent per second, 0 for no limit.
+SEND_RATE = 5
+# Messages that can be sent at once, before SEND_RATE applies.
+SEND_BURST = 10
+# Maximum queued outbound messages, when full the lowest priority message is dropped. 0 for no limit.
+SEND_QUEUE_SIZE = 1000
+# Seconds to wait for the reply to a request sent with future=True.
+REQUEST_TIMEOUT = 30
+# Maximum requests waiting for a reply, the oldest is dropped when full.
+REQUEST_MAX_PENDING = 1000
+# Give up reconnecting after this many failed attempts in a row, 0 for never.
+RECONNECT_MAX_ATTEMPTS = 10
+# Seconds to wait before the first reconnect attempt, doubled for every failed attempt.
+RECONNECT_BASE_DELAY = 1
+# Maximum seconds to wait between reconnect attempts.
+RECONNECT_MAX_DELAY = 60
+# Seconds a fetched rtc version is used, shared by all rooms.
+RTC_VERSION_TTL = 3600
+# Seconds before RTC_VERSION_TTL expires to refresh the rtc version in the background.
+RTC_VERSION_REFRESH = 300
+# The name of the rtc version cache file, in CONFIG_PATH.
+RTC_VERSION_FILE = 'rtc_version.json'
+# Record the raw websocket frames to the recordings folder of the room, see bench.replay
+RECORD_FRAMES = False
+# Frames the read loop lag percentiles are estimated from, see lag_stats.
+LAG_WINDOW = 1000
+# Call on_loop_saturated when the 99th percentile time from reading a frame until handled is above this, 0 to not check.
+LAG_SATURATED = 0.5
+# Call on_loop_saturated when a pong is written more than this many seconds after the ping was read, 0 to not check.
+PONG_SATURATED = 5
+# Serve prometheus metrics on http://METRICS_HOST:METRICS_PORT/metrics, 0 to not serve them.
+METRICS_PORT = 0
+# Time one in this many event handlers in pinylib_event_seconds, 1 to time all of them, 0 to not time them.
+# A timed frame reads the clock once more.
+EVENT_TIMING = 100
+# The address the metrics are served on.
+METRICS_HOST = '127.0.0.1'
+# Maximum rooms with metrics of their own, further rooms are counted together as _other.
+METRICS_MAX_ROOMS = 100
 # Show additional info/errors in console.
 DEBUG_MODE = False
 # Log debug info to file.
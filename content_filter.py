@@ -0,0 +1,440 @@
+"""
+Finds words and phrases of word lists in chat messages, with one Aho-Corasick automaton for all lists.
+
+Text is normalized before matching, so accents, full width letters and case do not hide a word.
+A list has a category, e.g 'spam', and a line per word or phrase. Lines starting with # are comments.
+A pattern matches whole words only, unless it starts or ends with *, e.g *spam matches 'foospam'.
+"""
+import os
+import time
+import logging
+import threading
+import unicodedata
+from collections import deque
+
+from util import file_handler
+
+log = logging.getLogger(__name__)
+
+WILDCARD = u'*'
+
+_shared = None
+_shared_lock = threading.Lock()
+
+# normalized text of each character seen, see _normalize_char.
+_chars = {}
+
+
+def get_filter(reload_interval=30):
+    """
+    Get the ContentFilter shared by all clients of the process.
+
+    :param reload_interval: Minimum seconds between checks for changed list files.
+    :type reload_interval: int | float
+    :return: The shared ContentFilter.
+    :rtype: ContentFilter
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = ContentFilter(reload_interval=reload_interval)
+        return _shared
+
+
+def _unicode(text):
+    if isinstance(text, bytes):
+        return text.decode('utf-8', 'replace')
+    return text
+
+
+def _lower(text):
+    return text.casefold() if hasattr(text, 'casefold') else text.lower()
+
+
+def _normalize_char(ch):
+    """ A character decomposed, without accents and in lower case. May be more than one character, or none. """
+    normalized = _chars.get(ch)
+    if normalized is None:
+        decomposed = unicodedata.normalize('NFKD', ch)
+        normalized = _lower(u''.join(c for c in decomposed if not unicodedata.combining(c)))
+        if len(_chars) < 100000:
+            _chars[ch] = normalized
+    return normalized
+
+
+def normalize(text):
+    """
+    Normalize a text for matching.
+
+    :param text: The text.
+    :type text: str
+    :return: The normalized text, and for each of its characters the index of the character it came from,
+    or None if it is the same length and order as the text.
+    :rtype: tuple
+    """
+    text = _unicode(text or u'')
+    try:
+        text.encode('ascii')
+    except UnicodeError:
+        pass
+    else:
+        return text.lower(), None
+
+    chars = []
+    index = []
+    for i, ch in enumerate(text):
+        normalized = _normalize_char(ch)
+        chars.append(normalized)
+        index.extend([i] * len(normalized))
+    return u''.join(chars), index
+
+
+def _is_word_char(ch):
+    return ch.isalnum() or ch == u'_'
+
+
+class Pattern(object):
+    """ A word or phrase of a list. """
+
+    __slots__ = ('text', 'category', 'normalized', 'word_start', 'word_end')
+
+    def __init__(self, text, category):
+        """
+        :param text: The pattern as written in the list, e.g 'buy now' or '*spam'
+        :type text: str
+        :param category: The category of the list.
+        :type category: str
+        """
+        self.text = text
+        self.category = category
+        self.word_start = not text.startswith(WILDCARD)
+        self.word_end = not text.endswith(WILDCARD)
+        self.normalized = normalize(text.strip(WILDCARD))[0]
+
+    def __repr__(self):
+        return 'Pattern(%r, %r)' % (self.text, self.category)
+
+
+class Match(object):
+    """ A pattern found in a text. start and end are positions in the text as given, not the normalized text. """
+
+    __slots__ = ('start', 'end', 'pattern', 'category')
+
+    def __init__(self, start, end, pattern):
+        self.start = start
+        self.end = end
+        self.pattern = pattern
+        self.category = pattern.category
+
+    def __repr__(self):
+        return 'Match(%r, %r, %r, %r)' % (self.start, self.end, self.pattern.text, self.category)
+
+
+class Automaton(object):
+    """
+    An Aho-Corasick automaton of patterns.
+
+    The transitions of a state are a dict, holding the trie edges. Other transitions are found by
+    following the failure links once, and added to the dict, so a text is scanned with one dict
+    lookup per character, whatever the number of patterns. Characters of no pattern go to the root.
+    """
+
+    def __init__(self, patterns):
+        """
+        :param patterns: The patterns.
+        :type patterns: list
+        """
+        self.patterns = [pattern for pattern in patterns if pattern.normalized]
+        self._next = [{}]
+        self._fail = [0]
+        self._out = [()]
+        self.alphabet = set()
+
+        for number, pattern in enumerate(self.patterns):
+            state = 0
+            for ch in pattern.normalized:
+                nxt = self._next[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._next)
+                    self._next[state][ch] = nxt
+                    self._next.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = nxt
+            self._out[state] += (number,)
+            self.alphabet.update(pattern.normalized)
+
+        queue = deque(self._next[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._next[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._next[fail]:
+                    fail = self._fail[fail]
+                fail = self._next[fail].get(ch, 0)
+                self._fail[nxt] = fail
+                if self._out[fail]:
+                    self._out[nxt] += self._out[fail]
+
+    def __len__(self):
+        return len(self._next)
+
+    def _step(self, state, ch):
+        """ The transition of a state missing from its dict, found through the failure link and added. """
+        if ch not in self.alphabet:
+            return 0
+        if state == 0:
+            nxt = 0
+        else:
+            fail = self._fail[state]
+            nxt = self._next[fail].get(ch)
+            if nxt is None:
+                nxt = self._step(fail, ch)
+        self._next[state][ch] = nxt
+        return nxt
+
+    def scan(self, text):
+        """
+        Find the patterns in a normalized text, overlapping matches included.
+
+        :param text: The normalized text.
+        :type text: str
+        :return: A list of (start, end, pattern number) tuples, positions in the normalized text.
+        :rtype: list
+        """
+        found = []
+        nexts = self._next
+        out = self._out
+        state = 0
+        for i, ch in enumerate(text):
+            nxt = nexts[state].get(ch)
+            if nxt is None:
+                nxt = self._step(state, ch)
+            state = nxt
+            if out[state]:
+                for number in out[state]:
+                    found.append((i + 1 - len(self.patterns[number].normalized), i + 1, number))
+        return found
+
+
+class ContentFilter(object):
+    """
+    Word lists by category, compiled into one automaton.
+
+    When a list changes, only that list is parsed again, and a builder thread builds a new automaton
+    and swaps it in, once for the changes made meanwhile. Searches keep using the previous automaton
+    until then, so they never wait on a build. The builder thread also reads the list files again
+    when they change.
+    """
+
+    def __init__(self, reload_interval=30):
+        """
+        :param reload_interval: Minimum seconds between checks for changed list files, 0 to not check.
+        :type reload_interval: int | float
+        """
+        self.reload_interval = reload_interval
+        self._lists = {}
+        self._files = {}
+        self._lock = threading.Lock()
+        self._automaton = Automaton([])
+        self._dirty = False
+        self._checked = time.time()
+        self._changed = threading.Event()
+        self._builder = None
+        # one build at a time, so an older automaton is never swapped in after a newer one.
+        self._build_lock = threading.Lock()
+        self.builds = 0
+        self.build_seconds = 0.0
+        self.searched = 0
+        self.matched = 0
+
+    def set_list(self, category, words):
+        """
+        Set the words and phrases of a category, replacing the previous list.
+
+        :param category: The category, e.g 'spam'
+        :type category: str
+        :param words: The words and phrases, comment lines and empty lines are skipped.
+        :type words: list
+        """
+        patterns = []
+        seen = set()
+        for line in words:
+            line = _unicode(line).strip()
+            if not line or line.startswith(u'#') or line in seen:
+                continue
+            seen.add(line)
+            patterns.append(Pattern(line, category))
+        with self._lock:
+            self._lists[category] = patterns
+            self._dirty = True
+        self._wake()
+
+    def add_words(self, category, words):
+        """
+        Add words and phrases to a category.
+
+        :param category: The category.
+        :type category: str
+        :param words: The words and phrases.
+        :type words: list
+        """
+        with self._lock:
+            existing = [pattern.text for pattern in self._lists.get(category, [])]
+        self.set_list(category, existing + list(words))
+
+    def remove_list(self, category):
+        """
+        Remove the list of a category.
+
+        :param category: The category.
+        :type category: str
+        """
+        with self._lock:
+            self._files.pop(category, None)
+            if self._lists.pop(category, None) is not None:
+                self._dirty = True
+        self._wake()
+
+    def load_list(self, category, file_path, file_name):
+        """
+        Load the list of a category from a file, with util.file_handler.file_reader.
+        The file is read again when it changes, see refresh.
+
+        :param category: The category.
+        :type category: str
+        :param file_path: The path to the file.
+        :type file_path: str
+        :param file_name: The name of the file.
+        :type file_name: str
+        :return: The number of patterns loaded.
+        :rtype: int
+        """
+        mtime = self._mtime(file_path + file_name)
+        self.set_list(category, file_handler.file_reader(file_path, file_name))
+        with self._lock:
+            self._files[category] = (file_path, file_name, mtime)
+            count = len(self._lists[category])
+        self._wake()
+        return count
+
+    @staticmethod
+    def _mtime(file_name):
+        try:
+            return os.path.getmtime(file_name)
+        except OSError:
+            return None
+
+    def _wake(self):
+        """ Let the builder thread build the automaton, starting it on the first change. """
+        with self._lock:
+            if self._builder is None:
+                self._builder = threading.Thread(target=self._run, name='content-filter')
+                self._builder.daemon = True
+                self._builder.start()
+        self._changed.set()
+
+    def _run(self):
+        """ The builder thread, building after list changes and checking the list files every reload_interval. """
+        while True:
+            self._changed.wait(self.reload_interval or None)
+            self._changed.clear()
+            try:
+                if self.reload_interval and time.time() - self._checked >= self.reload_interval:
+                    self._checked = time.time()
+                    self.refresh()
+                else:
+                    self.build()
+            except Exception as e:
+                log.error('content filter build error: %s' % e, exc_info=True)
+
+    def refresh(self):
+        """ Read the list files that changed since they were loaded, and build the automaton if a list changed. """
+        with self._lock:
+            files = list(self._files.items())
+        for category, (file_path, file_name, mtime) in files:
+            if self._mtime(file_path + file_name) != mtime:
+                log.info('reloading the %s list from %s' % (category, file_name))
+                self.load_list(category, file_path, file_name)
+        self.build()
+
+    def build(self):
+        """
+        Build the automaton now, on the calling thread, if a list changed since the last build.
+        Lists are built by the builder thread otherwise, this is for code that needs the change
+        applied before it continues, e.g when a client starts.
+        """
+        with self._build_lock:
+            with self._lock:
+                if not self._dirty:
+                    return
+                self._dirty = False
+                patterns = [pattern for category in sorted(self._lists) for pattern in self._lists[category]]
+            started = time.time()
+            automaton = Automaton(patterns)
+            self.build_seconds = time.time() - started
+            self.builds += 1
+            self._automaton = automaton
+        log.debug('built the content filter, %s patterns, %s states in %.3fs' %
+                  (len(automaton.patterns), len(automaton), self.build_seconds))
+
+    def search(self, text):
+        """
+        Find the words and phrases of all lists in a text.
+
+        :param text: The text, e.g a chat message.
+        :type text: str
+        :return: A list of Match, in the order they end in the text.
+        :rtype: list
+        """
+        automaton = self._automaton
+        self.searched += 1
+        if not automaton.patterns:
+            return []
+
+        text = _unicode(text or u'')
+        normalized, index = normalize(text)
+        matches = []
+        size = len(normalized)
+        for start, end, number in automaton.scan(normalized):
+            pattern = automaton.patterns[number]
+            if pattern.word_start and start > 0 and _is_word_char(normalized[start - 1]):
+                continue
+            if pattern.word_end and end < size and _is_word_char(normalized[end]):
+                continue
+            if index is not None:
+                start, end = index[start], index[end - 1] + 1
+            matches.append(Match(start, end, pattern))
+        if matches:
+            self.matched += 1
+        return matches
+
+    @property
+    def categories(self):
+        """
+        Returns the number of patterns of each category.
+
+        :rtype: dict
+        """
+        with self._lock:
+            return dict((category, len(patterns)) for category, patterns in self._lists.items())
+
+    @property
+    def stats(self):
+        """
+        Returns the number of patterns and states, the builds and the texts searched and matched.
+
+        :return: The content filter stats.
+        :rtype: dict
+        """
+        automaton = self._automaton
+        return {
+            'patterns': len(automaton.patterns),
+            'states': len(automaton),
+            'builds': self.builds,
+            'build_pending': self._dirty,
+            'build_seconds': self.build_seconds,
+            'searched': self.searched,
+            'matched': self.matched
+        }
@@ -0,0 +1,261 @@
+"""
+Finds the same or nearly the same chat message sent by different users, as raid bots do.
+
+Each message gets an exact fingerprint, and a MinHash signature of its character 3-grams, made with
+one hash per 3-gram. Messages are grouped in clusters of exact and near duplicates, found through
+locality sensitive hashing of the signature bands, and each cluster counts the users who sent it.
+"""
+import re
+import time
+import operator
+import logging
+from collections import deque
+
+import content_filter
+
+log = logging.getLogger(__name__)
+
+# Signature bins, and bins per band. A pair with a similarity of 0.7 shares a band with a chance of 0.99.
+BINS = 16
+BAND = 2
+SHINGLE = 3
+
+# Band entries compared with a new message, the most recent first.
+_CANDIDATES = 8
+_MASK = 0xffffffff
+_EMPTY = _MASK + 1
+_EMPTY_BAND = (_EMPTY,) * BAND
+_BAND_STARTS = tuple(range(0, BINS, BAND))
+_NON_WORD = re.compile(r'\W+', re.UNICODE)
+
+
+def fingerprint(text):
+    """
+    The exact fingerprint and the signature of a text, after normalizing it.
+
+    Case, accents, punctuation and repeated spaces are ignored.
+
+    :param text: The text.
+    :type text: str
+    :return: The normalized text, its hash and its signature, a tuple of BINS values.
+    :rtype: tuple
+    """
+    normalized = _NON_WORD.sub(u' ', content_filter.normalize(text)[0]).strip()
+    mins = [_EMPTY] * BINS
+    for i in range(len(normalized) - SHINGLE + 1):
+        h = hash(normalized[i:i + SHINGLE]) & _MASK
+        b = h % BINS
+        if h < mins[b]:
+            mins[b] = h
+    return normalized, hash(normalized), tuple(mins)
+
+
+def similarity(a, b):
+    """
+    Estimate the Jaccard similarity of the 3-grams of two texts, by the share of equal signature bins.
+
+    :param a: The signature of a text.
+    :type a: tuple
+    :param b: The signature of another text.
+    :type b: tuple
+    :return: The similarity, from 0 to 1.
+    :rtype: float
+    """
+    return sum(map(operator.eq, a, b)) / float(BINS)
+
+
+class Cluster(object):
+    """ Messages that are the same or nearly the same, and the users who sent them. """
+
+    __slots__ = ('text', 'handles', 'size', 'flagged', 'acted')
+
+    def __init__(self, text):
+        self.text = text
+        self.handles = {}
+        self.size = 0
+        self.flagged = False
+        self.acted = set()
+
+    def __repr__(self):
+        return 'Cluster(%r, %s users, %s messages)' % (self.text, len(self.handles), self.size)
+
+
+class _Entry(object):
+    __slots__ = ('time', 'handle', 'exact', 'bands', 'signature', 'cluster')
+
+    def __init__(self, timestamp, handle, exact, bands, signature, cluster):
+        self.time = timestamp
+        self.handle = handle
+        self.exact = exact
+        self.bands = bands
+        self.signature = signature
+        self.cluster = cluster
+
+
+class DuplicateDetector(object):
+    """
+    Keeps the messages of the last window seconds, at most max_messages, and flags a cluster
+    when min_handles different users sent it.
+
+    Messages expire in the order they arrived, so adding and expiring a message takes constant time.
+
+    This is not thread safe, messages are checked on the read loop.
+    """
+
+    def __init__(self, min_handles=3, window=60, similarity=0.7, min_length=12, max_messages=20000):
+        """
+        :param min_handles: Flag a cluster when this many different users sent it.
+        :type min_handles: int
+        :param window: Seconds a message is kept.
+        :type window: int | float
+        :param similarity: The estimated 3-gram similarity of near duplicates, from 0 to 1.
+        :type similarity: float
+        :param min_length: Messages shorter than this, after normalizing, are not checked.
+        :type min_length: int
+        :param max_messages: The maximum number of messages kept, the oldest are dropped first.
+        :type max_messages: int
+        """
+        self.min_handles = min_handles
+        self.window = window
+        self.similarity = similarity
+        self.min_length = min_length
+        self.max_messages = max_messages
+
+        self._ring = deque()
+        # exact fingerprint to [cluster, messages], and band to entries, oldest first.
+        self._exact = {}
+        self._bands = {}
+        self.checked = 0
+        self.exact_matches = 0
+        self.near_matches = 0
+        self.flagged = 0
+
+    def __len__(self):
+        return len(self._ring)
+
+    def check(self, handle, text, now=None):
+        """
+        Add a message, and check if its cluster is flagged.
+
+        :param handle: The handle of the sender.
+        :type handle: int
+        :param text: The message.
+        :type text: str
+        :param now: The time of the message, None for now.
+        :type now: float | None
+        :return: None if the cluster is not flagged, else the cluster and a list of the handles
+        of the cluster not returned before, the sender included if new.
+        :rtype: tuple | None
+        """
+        if now is None:
+            now = time.time()
+        self._expire(now)
+        self.checked += 1
+        normalized, exact, signature = fingerprint(text)
+        if len(normalized) < self.min_length:
+            return None
+
+        # bands of empty bins, of short messages, would make every short message a candidate.
+        bands = [(i, signature[i:i + BAND]) for i in _BAND_STARTS]
+        bands = tuple(band for band in bands if band[1] != _EMPTY_BAND)
+        cluster = None
+        counted = self._exact.get(exact)
+        if counted is not None:
+            cluster = counted[0]
+            counted[1] += 1
+            self.exact_matches += 1
+        else:
+            cluster = self._near(bands, signature)
+            if cluster is None:
+                cluster = Cluster(normalized)
+            else:
+                self.near_matches += 1
+            self._exact[exact] = [cluster, 1]
+
+        entry = _Entry(now, handle, exact, bands, signature, cluster)
+        self._ring.append(entry)
+        for band in bands:
+            entries = self._bands.get(band)
+            if entries is None:
+                entries = self._bands[band] = deque()
+            entries.append(entry)
+        cluster.handles[handle] = cluster.handles.get(handle, 0) + 1
+        cluster.size += 1
+
+        if len(cluster.handles) < self.min_handles:
+            return None
+        if not cluster.flagged:
+            cluster.flagged = True
+            self.flagged += 1
+            handles = list(cluster.handles)
+        elif handle not in cluster.acted:
+            handles = [handle]
+        else:
+            handles = []
+        cluster.acted.update(handles)
+        return cluster, handles
+
+    def _near(self, bands, signature):
+        """ The cluster of the most similar recent message sharing a band, if similar enough. """
+        best = None
+        best_similarity = self.similarity
+        seen = set()
+        for band in bands:
+            entries = self._bands.get(band)
+            if not entries:
+                continue
+            for i in range(1, min(_CANDIDATES, len(entries)) + 1):
+                entry = entries[-i]
+                if entry.cluster in seen:
+                    continue
+                seen.add(entry.cluster)
+                s = similarity(signature, entry.signature)
+                if s >= best_similarity:
+                    best, best_similarity = entry.cluster, s
+        return best
+
+    def _expire(self, now):
+        ring = self._ring
+        deadline = now - self.window
+        while ring and (ring[0].time < deadline or len(ring) >= self.max_messages):
+            entry = ring.popleft()
+            counted = self._exact[entry.exact]
+            counted[1] -= 1
+            if not counted[1]:
+                del self._exact[entry.exact]
+            for band in entry.bands:
+                entries = self._bands[band]
+                entries.popleft()
+                if not entries:
+                    del self._bands[band]
+            cluster = entry.cluster
+            cluster.size -= 1
+            count = cluster.handles[entry.handle] - 1
+            if count:
+                cluster.handles[entry.handle] = count
+            else:
+                del cluster.handles[entry.handle]
+
+    def clear(self):
+        """ Forget all messages. """
+        self._ring.clear()
+        self._exact.clear()
+        self._bands.clear()
+
+    @property
+    def stats(self):
+        """
+        Returns the number of messages checked and kept, the exact and near duplicates and the flagged clusters.
+
+        :return: The duplicate detector stats.
+        :rtype: dict
+        """
+        return {
+            'checked': self.checked,
+            'messages': len(self._ring),
+            'fingerprints': len(self._exact),
+            'bands': len(self._bands),
+            'exact_matches': self.exact_matches,
+            'near_matches': self.near_matches,
+            'flagged': self.flagged
+        }
@@ -0,0 +1,126 @@
+""" Fetches tinychat profile information for users in the background. """
+import time
+import logging
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import config
+import apis.tinychat
+from util.workers import WorkerPool
+
+log = logging.getLogger(__name__)
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_enricher():
+    """
+    Get the process wide ProfileEnricher, shared by all clients.
+
+    :return: The shared ProfileEnricher.
+    :rtype: ProfileEnricher
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = ProfileEnricher(workers=config.ENRICH_WORKERS, max_queue=config.ENRICH_QUEUE_SIZE)
+        return _shared
+
+
+class ProfileEnricher(object):
+    """ A bounded work queue and worker pool filling User profile info from the tinychat API. """
+
+    def __init__(self, workers=2, max_queue=500):
+        """
+        Create the enricher and start its worker threads.
+
+        :param workers: The number of worker threads.
+        :type workers: int
+        :param max_queue: The maximum number of queued lookups, further lookups are dropped.
+        :type max_queue: int
+        """
+        self._pool = WorkerPool(workers=workers, max_queue=max_queue, name='enrich')
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.dropped = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def submit(self, _user, callback=None):
+        """
+        Queue a profile lookup for a user.
+
+        :param _user: The user to fetch the profile info for.
+        :type _user: user.User
+        :param callback: Called from a worker thread with the user and the
+        profile info dict, if the lookup succeeded.
+        :type callback: callable | None
+        :return: True if queued, False if the queue was full.
+        :rtype: bool
+        """
+        try:
+            future = self._pool.submit(self._lookup, _user, time.time())
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+            log.warning('profile lookup queue full, dropping lookup for: %s' % _user.account)
+            return False
+
+        with self._lock:
+            self.submitted += 1
+
+        if callback is not None:
+            def done(f):
+                if f.exception() is None and f.result() is not None:
+                    callback(_user, f.result())
+            future.add_done_callback(done)
+        return True
+
+    def _lookup(self, _user, queued_at):
+        tc_info = apis.tinychat.user_info(_user.account)
+        latency = time.time() - queued_at
+
+        with self._lock:
+            if tc_info is None:
+                self.failed += 1
+            else:
+                self.completed += 1
+            self._latency_total += latency
+            self._latency_max = max(self._latency_max, latency)
+
+        if tc_info is not None:
+            _user.biography = tc_info['biography']
+            _user.gender = tc_info['gender']
+            _user.age = tc_info['age']
+            _user.location = tc_info['location']
+            _user.role = tc_info['role']
+        return tc_info
+
+    @property
+    def stats(self):
+        """
+        Returns the queue depth and lookup stats.
+
+        Latency is the time from queueing a lookup until the profile info arrived, in seconds.
+
+        :return: A dictionary of stats.
+        :rtype: dict
+        """
+        with self._lock:
+            done = self.completed + self.failed
+            return {
+                'queue_depth': self._pool.pending,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'latency_avg': self._latency_total / done if done else 0.0,
+                'latency_max': self._latency_max
+            }
@@ -0,0 +1,248 @@
+""" Rate limits for chat and private messages, per user, per account and for the whole room. """
+import time
+import logging
+
+log = logging.getLogger(__name__)
+
+# What a rule limits, messages of a user (handle), of an account, or of everyone in the room.
+SCOPE_USER = 'user'
+SCOPE_ACCOUNT = 'account'
+SCOPE_ROOM = 'room'
+SCOPES = (SCOPE_USER, SCOPE_ACCOUNT, SCOPE_ROOM)
+
+# How a rule counts messages.
+KIND_BUCKET = 'bucket'
+KIND_WINDOW = 'window'
+
+# What to do with a message over a limit. A warned message is still handled, the others are not.
+ACTION_WARN = 'warn'
+ACTION_DROP = 'drop'
+ACTION_KICK = 'kick'
+ACTION_BAN = 'ban'
+# The action taken when a message breaks several rules.
+SEVERITY = {ACTION_WARN: 0, ACTION_DROP: 1, ACTION_KICK: 2, ACTION_BAN: 3}
+
+
+class Rule(object):
+    """
+    A limit of messages per number of seconds.
+
+    A bucket rule is a token bucket holding up to limit messages, refilled at limit / seconds per second,
+    so it allows a burst of limit messages. Messages over the limit do not take a token.
+
+    A window rule allows at most limit messages in any period of seconds, estimated from the count
+    of the current and the previous period. All messages count, so a user who keeps flooding stays limited.
+    """
+
+    __slots__ = ('scope', 'kind', 'limit', 'seconds', 'action', 'rate')
+
+    def __init__(self, scope, kind, limit, seconds, action):
+        """
+        :param scope: SCOPE_USER, SCOPE_ACCOUNT or SCOPE_ROOM.
+        :type scope: str
+        :param kind: KIND_BUCKET or KIND_WINDOW.
+        :type kind: str
+        :param limit: The number of messages.
+        :type limit: int
+        :param seconds: Per this many seconds.
+        :type seconds: int | float
+        :param action: ACTION_WARN, ACTION_DROP, ACTION_KICK or ACTION_BAN, only warn or drop for SCOPE_ROOM.
+        :type action: str
+        :raises ValueError: If a value is unknown or out of range, or a room rule would kick or ban.
+        """
+        if scope not in SCOPES:
+            raise ValueError('unknown scope %s, use one of %s' % (scope, ', '.join(SCOPES)))
+        if kind not in (KIND_BUCKET, KIND_WINDOW):
+            raise ValueError('unknown kind %s, use %s or %s' % (kind, KIND_BUCKET, KIND_WINDOW))
+        if action not in SEVERITY:
+            raise ValueError('unknown action %s, use one of %s' % (action, ', '.join(sorted(SEVERITY))))
+        if scope == SCOPE_ROOM and action in (ACTION_KICK, ACTION_BAN):
+            # The user crossing a room wide limit is not the flooder, use a user or account rule.
+            raise ValueError('a %s rule can not %s, use %s or %s' % (scope, action, ACTION_WARN, ACTION_DROP))
+        if limit < 1 or seconds <= 0:
+            raise ValueError('a rule needs a limit of at least 1 and more than 0 seconds')
+        self.scope = scope
+        self.kind = kind
+        self.limit = limit
+        self.seconds = float(seconds)
+        self.action = action
+        self.rate = limit / self.seconds
+
+    def new_state(self, now):
+        """
+        The state of a new key, [tokens or count, time of the last message, time of the last action, ...]
+
+        :rtype: list
+        """
+        if self.kind == KIND_BUCKET:
+            return [float(self.limit), now, 0.0]
+        # count of the current period, last message, last action, start of the current period, previous count.
+        return [0, now, 0.0, now, 0]
+
+    def allow(self, state, now):
+        """
+        Count a message against the state of a key.
+
+        :param state: The state of the key, from new_state.
+        :type state: list
+        :param now: The time of the message.
+        :type now: float
+        :return: True if the message is within the limit.
+        :rtype: bool
+        """
+        if self.kind == KIND_BUCKET:
+            tokens = state[0] + (now - state[1]) * self.rate
+            if tokens > self.limit:
+                tokens = self.limit
+            state[1] = now
+            if tokens >= 1:
+                state[0] = tokens - 1
+                return True
+            state[0] = tokens
+            return False
+
+        state[1] = now
+        elapsed = now - state[3]
+        if elapsed >= self.seconds:
+            periods = int(elapsed // self.seconds)
+            state[4] = state[0] if periods == 1 else 0
+            state[0] = 0
+            state[3] += periods * self.seconds
+            elapsed = now - state[3]
+        state[0] += 1
+        return state[4] * (1 - elapsed / self.seconds) + state[0] <= self.limit
+
+    def __repr__(self):
+        return 'Rule(%r, %r, %r, %r, %r)' % (self.scope, self.kind, self.limit, self.seconds, self.action)
+
+
+class FloodControl(object):
+    """
+    Checks each message against a set of rules, in constant time per rule.
+
+    The state of each rule is kept in two generations of at most max_keys / 2 keys. A key seen again is
+    moved to the current generation, and when it is full, or older than idle seconds, the previous
+    generation is dropped. So keys not seen for a while are dropped together, without keeping them in
+    the order they were seen. A key that lost its state starts with a full limit.
+
+    This is not thread safe, messages are checked on the read loop.
+    """
+
+    def __init__(self, rules, max_keys=10000, idle=300, cooldown=10):
+        """
+        :param rules: Rule, or (scope, kind, limit, seconds, action) tuples.
+        :type rules: list
+        :param max_keys: The maximum number of users or accounts kept per rule.
+        :type max_keys: int
+        :param idle: Drop the state of a key after this many seconds without messages.
+        :type idle: int | float
+        :param cooldown: A warn, kick or ban is repeated at most once per cooldown seconds for a key,
+        the messages in between are dropped, or handled if the action is a warn.
+        :type cooldown: int | float
+        """
+        self.rules = [rule if isinstance(rule, Rule) else Rule(*rule) for rule in rules]
+        self.max_keys = max_keys
+        self.idle = idle
+        self.cooldown = cooldown
+        # the current and the previous generation of each rule, and the time the current one was started.
+        self._generations = [[{}, {}, 0.0] for _ in self.rules]
+        self._generation_size = max(1, max_keys // 2)
+        self.checked = 0
+        self.expired = 0
+        self.actions = dict((action, 0) for action in SEVERITY)
+
+    def check(self, handle, account='', now=None):
+        """
+        Count a message against the rules.
+
+        :param handle: The handle of the sender.
+        :type handle: int
+        :param account: The account of the sender, '' if not signed in.
+        :type account: str
+        :param now: The time of the message, None for now.
+        :type now: float | None
+        :return: None if the message is within all limits, else (action, rule) of the most severe rule broken.
+        :rtype: tuple | None
+        """
+        if now is None:
+            now = time.time()
+        self.checked += 1
+        verdict = None
+        for rule, generations in zip(self.rules, self._generations):
+            if rule.scope == SCOPE_USER:
+                key = handle
+            elif rule.scope == SCOPE_ACCOUNT:
+                if not account:
+                    continue
+                key = account
+            else:
+                key = SCOPE_ROOM
+
+            state = generations[0].get(key)
+            if state is None:
+                state = generations[1].pop(key, None)
+                if state is None:
+                    state = rule.new_state(now)
+                if len(generations[0]) >= self._generation_size or now - generations[2] > self.idle:
+                    self.expired += len(generations[1])
+                    generations[1] = generations[0]
+                    generations[0] = {}
+                    generations[2] = now
+                generations[0][key] = state
+
+            if rule.allow(state, now):
+                continue
+            action = rule.action
+            if action != ACTION_DROP:
+                if now - state[2] < self.cooldown:
+                    if action == ACTION_WARN:
+                        continue
+                    action = ACTION_DROP
+                else:
+                    state[2] = now
+            if verdict is None or SEVERITY[action] > SEVERITY[verdict[0]]:
+                verdict = (action, rule)
+
+        if verdict is not None:
+            self.actions[verdict[0]] += 1
+        return verdict
+
+    def forget(self, handle, account=''):
+        """
+        Drop the state of a user, e.g when they leave the room.
+
+        :param handle: The handle of the user.
+        :type handle: int
+        :param account: The account of the user, kept if ''.
+        :type account: str
+        """
+        for rule, generations in zip(self.rules, self._generations):
+            if rule.scope == SCOPE_USER:
+                key = handle
+            elif rule.scope == SCOPE_ACCOUNT and account:
+                key = account
+            else:
+                continue
+            generations[0].pop(key, None)
+            generations[1].pop(key, None)
+
+    def clear(self):
+        """ Drop the state of all keys. """
+        for generations in self._generations:
+            generations[0].clear()
+            generations[1].clear()
+
+    @property
+    def stats(self):
+        """
+        Returns the number of messages checked, the actions taken, and the keys kept and expired.
+
+        :return: The flood control stats.
+        :rtype: dict
+        """
+        return {
+            'checked': self.checked,
+            'actions': dict(self.actions),
+            'keys': sum(len(generations[0]) + len(generations[1]) for generations in self._generations),
+            'expired': self.expired
+        }
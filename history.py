@@ -0,0 +1,643 @@
+"""
+An append-only chat history, stored in block compressed daily segments.
+
+A segment file, YYYY-MM-DD.hist, is a header followed by blocks. Each block holds the
+crc32 and lengths of its payload, the number of records, the time of the first and last
+record, and the hashes of the nicks and accounts in it, followed by the zlib compressed records.
+
+The block headers are the sparse index: a query walks the headers of a memory mapped
+segment, and decompresses only the blocks that overlap the time range and may hold the user.
+
+e.g python -m history rooms/room_name/history/ --nick some_nick --start "2017-12-24 18:00"
+"""
+import os
+import sys
+import mmap
+import time
+import zlib
+import struct
+import atexit
+import bisect
+import logging
+import argparse
+import threading
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'TCHIS1\n'
+EXTENSION = '.hist'
+
+# Event types.
+MSG = 1
+PVTMSG = 2
+JOIN = 3
+QUIT = 4
+NICK = 5
+BAN = 6
+UNBAN = 7
+
+EVENT_TYPES = {
+    'msg': MSG,
+    'pvtmsg': PVTMSG,
+    'join': JOIN,
+    'quit': QUIT,
+    'nick': NICK,
+    'ban': BAN,
+    'unban': UNBAN
+}
+EVENT_NAMES = dict((event_type, name) for name, event_type in EVENT_TYPES.items())
+
+# time, event type, handle and the lengths of the nick, account and text.
+_RECORD = struct.Struct('<dBiHHI')
+# crc32 and length of the compressed payload, length of the records, record count,
+# time of the first and last record and the number of user hashes.
+_BLOCK = struct.Struct('<IIIIddH')
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def get_history(path, block_size=65536, flush_interval=60):
+    """
+    Get the ChatHistory of a folder, shared by all clients of the process.
+
+    The histories are flushed and closed when the process exits.
+
+    :param path: The history folder, e.g rooms/room_name/history/
+    :type path: str
+    :param block_size: Uncompressed bytes of records compressed together into a block.
+    :type block_size: int
+    :param flush_interval: Maximum seconds records are buffered before their block is written.
+    :type flush_interval: int | float
+    :return: The ChatHistory of the folder.
+    :rtype: ChatHistory
+    """
+    key = os.path.abspath(path)
+    with _stores_lock:
+        if not _stores:
+            atexit.register(close_all)
+        store = _stores.get(key)
+        if store is None:
+            store = ChatHistory(path, block_size=block_size, flush_interval=flush_interval)
+            _stores[key] = store
+        return store
+
+
+def close_all():
+    """ Flush and close the histories opened by get_history. """
+    with _stores_lock:
+        stores = list(_stores.values())
+        _stores.clear()
+    for store in stores:
+        store.close()
+
+
+def user_hash(name):
+    """
+    The hash of a nick or account, as stored in the block headers. Names are compared case insensitive.
+
+    :param name: The nick or account.
+    :type name: str
+    :rtype: int
+    """
+    if not isinstance(name, bytes):
+        name = name.encode('utf-8')
+    return zlib.crc32(name.lower()) & 0xffffffff
+
+
+def _text(value):
+    """ The utf-8 bytes of a value. """
+    if value is None:
+        return b''
+    if isinstance(value, bytes):
+        return value
+    if not isinstance(value, type(u'')):
+        value = u'%s' % value
+    return value.encode('utf-8')
+
+
+class Record(object):
+    """ A chat history record. """
+
+    __slots__ = ('time', 'event', 'handle', 'nick', 'account', 'text')
+
+    def __init__(self, timestamp, event, handle, nick, account, text):
+        self.time = timestamp
+        self.event = event
+        self.handle = handle
+        self.nick = nick
+        self.account = account
+        self.text = text
+
+    @property
+    def event_name(self):
+        """ The tc name of the event type, e.g msg """
+        return EVENT_NAMES.get(self.event, str(self.event))
+
+    def __repr__(self):
+        return 'Record(%r, %r, %r, %r, %r, %r)' % (self.time, self.event_name, self.handle,
+                                                   self.nick, self.account, self.text)
+
+
+def encode_record(timestamp, event, handle, nick, account, text):
+    """
+    Encode a record.
+
+    :return: The length prefixed record.
+    :rtype: bytes
+    """
+    nick, account, text = _text(nick), _text(account), _text(text)
+    return _RECORD.pack(timestamp, event, handle or 0, len(nick), len(account), len(text)) + nick + account + text
+
+
+def decode_records(data, start=None, end=None, names=None):
+    """
+    Decode the records of a block.
+
+    :param data: The uncompressed records.
+    :type data: bytes
+    :param start: Skip records before this time, None to decode all.
+    :type start: float | None
+    :param end: Skip records after this time, None to decode all.
+    :type end: float | None
+    :param names: Skip records unless the lower case utf-8 nick or account is in names, None to decode all.
+    :type names: set | None
+    :return: A generator of Record.
+    :rtype: generator
+    """
+    offset = 0
+    length = len(data)
+    size = _RECORD.size
+    while offset < length:
+        timestamp, event, handle, nick_len, account_len, text_len = _RECORD.unpack_from(data, offset)
+        offset += size
+        if (start is not None and timestamp < start) or (end is not None and timestamp > end):
+            offset += nick_len + account_len + text_len
+            continue
+        nick = data[offset:offset + nick_len]
+        offset += nick_len
+        account = data[offset:offset + account_len]
+        offset += account_len
+        if names is not None and nick.lower() not in names and account.lower() not in names:
+            offset += text_len
+            continue
+        nick = nick.decode('utf-8', 'replace')
+        account = account.decode('utf-8', 'replace')
+        text = data[offset:offset + text_len].decode('utf-8', 'replace')
+        offset += text_len
+        yield Record(timestamp, event, handle, nick, account, text)
+
+
+class _Block(object):
+    """ The index entry of a block. """
+
+    __slots__ = ('offset', 'crc', 'length', 'raw_length', 'count', 'first', 'last', 'users')
+
+    def __init__(self, offset, crc, length, raw_length, count, first, last, users):
+        self.offset = offset
+        self.crc = crc
+        self.length = length
+        self.raw_length = raw_length
+        self.count = count
+        self.first = first
+        self.last = last
+        self.users = users
+
+
+class Segment(object):
+    """ A memory mapped segment file and the index of its blocks, extended as the file grows. """
+
+    def __init__(self, file_name):
+        """
+        :param file_name: The path and file name of the segment.
+        :type file_name: str
+        """
+        self.file_name = file_name
+        self.blocks = []
+        self._lasts = []
+        self._file = None
+        self._map = None
+        self._size = 0
+        # the end of the last complete block.
+        self.valid_end = len(MAGIC)
+
+    def refresh(self):
+        """ Map the file again if it grew, and index the new blocks. """
+        size = os.path.getsize(self.file_name)
+        if size == self._size:
+            return
+        self.close()
+        self._file = open(self.file_name, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._size = size
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError('not a chat history segment: %s' % self.file_name)
+
+        m = self._map
+        offset = self.valid_end
+        while offset + _BLOCK.size <= size:
+            crc, length, raw_length, count, first, last, user_count = _BLOCK.unpack_from(m, offset)
+            users_start = offset + _BLOCK.size
+            payload = users_start + user_count * 4
+            end = payload + length
+            if end > size:
+                break
+            users = frozenset(struct.unpack_from('<%sI' % user_count, m, users_start))
+            self.blocks.append(_Block(payload, crc, length, raw_length, count, first, last, users))
+            self._lasts.append(last)
+            offset = end
+        self.valid_end = offset
+        if offset < size:
+            log.debug('incomplete block at %s of %s' % (offset, self.file_name))
+
+    def read(self, start=None, end=None, users=None, until=None, names=None):
+        """
+        Read the records of the blocks that may match.
+
+        Blocks are in time order, so the first block is found by bisecting the time of the last records.
+
+        :param start: The earliest time, None for the start of the segment.
+        :type start: float | None
+        :param end: The latest time, None for the end of the segment.
+        :type end: float | None
+        :param users: The user hashes, a block is read only if it has one of them. None to read all blocks.
+        :type users: set | None
+        :param until: Only read the blocks before this file offset, None to read all blocks.
+        :type until: int | None
+        :param names: Only decode the records of these lower case utf-8 nicks or accounts, None to decode all.
+        :type names: set | None
+        :return: A generator of Record.
+        :rtype: generator
+        """
+        self.refresh()
+        i = 0 if start is None else bisect.bisect_left(self._lasts, start)
+        for block in self.blocks[i:]:
+            if end is not None and block.first > end:
+                break
+            if until is not None and block.offset >= until:
+                break
+            if users is not None and not (users & block.users):
+                continue
+            data = self._map[block.offset:block.offset + block.length]
+            if zlib.crc32(data) & 0xffffffff != block.crc:
+                log.error('corrupt block at %s of %s' % (block.offset, self.file_name))
+                continue
+            for record in decode_records(zlib.decompress(data), start, end, names):
+                yield record
+
+    def close(self):
+        """ Unmap the file. """
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._size = 0
+
+
+class ChatHistory(object):
+    """
+    Appends records to the segment of the day, and queries them by time and user.
+
+    Records are buffered until block_size bytes are buffered, flush_interval
+    has passed or the day changes. A flusher thread writes a buffered block
+    once it is flush_interval old, also when no more records arrive.
+    This is safe to call from any thread.
+    """
+
+    def __init__(self, path, block_size=65536, flush_interval=60, level=6):
+        """
+        :param path: The history folder, created if it does not exist.
+        :type path: str
+        :param block_size: Uncompressed bytes of records compressed together into a block.
+        :type block_size: int
+        :param flush_interval: Maximum seconds records are buffered before their block is written.
+        :type flush_interval: int | float
+        :param level: The zlib compression level.
+        :type level: int
+        """
+        self.path = path
+        self.block_size = block_size
+        self.flush_interval = flush_interval
+        self.level = level
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._buffered = 0
+        self._users = set()
+        self._first = None
+        self._last = None
+        # the time the buffered block was started, for the flusher thread.
+        self._started = None
+        self._day = None
+        # the local day of the last appended record, and when it starts and ends.
+        self._day_range = (None, 0, 0)
+        self._hashes = {}
+        self._file = None
+        self._file_day = None
+        self._segments = {}
+        self._read_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._flusher = None
+        self._closed = False
+
+        self.records = 0
+        self.failed = 0
+        self.blocks = 0
+        self.bytes_raw = 0
+        self.bytes_written = 0
+
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def append(self, timestamp, event, handle=0, nick='', account='', text=''):
+        """
+        Append a record.
+
+        :param timestamp: The time of the event.
+        :type timestamp: float
+        :param event: The event type, e.g MSG
+        :type event: int
+        :param handle: The handle of the user, or the ban ID.
+        :type handle: int
+        :param nick: The nick of the user.
+        :type nick: str
+        :param account: The account of the user.
+        :type account: str
+        :param text: The message, or the old nick of a nick change.
+        :type text: str
+        """
+        data = encode_record(timestamp, event, handle, nick, account, text)
+        day, day_start, day_end = self._day_range
+        if not day_start <= timestamp < day_end:
+            day, day_start, day_end = self._day_range = self._day_of(timestamp)
+        with self._lock:
+            if self._buffer and (day != self._day or timestamp - self._first > self.flush_interval):
+                self._flush()
+            if not self._buffer:
+                self._day = day
+                self._first = timestamp
+                self._started = time.time()
+                if self._flusher is None and not self._closed:
+                    self._start_flusher()
+                self._wake.set()
+            self._buffer.append(data)
+            self._buffered += len(data)
+            self._last = timestamp
+            if nick:
+                self._users.add(self._hash(nick))
+            if account:
+                self._users.add(self._hash(account))
+            self.records += 1
+            if self._buffered >= self.block_size or len(self._users) >= 0xfffe:
+                self._flush()
+
+    def _start_flusher(self):
+        """ Start the thread writing the buffered block after flush_interval. Called with the lock held. """
+        self._flusher = threading.Thread(target=self._run, name='chat-history-flusher')
+        self._flusher.daemon = True
+        self._flusher.start()
+
+    def _run(self):
+        while not self._closed:
+            with self._lock:
+                timeout = None
+                if self._buffer:
+                    timeout = max(0, self._started + self.flush_interval - time.time())
+            self._wake.wait(timeout)
+            self._wake.clear()
+            if self._closed:
+                break
+            try:
+                with self._lock:
+                    if self._buffer and time.time() - self._started >= self.flush_interval:
+                        self._flush()
+            except Exception as e:
+                log.error('history flusher error: %s' % e, exc_info=True)
+
+    @staticmethod
+    def _day_of(timestamp):
+        """ The local date of a time, and the times the day starts and ends. """
+        t = time.localtime(timestamp)
+        start = time.mktime((t.tm_year, t.tm_mon, t.tm_mday, 0, 0, 0, 0, 0, -1))
+        end = time.mktime((t.tm_year, t.tm_mon, t.tm_mday + 1, 0, 0, 0, 0, 0, -1))
+        return time.strftime('%Y-%m-%d', t), start, end
+
+    def _hash(self, name):
+        """ user_hash, cached for the names seen recently. """
+        h = self._hashes.get(name)
+        if h is None:
+            if len(self._hashes) >= 10000:
+                self._hashes.clear()
+            h = self._hashes[name] = user_hash(name)
+        return h
+
+    def flush(self):
+        """ Write the buffered records as a block. """
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._buffer:
+            return
+        raw = b''.join(self._buffer)
+        payload = zlib.compress(raw, self.level)
+        users = sorted(self._users)
+        header = _BLOCK.pack(zlib.crc32(payload) & 0xffffffff, len(payload), len(raw), len(self._buffer),
+                             self._first, self._last, len(users))
+        try:
+            f = self._segment_file(self._day)
+            f.write(header + struct.pack('<%sI' % len(users), *users) + payload)
+            f.flush()
+        except (IOError, OSError) as e:
+            self.failed += len(self._buffer)
+            log.error('failed to write %s records to %s: %s' % (len(self._buffer), self.path, e), exc_info=True)
+        else:
+            self.blocks += 1
+            self.bytes_raw += len(raw)
+            self.bytes_written += len(header) + len(users) * 4 + len(payload)
+        self._buffer = []
+        self._buffered = 0
+        self._users = set()
+        self._first = self._last = self._started = None
+
+    def _segment_file(self, day):
+        """ The segment file of a day, open for appending. An incomplete block at the end is cut off. """
+        if self._file is not None and self._file_day == day:
+            return self._file
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        file_name = os.path.join(self.path, day + EXTENSION)
+        if os.path.exists(file_name) and os.path.getsize(file_name) > 0:
+            segment = Segment(file_name)
+            segment.refresh()
+            valid_end = segment.valid_end
+            segment.close()
+            if valid_end < os.path.getsize(file_name):
+                log.warning('cutting off an incomplete block at %s of %s' % (valid_end, file_name))
+                with open(file_name, 'r+b') as f:
+                    f.truncate(valid_end)
+            self._file = open(file_name, 'ab')
+        else:
+            self._file = open(file_name, 'wb')
+            self._file.write(MAGIC)
+        self._file_day = day
+        return self._file
+
+    def days(self):
+        """
+        Returns the days that have a segment, in order.
+
+        :return: A list of dates, e.g ['2017-12-24', '2017-12-25']
+        :rtype: list
+        """
+        return sorted(name[:-len(EXTENSION)] for name in os.listdir(self.path) if name.endswith(EXTENSION))
+
+    def _segment(self, day):
+        segment = self._segments.get(day)
+        if segment is None:
+            segment = Segment(os.path.join(self.path, day + EXTENSION))
+            self._segments[day] = segment
+        return segment
+
+    def query(self, start=None, end=None, nick=None, account=None, handle=None, events=None, limit=None):
+        """
+        Find records by time range and user, oldest first.
+
+        Only the segments of the days in the range are opened, and only the blocks that overlap the range,
+        and have the nick or account in their user hashes, are decompressed. Buffered records are included.
+
+        :param start: The earliest time, None for no limit.
+        :type start: float | None
+        :param end: The latest time, None for no limit.
+        :type end: float | None
+        :param nick: Only records of this nick, case insensitive.
+        :type nick: str | None
+        :param account: Only records of this account, case insensitive.
+        :type account: str | None
+        :param handle: Only records of this handle.
+        :type handle: int | None
+        :param events: Only records of these event types, e.g (MSG, PVTMSG)
+        :type events: tuple | None
+        :param limit: The maximum number of records.
+        :type limit: int | None
+        :return: A list of Record.
+        :rtype: list
+        """
+        users = names = None
+        if nick or account:
+            users = set(user_hash(name) for name in (nick, account) if name)
+            names = set(_text(name).lower() for name in (nick, account) if name)
+        nick = nick.lower() if nick else None
+        account = account.lower() if account else None
+
+        def matches(record):
+            if start is not None and record.time < start:
+                return False
+            if end is not None and record.time > end:
+                return False
+            if events is not None and record.event not in events:
+                return False
+            if handle is not None and record.handle != handle:
+                return False
+            if nick is not None and record.nick.lower() != nick:
+                return False
+            if account is not None and record.account.lower() != account:
+                return False
+            return True
+
+        first_day = time.strftime('%Y-%m-%d', time.localtime(start)) if start is not None else None
+        last_day = time.strftime('%Y-%m-%d', time.localtime(end)) if end is not None else None
+        with self._lock:
+            # blocks written after this are read from the buffer, so appending is not blocked while reading.
+            buffered = list(self._buffer)
+            until = {self._file_day: self._file.tell()} if self._file is not None else {}
+
+        results = []
+        with self._read_lock:
+            for day in self.days():
+                if (first_day is not None and day < first_day) or (last_day is not None and day > last_day):
+                    continue
+                for record in self._segment(day).read(start, end, users, until.get(day), names):
+                    if matches(record):
+                        results.append(record)
+                        if limit is not None and len(results) >= limit:
+                            return results
+        for record in decode_records(b''.join(buffered)):
+            if matches(record):
+                results.append(record)
+                if limit is not None and len(results) >= limit:
+                    break
+        return results
+
+    def close(self):
+        """ Write the buffered records, stop the flusher thread and close the files. """
+        self._closed = True
+        self._wake.set()
+        with self._lock:
+            self._flush()
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        with self._read_lock:
+            for segment in self._segments.values():
+                segment.close()
+            self._segments.clear()
+
+    @property
+    def stats(self):
+        """
+        Returns the records appended and failed to write, blocks written, and the raw and written bytes.
+
+        :return: The history stats.
+        :rtype: dict
+        """
+        return {
+            'records': self.records,
+            'failed': self.failed,
+            'blocks': self.blocks,
+            'buffered': len(self._buffer),
+            'bytes_raw': self.bytes_raw,
+            'bytes_written': self.bytes_written,
+            'ratio': float(self.bytes_raw) / self.bytes_written if self.bytes_written else None
+        }
+
+
+def _parse_time(value):
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d %H:%M', '%Y-%m-%d'):
+        try:
+            return time.mktime(time.strptime(value, fmt))
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError('expected YYYY-MM-DD [HH:MM[:SS]], got %s' % value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Search a chat history.')
+    parser.add_argument('path', help='the history folder, e.g rooms/room_name/history/')
+    parser.add_argument('--start', type=_parse_time, help='YYYY-MM-DD [HH:MM[:SS]]')
+    parser.add_argument('--end', type=_parse_time, help='YYYY-MM-DD [HH:MM[:SS]]')
+    parser.add_argument('--nick')
+    parser.add_argument('--account')
+    parser.add_argument('--event', action='append', choices=sorted(EVENT_TYPES), help='can be given more than once')
+    parser.add_argument('--limit', type=int)
+    args = parser.parse_args()
+
+    store = ChatHistory(args.path)
+    events = tuple(EVENT_TYPES[e] for e in args.event) if args.event else None
+    for record in store.query(args.start, args.end, nick=args.nick, account=args.account,
+                              events=events, limit=args.limit):
+        line = u'[%s] %s %s:%s %s %s' % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.time)),
+                                          record.event_name, record.nick, record.handle,
+                                          record.account, record.text)
+        if sys.version_info[0] == 2:
+            line = line.encode('utf-8')
+        print (line)
+    store.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,270 @@
+""" Writes console output and chat logs on a background thread, in batches. """
+import os
+import sys
+import time
+import atexit
+import logging
+import threading
+import traceback
+
+import config
+
+log = logging.getLogger(__name__)
+
+# What to do when the queue is full.
+POLICY_DROP = 'drop'
+POLICY_BLOCK = 'block'
+
+_shared = None
+_shared_lock = threading.Lock()
+
+_timestamps = {}
+
+
+def get_sink():
+    """
+    Get the process wide LogSink, shared by all clients.
+
+    The sink is flushed and closed when the process exits.
+
+    :return: The shared LogSink.
+    :rtype: LogSink
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = LogSink(flush_interval=config.LOG_FLUSH_INTERVAL, flush_size=config.LOG_FLUSH_SIZE,
+                              max_queue=config.LOG_QUEUE_SIZE, policy=config.LOG_FULL_POLICY)
+            atexit.register(_shared.close)
+        return _shared
+
+
+def timestamp(fmt, now=None):
+    """
+    time.strftime, formatted at most once per second for each format.
+
+    :param fmt: The time format, e.g '%H:%M:%S'
+    :type fmt: str
+    :param now: The time, None for now.
+    :type now: float | None
+    :return: The formatted local time.
+    :rtype: str
+    """
+    second = int(now or time.time())
+    cached = _timestamps.get(fmt)
+    if cached is not None and cached[0] == second:
+        return cached[1]
+    text = time.strftime(fmt, time.localtime(second))
+    _timestamps[fmt] = (second, text)
+    return text
+
+
+class LogSink(object):
+    """
+    A queue of console lines and log file lines, written by a background thread.
+
+    The queue is written every flush_interval, or as soon as flush_size lines are queued.
+    Log files are kept open, a file per folder and day named like 2017-12-31.log
+    """
+
+    def __init__(self, flush_interval=0.2, flush_size=500, max_queue=10000, policy=POLICY_DROP):
+        """
+        Create the sink and start its thread.
+
+        :param flush_interval: The maximum seconds a line waits before it is written.
+        :type flush_interval: int | float
+        :param flush_size: Write as soon as this many lines are queued.
+        :type flush_size: int
+        :param max_queue: The maximum number of queued lines, 0 for no limit.
+        :type max_queue: int
+        :param policy: POLICY_DROP to drop lines when the queue is full, POLICY_BLOCK to wait for room.
+        :type policy: str
+        """
+        if policy not in (POLICY_DROP, POLICY_BLOCK):
+            raise ValueError('unknown policy %s, use %s or %s' % (policy, POLICY_DROP, POLICY_BLOCK))
+        self.flush_interval = flush_interval
+        self.flush_size = max(1, flush_size)
+        self.max_queue = max_queue
+        self.policy = policy
+
+        self._queue = []
+        self._lock = threading.Lock()
+        # _cond wakes the thread, _flushed the callers waiting for room or for a flush.
+        self._cond = threading.Condition(self._lock)
+        self._flushed = threading.Condition(self._lock)
+        self._writing = False
+        self._running = True
+        # open log files by folder, with the day they were opened for.
+        self._files = {}
+
+        self.queued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+
+        self._thread = threading.Thread(target=self._run, name='log-sink')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def console(self, line):
+        """
+        Queue a line for the console.
+
+        :param line: The line, without a line break.
+        :type line: str
+        :return: True if queued, False if dropped.
+        :rtype: bool
+        """
+        return self._put((None, line))
+
+    def log(self, path, line):
+        """
+        Queue a line for the log file of the day in a folder.
+
+        :param path: The folder, created if it does not exist, e.g rooms/room_name/logs/
+        :type path: str
+        :param line: The line, without a line break.
+        :type line: str
+        :return: True if queued, False if dropped.
+        :rtype: bool
+        """
+        return self._put((path, line))
+
+    def _put(self, item):
+        with self._lock:
+            if not self._running:
+                return False
+            if self.max_queue and len(self._queue) >= self.max_queue:
+                if self.policy == POLICY_DROP:
+                    self.dropped += 1
+                    return False
+                while self._running and len(self._queue) >= self.max_queue:
+                    self._flushed.wait(1)
+            self._queue.append(item)
+            self.queued += 1
+            if len(self._queue) == self.flush_size:
+                self._cond.notify()
+        return True
+
+    def flush(self, timeout=5):
+        """
+        Wait until the lines queued so far are written.
+
+        :param timeout: The maximum seconds to wait.
+        :type timeout: int | float
+        :return: True if written, False if the wait timed out.
+        :rtype: bool
+        """
+        if threading.current_thread() is self._thread:
+            return False
+        deadline = time.time() + timeout
+        with self._cond:
+            self._cond.notify()
+            while self._queue or self._writing:
+                remaining = deadline - time.time()
+                if remaining <= 0 or not self._thread.is_alive():
+                    return False
+                self._flushed.wait(remaining)
+        return True
+
+    def close(self):
+        """ Write the queued lines, stop the thread and close the log files. """
+        with self._cond:
+            if not self._running:
+                return
+            self._running = False
+            self._cond.notify()
+        self._thread.join(5)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if self._running and len(self._queue) < self.flush_size:
+                    self._cond.wait(self.flush_interval)
+                batch, self._queue = self._queue, []
+                self._writing = bool(batch)
+                running = self._running
+                self._flushed.notify_all()
+            if batch:
+                self._write(batch)
+            with self._cond:
+                self._writing = False
+                self._flushed.notify_all()
+            if not running and not batch:
+                break
+        self._close_files()
+
+    def _write(self, batch):
+        self.batches += 1
+        day = time.strftime('%Y-%m-%d')
+        console = False
+        files = set()
+        for path, line in batch:
+            try:
+                if path is None:
+                    sys.stdout.write(line + '\n')
+                    console = True
+                else:
+                    f = self._file(path, day)
+                    if not isinstance(line, bytes):
+                        line = line.encode('utf-8', 'ignore')
+                    f.write(line + b'\n')
+                    files.add(f)
+            except (IOError, OSError, UnicodeError) as e:
+                self.failed += 1
+                log.error('failed to write %s line: %s' % (path or 'console', e), exc_info=True)
+                if config.DEBUG_MODE:
+                    traceback.print_exc()
+            else:
+                self.written += 1
+
+        if console:
+            try:
+                sys.stdout.flush()
+            except (IOError, OSError) as e:
+                log.debug('failed to flush the console: %s' % e)
+        for f in files:
+            try:
+                f.flush()
+            except (IOError, OSError) as e:
+                log.error('failed to flush %s: %s' % (f.name, e))
+
+    def _file(self, path, day):
+        """ The open log file of a folder, reopened when the day changes. """
+        opened = self._files.get(path)
+        if opened is not None:
+            if opened[0] == day:
+                return opened[1]
+            opened[1].close()
+        if not os.path.exists(path):
+            os.makedirs(path)
+        f = open(os.path.join(path, day + '.log'), 'ab')
+        self._files[path] = (day, f)
+        return f
+
+    def _close_files(self):
+        for _, f in self._files.values():
+            try:
+                f.close()
+            except (IOError, OSError) as e:
+                log.debug('failed to close %s: %s' % (f.name, e))
+        self._files.clear()
+
+    @property
+    def stats(self):
+        """
+        Returns the number of lines queued, written, dropped and failed, the queue depth and open files.
+
+        :return: The sink stats.
+        :rtype: dict
+        """
+        return {
+            'queue_depth': len(self._queue),
+            'queued': self.queued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'batches': self.batches,
+            'open_files': len(self._files)
+        }
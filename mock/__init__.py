@@ -0,0 +1,10 @@
+"""
+A local stand-in for tinychat, for load and integration testing without tinychat.com
+
+e.g python -m mock.server --users 10000 --msg-rate 50, or in a test:
+
+    server = mock.MockServer(scenarios=[mock.MessageStorm(rate=20)]).start()
+    mock.use(server)
+"""
+from mock.server import MockServer, MockRoom, use
+from mock.scenarios import Scenario, BigRoom, JoinFlood, MessageStorm
@@ -0,0 +1,162 @@
+""" The server side of HTTP requests, the websocket handshake and websocket frames. """
+import json
+import base64
+import struct
+import hashlib
+from collections import OrderedDict
+
+WS_GUID = '258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+
+_STATUS = {
+    200: 'OK',
+    404: 'Not Found',
+    405: 'Method Not Allowed'
+}
+
+
+def encode_event(tc, fields=None, **kwargs):
+    """
+    Encode a tc event the way tinychat does, compact and with tc as the first key.
+
+    :param tc: The event name.
+    :type tc: str
+    :param fields: The event fields, for field names that are not valid keyword arguments, e.g self.
+    :type fields: dict | None
+    :return: The json frame.
+    :rtype: str
+    """
+    if fields is not None:
+        kwargs.update(fields)
+    event = OrderedDict([('tc', tc)])
+    for key in sorted(kwargs):
+        event[key] = kwargs[key]
+    return json.dumps(event, separators=(',', ':'))
+
+
+def encode_frame(payload, opcode=0x1):
+    """
+    Encode an unmasked server to client frame.
+
+    :param payload: The frame payload.
+    :type payload: str | bytes
+    :param opcode: The frame opcode, 0x1 text, 0x8 close.
+    :type opcode: int
+    :return: The encoded frame.
+    :rtype: bytes
+    """
+    if not isinstance(payload, bytes):
+        payload = payload.encode('utf-8')
+    length = len(payload)
+    if length < 126:
+        header = struct.pack('!BB', 0x80 | opcode, length)
+    elif length < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, length)
+    return header + payload
+
+
+def _recv_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise EOFError('connection closed')
+        data += chunk
+    return data
+
+
+def read_frame(sock):
+    """
+    Read a masked client to server frame.
+
+    :param sock: The client socket.
+    :type sock: socket.socket
+    :return: The opcode and the unmasked payload.
+    :rtype: tuple
+    """
+    b1, b2 = struct.unpack('!BB', _recv_exact(sock, 2))
+    opcode = b1 & 0x0f
+    length = b2 & 0x7f
+    if length == 126:
+        length = struct.unpack('!H', _recv_exact(sock, 2))[0]
+    elif length == 127:
+        length = struct.unpack('!Q', _recv_exact(sock, 8))[0]
+    mask = bytearray(_recv_exact(sock, 4)) if b2 & 0x80 else None
+    payload = bytearray(_recv_exact(sock, length))
+    if mask is not None:
+        for i in range(length):
+            payload[i] ^= mask[i % 4]
+    return opcode, bytes(payload)
+
+
+def read_request(sock):
+    """
+    Read a HTTP request.
+
+    :param sock: The client socket.
+    :type sock: socket.socket
+    :return: The method, the path (with the query string), the headers with lower case names, and the body.
+    :rtype: tuple
+    """
+    request = b''
+    while b'\r\n\r\n' not in request:
+        chunk = sock.recv(4096)
+        if not chunk:
+            raise EOFError('connection closed during the request')
+        request += chunk
+
+    head, body = request.split(b'\r\n\r\n', 1)
+    lines = head.decode('utf-8').split('\r\n')
+    method, path = lines[0].split(' ')[:2]
+    headers = {}
+    for line in lines[1:]:
+        if ':' in line:
+            name, value = line.split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+
+    length = int(headers.get('content-length', 0))
+    if len(body) < length:
+        body += _recv_exact(sock, length - len(body))
+    return method, path, headers, body
+
+
+def accept_websocket(sock, headers):
+    """
+    Complete the server side of the websocket handshake.
+
+    :param sock: The client socket.
+    :type sock: socket.socket
+    :param headers: The request headers, as returned by read_request.
+    :type headers: dict
+    """
+    digest = hashlib.sha1((headers['sec-websocket-key'] + WS_GUID).encode('utf-8')).digest()
+    accept = base64.b64encode(digest).decode('utf-8')
+    response = ('HTTP/1.1 101 Switching Protocols\r\n'
+                'Upgrade: websocket\r\n'
+                'Connection: Upgrade\r\n'
+                'Sec-WebSocket-Protocol: tc\r\n'
+                'Sec-WebSocket-Accept: %s\r\n\r\n' % accept)
+    sock.sendall(response.encode('utf-8'))
+
+
+def send_response(sock, status, body, content_type='application/json'):
+    """
+    Send a HTTP response, and close the connection afterwards.
+
+    :param sock: The client socket.
+    :type sock: socket.socket
+    :param status: The status code.
+    :type status: int
+    :param body: The response body.
+    :type body: str | bytes
+    :param content_type: The content type.
+    :type content_type: str
+    """
+    if not isinstance(body, bytes):
+        body = body.encode('utf-8')
+    head = ('HTTP/1.1 %s %s\r\n'
+            'Content-Type: %s; charset=utf-8\r\n'
+            'Content-Length: %s\r\n'
+            'Connection: close\r\n\r\n' % (status, _STATUS.get(status, ''), content_type, len(body)))
+    sock.sendall(head.encode('utf-8') + body)
@@ -0,0 +1,134 @@
+"""
+Scripted load for the rooms of a MockServer.
+
+A scenario is started in every room the server creates. setup runs when the room is created,
+before the first client joins, and run in a thread of its own until the room is stopped.
+"""
+import time
+import itertools
+
+
+def paced(rate, stopped, tick=0.01):
+    """
+    Pace events at a rate, in batches of the events due every tick.
+
+    :param rate: Events per second.
+    :type rate: int | float
+    :param stopped: Ends the pacing when set.
+    :type stopped: threading.Event
+    :param tick: Seconds between batches.
+    :type tick: float
+    :return: A generator of the number of events due.
+    :rtype: generator
+    """
+    started = time.time()
+    done = 0
+    while not stopped.is_set():
+        due = int((time.time() - started) * rate) - done
+        if due > 0:
+            done += due
+            yield due
+        stopped.wait(tick if rate * tick >= 1 else 1.0 / rate)
+
+
+class Scenario(object):
+    """ Base scenario, doing nothing. """
+
+    def setup(self, room):
+        """
+        Prepare a room, before the first client joins.
+
+        :param room: The room.
+        :type room: mock.server.MockRoom
+        """
+        pass
+
+    def run(self, room):
+        """
+        Drive a room until room.stopped is set.
+
+        :param room: The room.
+        :type room: mock.server.MockRoom
+        """
+        pass
+
+
+class BigRoom(Scenario):
+    """ A room already holding many guests, sent in the userlist of every client joining. """
+
+    def __init__(self, users=10000, mods=0):
+        """
+        :param users: The number of guests.
+        :type users: int
+        :param mods: How many of them are moderators.
+        :type mods: int
+        """
+        self.users = users
+        self.mods = mods
+
+    def setup(self, room):
+        # under the room lock, so a client joining meanwhile waits for the whole userlist.
+        with room.lock:
+            for i in range(self.users):
+                room.join('guest-%s' % i, mod=i < self.mods)
+
+
+class JoinFlood(Scenario):
+    """ Guests joining at a fixed rate, and optionally leaving again. """
+
+    def __init__(self, count=1000, rate=100, delay=1, leave=False):
+        """
+        :param count: The number of guests joining.
+        :type count: int
+        :param rate: Joins per second.
+        :type rate: int | float
+        :param delay: Seconds to wait before the flood starts, so clients can join first.
+        :type delay: int | float
+        :param leave: Every guest leaves right after joining.
+        :type leave: bool
+        """
+        self.count = count
+        self.rate = rate
+        self.delay = delay
+        self.leave = leave
+
+    def run(self, room):
+        if room.stopped.wait(self.delay):
+            return
+        joined = 0
+        for due in paced(self.rate, room.stopped):
+            for _ in range(min(due, self.count - joined)):
+                user = room.join('flood-%s' % joined)
+                joined += 1
+                if self.leave:
+                    room.quit(user['handle'])
+            if joined >= self.count:
+                break
+
+
+class MessageStorm(Scenario):
+    """ Guests sending chat messages at a fixed rate. """
+
+    def __init__(self, rate=10, users=100, text='mock message'):
+        """
+        :param rate: Messages per second.
+        :type rate: int | float
+        :param users: The number of guests sending the messages, joined in setup.
+        :type users: int
+        :param text: The message text.
+        :type text: str
+        """
+        self.rate = rate
+        self.users = users
+        self.text = text
+        self._senders = {}
+
+    def setup(self, room):
+        with room.lock:
+            self._senders[room.name] = [room.join('chatter-%s' % i)['handle'] for i in range(self.users)]
+
+    def run(self, room):
+        senders = itertools.cycle(self._senders.pop(room.name))
+        for due in paced(self.rate, room.stopped):
+            for _ in range(due):
+                room.say(next(senders), self.text)
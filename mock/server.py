@@ -0,0 +1,471 @@
+"""
+A local stand-in for tinychat, serving the HTTP API and the tc websocket protocol on one port.
+
+e.g python -m mock.server --port 8080 --users 10000 --msg-rate 50
+"""
+import json
+import time
+import socket
+import logging
+import argparse
+import threading
+import itertools
+
+try:
+    import SocketServer as socketserver
+except ImportError:
+    import socketserver
+
+try:
+    from urlparse import urlparse, parse_qs
+except ImportError:
+    from urllib.parse import urlparse, parse_qs
+
+from mock import protocol
+from mock import scenarios as _scenarios
+
+log = logging.getLogger(__name__)
+
+
+def make_user(handle, nick, username='', mod=False, owner=False, lurker=False):
+    """
+    Create the user info tinychat sends in join and userlist events.
+
+    :param handle: The user ID (handle).
+    :type handle: int
+    :param nick: The nick name.
+    :type nick: str
+    :param username: The account name, empty for guests.
+    :type username: str
+    :return: The user info.
+    :rtype: dict
+    """
+    return {
+        'achievement_url': '',
+        'avatar': 'https://avatars.tinychat.com/default/%s.png' % (handle % 10),
+        'featured': False,
+        'giftpoints': 0,
+        'handle': handle,
+        'lurker': lurker,
+        'mod': mod,
+        'nick': nick,
+        'owner': owner,
+        'session_id': '%s-mock' % handle,
+        'subscription': 0,
+        'username': username
+    }
+
+
+class Connection(object):
+    """ A connected websocket client. Frames can be sent from any thread. """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self.room = None
+        self.user = None
+        self.closed = False
+        self._lock = threading.Lock()
+
+    @property
+    def handle(self):
+        return self.user['handle'] if self.user is not None else None
+
+    def send(self, tc, fields=None, **kwargs):
+        """ Encode and send a tc event. """
+        self.send_raw(protocol.encode_frame(protocol.encode_event(tc, fields, **kwargs)))
+
+    def send_raw(self, frame):
+        """ Send an already encoded websocket frame. """
+        if self.closed:
+            return
+        try:
+            with self._lock:
+                self.sock.sendall(frame)
+        except socket.error:
+            self.closed = True
+
+
+class MockRoom(object):
+    """ A room with its users, banlist and connected clients. """
+
+    def __init__(self, name):
+        self.name = name
+        self.users = {}
+        self.bans = {}
+        self.connections = {}
+        self.stopped = threading.Event()
+        self._lock = threading.RLock()
+        self._handles = itertools.count(1)
+        self._ban_ids = itertools.count(1)
+
+    @property
+    def lock(self):
+        """ The reentrant lock of the room, held to make several changes before a client joins. """
+        return self._lock
+
+    def join(self, nick, username='', mod=False, connection=None):
+        """
+        Add a user to the room, and broadcast the join.
+
+        :param nick: The nick name.
+        :type nick: str
+        :param username: The account name, empty for guests.
+        :type username: str
+        :param mod: Join as moderator.
+        :type mod: bool
+        :param connection: The connection of a websocket client, None for a virtual user.
+        :type connection: Connection | None
+        :return: The user info.
+        :rtype: dict
+        """
+        with self._lock:
+            user = make_user(next(self._handles), nick, username=username, mod=mod)
+            self.users[user['handle']] = user
+            if connection is not None:
+                self.connections[user['handle']] = connection
+            self.broadcast('join', exclude=connection, **user)
+        return user
+
+    def admit(self, nick, connection):
+        """
+        Join a websocket client, and send it the joined and userlist events.
+
+        Broadcasts wait until the userlist is sent, so the client does not
+        get events of users it does not know about yet.
+
+        :param nick: The nick name.
+        :type nick: str
+        :param connection: The connection of the client.
+        :type connection: Connection
+        :return: The user info.
+        :rtype: dict
+        """
+        with self._lock:
+            others = list(self.users.values())
+            user = self.join(nick, connection=connection)
+            connection.send('joined', {'self': user, 'room': {'name': self.name, 'topic': ''}})
+            connection.send('userlist', users=others)
+        return user
+
+    def kick(self, handle):
+        """ Kick a user out of the room. """
+        connection = self.connections.get(handle)
+        if connection is not None:
+            connection.send('closed', error=12)
+        return self.quit(handle)
+
+    def quit(self, handle):
+        """ Remove a user from the room, and broadcast the quit. """
+        with self._lock:
+            user = self.users.pop(handle, None)
+            self.connections.pop(handle, None)
+        if user is not None:
+            self.broadcast('quit', handle=handle)
+        return user
+
+    def say(self, handle, text):
+        """ Broadcast a chat message from a user to everyone else, if the user is still in the room. """
+        with self._lock:
+            if handle not in self.users:
+                return
+            exclude = self.connections.get(handle)
+        self.broadcast('msg', exclude=exclude, handle=handle, text=text)
+
+    def nick(self, handle, nick):
+        """ Change the nick of a user. """
+        with self._lock:
+            user = self.users.get(handle)
+            if user is None:
+                return
+            user['nick'] = nick
+        self.broadcast('nick', handle=handle, nick=nick)
+
+    def ban(self, handle, moderator):
+        """
+        Ban a user.
+
+        :return: The ban info, or None if the user is not in the room.
+        :rtype: dict | None
+        """
+        with self._lock:
+            user = self.users.get(handle)
+            if user is None:
+                return None
+            ban_id = next(self._ban_ids)
+            self.bans[ban_id] = {'id': ban_id, 'nick': user['nick'], 'username': user['username'],
+                                 'moderator': moderator, 'reason': ''}
+            connection = self.connections.get(handle)
+        if connection is not None:
+            connection.send('closed', error=4)
+        self.quit(handle)
+        return self.bans[ban_id]
+
+    def unban(self, ban_id):
+        """ Remove a ban. Returns the ban info, or None. """
+        with self._lock:
+            return self.bans.pop(ban_id, None)
+
+    def userlist(self):
+        """ Returns a list of the users in the room. """
+        with self._lock:
+            return list(self.users.values())
+
+    def broadcast(self, tc, exclude=None, **fields):
+        """
+        Send an event to the connected clients, encoded once.
+
+        :param tc: The event name.
+        :type tc: str
+        :param exclude: A connection not to send the event to.
+        :type exclude: Connection | None
+        """
+        with self._lock:
+            connections = [c for c in self.connections.values() if c is not exclude]
+        if connections:
+            frame = protocol.encode_frame(protocol.encode_event(tc, **fields))
+            for connection in connections:
+                connection.send_raw(frame)
+
+
+class _Handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        try:
+            method, path, headers, body = protocol.read_request(self.request)
+        except (EOFError, ValueError, socket.error):
+            return
+        self.server.requests += 1
+
+        if headers.get('upgrade', '').lower() == 'websocket':
+            protocol.accept_websocket(self.request, headers)
+            self.server.serve_websocket(Connection(self.request))
+        else:
+            status, content_type, content = self.server.http(method, path)
+            protocol.send_response(self.request, status, content, content_type)
+
+
+class MockServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    """ A threaded server standing in for tinychat.com and its wss endpoint. """
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 1024
+
+    def __init__(self, port=0, scenarios=None, ping_interval=30, rtc_version='2.0.22-4', host='127.0.0.1'):
+        """
+        Create the server.
+
+        :param port: The port to listen on, 0 picks a free port.
+        :type port: int
+        :param scenarios: Scenarios started in every room, when it is created.
+        :type scenarios: list | None
+        :param ping_interval: Seconds between pings sent to every client, 0 for no pings.
+        :type ping_interval: int | float
+        :param rtc_version: The rtc version in the manifest link of the room html.
+        :type rtc_version: str
+        :param host: The address to listen on.
+        :type host: str
+        """
+        socketserver.TCPServer.__init__(self, (host, port), _Handler)
+        self.scenarios = scenarios or []
+        self.ping_interval = ping_interval
+        self.rtc_version = rtc_version
+        self.rooms = {}
+        self.requests = 0
+        self.frames_in = 0
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def url(self):
+        """ The base url of the HTTP API, used in place of https://tinychat.com """
+        return 'http://%s:%s' % self.server_address[:2]
+
+    @property
+    def endpoint(self):
+        """ The ws endpoint, returned with the connect token. """
+        return 'ws://%s:%s/' % self.server_address[:2]
+
+    def start(self):
+        """
+        Serve in a background thread.
+
+        :return: The server.
+        :rtype: MockServer
+        """
+        self._thread = threading.Thread(target=self.serve_forever, name='mock-server')
+        self._thread.daemon = True
+        self._thread.start()
+        if self.ping_interval:
+            t = threading.Thread(target=self._pinger, name='mock-pinger')
+            t.daemon = True
+            t.start()
+        return self
+
+    def stop(self):
+        """ Stop serving, and stop the scenarios of all rooms. """
+        self.shutdown()
+        self.server_close()
+        with self._lock:
+            for room in self.rooms.values():
+                room.stopped.set()
+
+    def room(self, name):
+        """
+        Get a room, creating it and starting the scenarios if it does not exist.
+
+        :param name: The room name.
+        :type name: str
+        :return: The room.
+        :rtype: MockRoom
+        """
+        with self._lock:
+            room = self.rooms.get(name)
+            if room is not None:
+                return room
+            room = MockRoom(name)
+            self.rooms[name] = room
+
+        for scenario in self.scenarios:
+            scenario.setup(room)
+            t = threading.Thread(target=scenario.run, args=(room,), name='mock-scenario')
+            t.daemon = True
+            t.start()
+        return room
+
+    def http(self, method, path):
+        """
+        Answer a HTTP request.
+
+        :return: The status code, the content type and the content.
+        :rtype: tuple
+        """
+        if method != 'GET':
+            return 405, 'text/plain', 'method not allowed'
+
+        url = urlparse(path)
+        parts = url.path.strip('/').split('/')
+        if len(parts) == 2 and parts[0] == 'room':
+            html = ('<!DOCTYPE html><html><head>'
+                    '<link rel="manifest" href="/webrtc/%s/manifest.json">'
+                    '</head><body></body></html>' % self.rtc_version)
+            return 200, 'text/html', html
+
+        if parts[:4] == ['api', 'v1.0', 'room', 'token'] and len(parts) == 5:
+            return 200, 'application/json', json.dumps({'result': 'mock-token-%s' % parts[4],
+                                                        'endpoint': self.endpoint})
+
+        if parts == ['api', 'v1.0', 'user', 'profile']:
+            account = parse_qs(url.query).get('username', [''])[0]
+            return 200, 'application/json', json.dumps({
+                'result': 'success',
+                'biography': 'mock profile of %s' % account,
+                'gender': 'unknown',
+                'location': 'localhost',
+                'role': 'user',
+                'age': 0
+            })
+
+        return 404, 'text/plain', 'not found'
+
+    def serve_websocket(self, connection):
+        """ Read and answer the tc events of a websocket client, until it disconnects. """
+        try:
+            while True:
+                opcode, payload = protocol.read_frame(connection.sock)
+                if opcode == 0x8:
+                    break
+                if opcode != 0x1:
+                    continue
+                self.frames_in += 1
+                self._on_event(connection, json.loads(payload.decode('utf-8')))
+        except (EOFError, ValueError, socket.error):
+            pass
+        finally:
+            connection.closed = True
+            if connection.room is not None:
+                connection.room.quit(connection.handle)
+
+    def _on_event(self, connection, event):
+        tc = event.get('tc')
+        req = event.get('req', 0)
+        room = connection.room
+
+        if tc == 'join':
+            connection.room = self.room(event.get('room', ''))
+            connection.user = connection.room.admit(event.get('nick', 'guest'), connection)
+        elif room is None:
+            log.debug('event before join: %s' % tc)
+        elif tc == 'msg':
+            room.say(connection.handle, event.get('text', ''))
+        elif tc == 'pvtmsg':
+            target = room.connections.get(event.get('handle'))
+            if target is not None:
+                target.send('pvtmsg', handle=connection.handle, text=event.get('text', ''))
+        elif tc == 'nick':
+            room.nick(connection.handle, event.get('nick', ''))
+        elif tc == 'kick':
+            room.kick(event.get('handle'))
+        elif tc == 'ban':
+            ban = room.ban(event.get('handle'), connection.user['nick'])
+            if ban is None:
+                connection.send('ban', success=False, reason='no such user', req=req)
+            else:
+                connection.send('ban', success=True, req=req, **ban)
+        elif tc == 'unban':
+            ban = room.unban(event.get('id'))
+            connection.send('unban', success=ban is not None, req=req, **(ban or {'id': event.get('id')}))
+        elif tc == 'banlist':
+            connection.send('banlist', success=True, items=list(room.bans.values()), req=req)
+
+    def _pinger(self):
+        while True:
+            time.sleep(self.ping_interval)
+            with self._lock:
+                rooms = list(self.rooms.values())
+            for room in rooms:
+                room.broadcast('ping')
+
+
+def use(server):
+    """
+    Point apis.tinychat at a mock server.
+
+    :param server: The server.
+    :type server: MockServer
+    """
+    import apis.tinychat
+    apis.tinychat.BASE_URL = server.url
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a local tinychat stand-in server.')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--ping-interval', type=float, default=30)
+    parser.add_argument('--users', type=int, default=0, help='guests already in every room')
+    parser.add_argument('--join-flood', type=int, default=0, help='guests joining every room')
+    parser.add_argument('--join-rate', type=float, default=100, help='joins per second of the join flood')
+    parser.add_argument('--msg-rate', type=float, default=0, help='chat messages per second in every room')
+    args = parser.parse_args()
+
+    scenarios = []
+    if args.users:
+        scenarios.append(_scenarios.BigRoom(args.users))
+    if args.join_flood:
+        scenarios.append(_scenarios.JoinFlood(args.join_flood, rate=args.join_rate))
+    if args.msg_rate:
+        scenarios.append(_scenarios.MessageStorm(rate=args.msg_rate))
+
+    logging.basicConfig(level=logging.INFO)
+    server = MockServer(port=args.port, scenarios=scenarios, ping_interval=args.ping_interval, host=args.host)
+    print ('serving on %s, point apis.tinychat.BASE_URL at it' % server.url)
+    server.start()
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
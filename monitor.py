@@ -0,0 +1,185 @@
+""" Ping, pong and read loop lag measurements, shared by the threaded and the event loop client. """
+import time
+from collections import deque
+
+
+class SlidingWindow(object):
+    """ The most recent samples of a measurement, and their percentiles. """
+
+    def __init__(self, size=1000):
+        """
+        :param size: The number of samples kept, older samples are dropped.
+        :type size: int
+        """
+        self._samples = deque(maxlen=size)
+
+    def __len__(self):
+        return len(self._samples)
+
+    def add(self, value):
+        """
+        Add a sample. This is thread safe.
+
+        :param value: The sample.
+        :type value: int | float
+        """
+        self._samples.append(value)
+
+    def clear(self):
+        """ Drop all samples. """
+        self._samples.clear()
+
+    def percentiles(self, *percents):
+        """
+        Estimate percentiles of the samples in the window, by the nearest rank.
+
+        :param percents: The percentiles, e.g 50, 99
+        :type percents: int | float
+        :return: A list of values in the order of percents, None for each if there are no samples.
+        :rtype: list
+        """
+        samples = sorted(self._samples)
+        if not samples:
+            return [None for _ in percents]
+        last = len(samples) - 1
+        return [samples[min(last, int(round(p / 100.0 * last)))] for p in percents]
+
+    @property
+    def last(self):
+        """
+        Returns the most recent sample.
+
+        :return: The sample, or None if there are no samples.
+        :rtype: int | float | None
+        """
+        if self._samples:
+            return self._samples[-1]
+        return None
+
+    def summary(self):
+        """
+        Returns the count, 50th, 90th and 99th percentile and maximum of the samples.
+
+        :rtype: dict
+        """
+        p50, p90, p99, _max = self.percentiles(50, 90, 99, 100)
+        return {'count': len(self._samples), 'p50': p50, 'p90': p90, 'p99': p99, 'max': _max}
+
+
+class LagMonitor(object):
+    """
+    Tracks the server ping interval, the time from receiving a ping until the pong was written,
+    and the time from the read loop picking up a frame until its handler finished.
+
+    The loop counts as saturated when the 99th percentile of the frame lag, or a pong,
+    takes longer than the thresholds. Saturation is checked at most once per check_interval.
+    """
+
+    def __init__(self, window=1000, max_lag=0.5, max_pong=5.0, check_interval=1.0):
+        """
+        :param window: The number of frames the lag percentiles are estimated from.
+        :type window: int
+        :param max_lag: Saturated if the 99th percentile frame lag is above this many seconds, 0 to not check.
+        :type max_lag: int | float
+        :param max_pong: Saturated if a pong took, or is taking, longer than this many seconds, 0 to not check.
+        :type max_pong: int | float
+        :param check_interval: Minimum seconds between saturation checks.
+        :type check_interval: int | float
+        """
+        self.max_lag = max_lag
+        self.max_pong = max_pong
+        self.check_interval = check_interval
+
+        self.frame_lag = SlidingWindow(window)
+        self.pong_time = SlidingWindow(100)
+        self.ping_interval = SlidingWindow(100)
+        self.saturated = False
+        self.saturations = 0
+        self._last_ping = None
+        self._pong_pending = None
+        self._checked = 0.0
+
+    def reset(self):
+        """ Forget the ping state of the previous connection. The lag samples are kept. """
+        self._last_ping = None
+        self._pong_pending = None
+        self.saturated = False
+
+    def ping(self, received):
+        """
+        Record a ping from the server.
+
+        :param received: The time the ping frame was picked up by the read loop.
+        :type received: float
+        """
+        if self._last_ping is not None:
+            self.ping_interval.add(received - self._last_ping)
+        self._last_ping = received
+        self._pong_pending = received
+
+    def pong(self, received, written):
+        """
+        Record a pong written to the websocket. This may be called from the writer thread.
+
+        :param received: The time the ping was picked up by the read loop.
+        :type received: float
+        :param written: The time the pong was written.
+        :type written: float
+        """
+        self.pong_time.add(written - received)
+        if self._pong_pending == received:
+            self._pong_pending = None
+
+    def frame(self, received, now):
+        """
+        Record the lag of a frame, and check for saturation once per check_interval.
+
+        :param received: The time the frame was picked up by the read loop.
+        :type received: float
+        :param now: The time its handler finished.
+        :type now: float
+        :return: True if the loop became saturated, False otherwise.
+        :rtype: bool
+        """
+        self.frame_lag.add(now - received)
+        if now - self._checked < self.check_interval:
+            return False
+        self._checked = now
+
+        saturated = self._is_saturated(now)
+        became = saturated and not self.saturated
+        self.saturated = saturated
+        if became:
+            self.saturations += 1
+        return became
+
+    def _is_saturated(self, now):
+        if self.max_pong:
+            if self._pong_pending is not None and now - self._pong_pending > self.max_pong:
+                return True
+            last_pong = self.pong_time.last
+            if last_pong is not None and last_pong > self.max_pong:
+                return True
+        if self.max_lag and len(self.frame_lag) >= 100:
+            return self.frame_lag.percentiles(99)[0] > self.max_lag
+        return False
+
+    @property
+    def stats(self):
+        """
+        Returns the ping interval, pong and frame lag percentiles, in seconds, and the saturation state.
+
+        :return: The lag stats.
+        :rtype: dict
+        """
+        pending = None
+        if self._pong_pending is not None:
+            pending = time.time() - self._pong_pending
+        return {
+            'ping_interval': self.ping_interval.summary(),
+            'pong': self.pong_time.summary(),
+            'pong_pending': pending,
+            'lag': self.frame_lag.summary(),
+            'saturated': self.saturated,
+            'saturations': self.saturations
+        }
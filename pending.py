@@ -0,0 +1,247 @@
+""" Correlates server replies with the requests that caused them, by req ID. """
+import time
+import heapq
+import logging
+import itertools
+import threading
+from collections import OrderedDict
+
+from util.workers import Future
+
+log = logging.getLogger(__name__)
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_timer():
+    """
+    Get the process wide ExpiryTimer, shared by all clients.
+
+    :return: The shared ExpiryTimer.
+    :rtype: ExpiryTimer
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = ExpiryTimer()
+        return _shared
+
+
+class RequestTimeout(Exception):
+    """ Set on a request future when no reply arrived in time. """
+    pass
+
+
+class RequestCancelled(Exception):
+    """ Set on a request future when the request was dropped, e.g on disconnect. """
+    pass
+
+
+class RequestFuture(Future):
+    """
+    The future of a request.
+
+    The reply is read by the thread reading the room, so waiting for it on that thread,
+    e.g in an event handler, raises RuntimeError instead of blocking until the timeout.
+    """
+
+    def __init__(self, table):
+        super(RequestFuture, self).__init__()
+        self._table = table
+
+    def _check_thread(self):
+        if not self.done() and self._table.reader is threading.current_thread():
+            raise RuntimeError('waiting for a reply on the thread reading it, use add_done_callback instead')
+
+    def result(self, timeout=None):
+        self._check_thread()
+        return super(RequestFuture, self).result(timeout)
+
+    def exception(self, timeout=None):
+        self._check_thread()
+        return super(RequestFuture, self).exception(timeout)
+
+
+class ExpiryTimer(object):
+    """
+    A thread failing pending requests when their timeout has passed,
+    also in rooms where no frame arrives to expire them.
+    """
+
+    def __init__(self):
+        # the deadlines of the requests, and their table.
+        self._deadlines = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def schedule(self, deadline, table):
+        """
+        Expire the requests of a table at a deadline.
+
+        :param deadline: The time to expire at.
+        :type deadline: float
+        :param table: The table of the request.
+        :type table: PendingRequests
+        """
+        with self._cond:
+            heapq.heappush(self._deadlines, (deadline, next(self._seq), table))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-expiry')
+                self._thread.daemon = True
+                self._thread.start()
+            elif self._deadlines[0][0] == deadline:
+                self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    now = time.time()
+                    if self._deadlines and self._deadlines[0][0] <= now:
+                        break
+                    self._cond.wait(self._deadlines[0][0] - now if self._deadlines else None)
+                due = set()
+                while self._deadlines and self._deadlines[0][0] <= now:
+                    due.add(heapq.heappop(self._deadlines)[2])
+            for table in due:
+                try:
+                    table.expire()
+                except Exception as e:
+                    log.error('request expiry error: %s' % e, exc_info=True)
+
+
+class PendingRequests(object):
+    """ A bounded table of futures waiting for a reply, keyed by req ID. """
+
+    def __init__(self, max_pending=1000, default_timeout=30, timer=None):
+        """
+        Create the table.
+
+        :param max_pending: The maximum number of pending requests. When full, the oldest is cancelled.
+        :type max_pending: int
+        :param default_timeout: Seconds to wait for a reply, when no timeout is given.
+        :type default_timeout: int | float
+        :param timer: The timer expiring the requests, None for the shared timer.
+        :type timer: ExpiryTimer | None
+        """
+        self.max_pending = max_pending
+        self.default_timeout = default_timeout
+        # the number of pending requests, checked for every frame without calling __len__.
+        self.waiting = 0
+        # the thread reading the replies, set by the client.
+        self.reader = None
+        self._timer = timer
+        self._pending = OrderedDict()
+        self._deadlines = []
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, req, timeout=None):
+        """
+        Add a request waiting for a reply.
+
+        :param req: The req ID of the request.
+        :type req: int
+        :param timeout: Seconds to wait for the reply.
+        :type timeout: int | float | None
+        :return: A future, completed with the reply frame.
+        :rtype: RequestFuture
+        """
+        future = RequestFuture(self)
+        deadline = time.time() + (timeout or self.default_timeout)
+        evicted = None
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                evicted = self._pending.popitem(last=False)
+            self._pending[req] = future
+            heapq.heappush(self._deadlines, (deadline, req))
+            self.waiting = len(self._pending)
+        (self._timer or get_timer()).schedule(deadline, self)
+
+        if evicted is not None:
+            evicted[1].set_exception(RequestCancelled('too many pending requests, req %s dropped' % evicted[0]))
+        return future
+
+    def resolve(self, req, reply):
+        """
+        Complete the future of a request with its reply.
+
+        :param req: The req ID of the reply.
+        :type req: int
+        :param reply: The reply frame.
+        :type reply: dict
+        :return: True if a request was waiting for the reply, else False.
+        :rtype: bool
+        """
+        with self._lock:
+            future = self._pending.pop(req, None)
+            self.waiting = len(self._pending)
+        if future is None:
+            return False
+        future.set_result(reply)
+        return True
+
+    def expire(self):
+        """
+        Fail the requests whose timeout has passed. This is called by the timer.
+
+        :return: The number of expired requests.
+        :rtype: int
+        """
+        now = time.time()
+        expired = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, req = heapq.heappop(self._deadlines)
+                future = self._pending.pop(req, None)
+                if future is not None:
+                    expired.append((req, future))
+            if not self._pending:
+                del self._deadlines[:]
+            self.waiting = len(self._pending)
+
+        for req, future in expired:
+            future.set_exception(RequestTimeout('no reply to req %s' % req))
+        return len(expired)
+
+    def cancel_all(self, reason='disconnected'):
+        """
+        Fail all pending requests.
+
+        :param reason: The reason given in the RequestCancelled exception.
+        :type reason: str
+        """
+        with self._lock:
+            pending = list(self._pending.items())
+            self._pending.clear()
+            del self._deadlines[:]
+            self.waiting = 0
+
+        for req, future in pending:
+            future.set_exception(RequestCancelled('req %s cancelled: %s' % (req, reason)))
+
+
+def wait_all(futures, timeout=None):
+    """
+    Wait for many request futures.
+
+    :param futures: The futures.
+    :type futures: list
+    :param timeout: The maximum seconds to wait in total, None waits until every future completed.
+    :type timeout: int | float | None
+    :return: A list with the reply, or the exception, of each future, in the same order.
+    :rtype: list
+    """
+    deadline = None if timeout is None else time.time() + timeout
+    results = []
+    for future in futures:
+        remaining = None if deadline is None else max(0, deadline - time.time())
+        try:
+            results.append(future.result(remaining))
+        except Exception as e:
+            results.append(e)
+    return results
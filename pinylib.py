@@ -1,19 +1,35 @@
 # -*- coding: utf-8 -*-
 # Pinylib RTC module, based on the POC by Notnola (https://github.com/notnola/TcRTC)
 
-import json
+import os
 import time
 import logging
+import weakref
+import threading
 import traceback
 
 import websocket
 from colorama import init, Fore, Style
 
 import config
+import command_router
+import content_filter
+import duplicates
 import user
+import writer
+import monitor
+import log_sink
+import flood
+import history
+import text_index
+import pending
+import reconnect
+import rtc_cache
+import recorder
+import enrichment
 import apis.tinychat
 from page import acc
-from util import file_handler, string_util
+from util import codec, metrics, string_util
 
 __version__ = '1.0.11'
 
@@ -36,20 +52,172 @@ COLOR = {
     'bright_magenta': Style.BRIGHT + Fore.MAGENTA
 }
 
+# The metrics of each room, served on METRICS_PORT.
+_metrics = metrics.get_registry()
+_metrics.limit_label('room', config.METRICS_MAX_ROOMS)
+EVENTS_HANDLED = _metrics.counter('pinylib_events_total', 'Events handled, by event.', ('room', 'event'))
+EVENT_SECONDS = _metrics.histogram('pinylib_event_seconds',
+                                   'Time spent in the handler of an event, for one in EVENT_TIMING events.',
+                                   ('room', 'event'))
+EVENTS_SKIPPED = _metrics.counter('pinylib_events_skipped_total',
+                                  'Frames of unsubscribed events, skipped before decoding.', ('room', 'event'))
+SEND_QUEUE_DEPTH = _metrics.gauge('pinylib_send_queue_depth', 'Outbound messages waiting to be sent.', ('room',))
+RECONNECTS = _metrics.counter('pinylib_reconnects_total', 'Reconnect attempts.', ('room',))
+CONNECT_SECONDS = _metrics.histogram('pinylib_connect_seconds',
+                                     'Time from starting to connect to the joined event.', ('room',))
+PONG_SECONDS = _metrics.histogram('pinylib_pong_seconds', 'Time from reading a ping until the pong was written.',
+                                  ('room',))
+LOOP_SATURATED = _metrics.counter('pinylib_loop_saturated_total',
+                                  'Times the read loop became saturated, see on_loop_saturated.', ('room',))
+USERS = _metrics.gauge('pinylib_users', 'Users in the room.', ('room',))
+BANLIST = _metrics.gauge('pinylib_banlist', 'Entries in the banlist of the room.', ('room',))
+FLOOD_ACTIONS = _metrics.counter('pinylib_flood_actions_total',
+                                 'Messages over a flood control limit, by the action taken.', ('room', 'action'))
+DUPLICATES = _metrics.counter('pinylib_duplicates_total',
+                              'Chat messages sent by several users, by the action taken.', ('room', 'action'))
+FILTER_MATCHES = _metrics.counter('pinylib_filter_matches_total',
+                                  'Messages with words of the content filter lists, by the action taken.',
+                                  ('room', 'action'))
+
+# The websocket handshake header.
+TC_HEADER = {
+    'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:52.0) Gecko/20100101 Firefox/52.0',
+    'Accept-Language': 'en-US,en;q=0.5',
+    'Accept-Encoding': 'gzip, deflate, br',
+    'Sec-WebSocket-Protocol': 'tc',
+    'Sec-WebSocket-Extensions': 'permessage-deflate'
+}
+
 
 def write_to_log(msg, room_name):
     """
     Writes chat events to log.
 
+    The line is queued, and written to the log file of the day by the log sink.
+
     :param msg: the message to write to the log.
     :type msg: str
     :param room_name: the room name.
     :type room_name: str
     """
-    d = time.strftime('%Y-%m-%d')
-    file_name = d + '.log'
-    path = config.CONFIG_PATH + room_name + '/logs/'
-    file_handler.file_writer(path, file_name, msg.encode(encoding='UTF-8', errors='ignore'))
+    log_sink.get_sink().log(config.CONFIG_PATH + room_name + '/logs/', msg)
+
+
+# Argument extractors used by the event registry.
+def _frame(json_data):
+    """ Pass the whole frame to the handler. """
+    return json_data,
+
+
+def _no_args(json_data):
+    """ The handler takes no arguments. """
+    return ()
+
+
+def _keys(*keys):
+    """
+    Create an extractor passing the values of the given frame keys to the handler.
+
+    :param keys: The frame keys, in the order the handler takes them.
+    :type keys: str
+    :return: A callable returning a tuple of the key values.
+    :rtype: callable
+    """
+    def extractor(json_data):
+        return tuple([json_data[key] for key in keys])
+    extractor.keys = keys
+    return extractor
+
+
+def _bind(handler, extractor):
+    """
+    Combine a handler and its extractor into a single callable taking the frame.
+
+    The common extractors are unrolled, so that most events cost a
+    single dict lookup and one or two calls to dispatch.
+
+    :param handler: The event handler.
+    :type handler: callable
+    :param extractor: The argument extractor.
+    :type extractor: callable
+    :return: A callable taking the decoded frame.
+    :rtype: callable
+    """
+    if extractor is _frame:
+        return handler
+    if extractor is _no_args:
+        return lambda json_data: handler()
+
+    keys = getattr(extractor, 'keys', ())
+    if len(keys) == 1:
+        key = keys[0]
+        return lambda json_data: handler(json_data[key])
+    if len(keys) == 2:
+        key1, key2 = keys
+        return lambda json_data: handler(json_data[key1], json_data[key2])
+    return lambda json_data: handler(*extractor(json_data))
+
+
+# The default event table. Event name, handler method name and argument extractor.
+EVENTS = (
+    ('ping', '_on_ping_frame', _no_args),
+    ('closed', 'on_closed', _keys('error')),
+    ('joined', '_on_joined_frame', _keys('self', 'room')),
+    ('room_settings', 'on_room_settings', _keys('room')),
+    ('userlist', '_on_userlist_frame', _keys('users')),
+    ('join', 'on_join', _frame),
+    ('nick', 'on_nick', _keys('handle', 'nick')),
+    ('quit', 'on_quit', _keys('handle')),
+    ('ban', 'on_ban', _frame),
+    ('unban', 'on_unban', _frame),
+    ('banlist', 'on_banlist', _frame),
+    ('msg', 'on_msg', _keys('handle', 'text')),
+    ('pvtmsg', 'on_pvtmsg', _keys('handle', 'text')),
+    ('publish', 'on_publish', _keys('handle')),
+    ('unpublish', 'on_unpublish', _keys('handle')),
+    ('sysmsg', 'on_sysmsg', _keys('text')),
+    ('password', 'on_password', _no_args),
+    ('pending_moderation', 'on_pending_moderation', _frame),
+    ('stream_moder_allow', 'on_stream_moder_allow', _frame),
+    ('stream_moder_close', 'on_stream_moder_close', _frame),
+    ('captcha', 'on_captcha', _keys('key')),
+    ('yut_playlist', 'on_yut_playlist', _frame),
+    ('yut_play', 'on_yut_play', _frame),
+    ('yut_pause', 'on_yut_pause', _frame),
+    ('yut_stop', 'on_yut_stop', _frame)
+)
+
+
+# Events the client needs to stay connected and to keep self.users, its role views
+# and the banlist in step with the room, these can not be unsubscribed.
+REQUIRED_EVENTS = ('ping', 'closed', 'joined', 'userlist', 'join', 'nick', 'quit',
+                   'publish', 'unpublish', 'ban', 'unban', 'banlist')
+
+_TC_KEY = b'"tc":"'
+
+
+def peek_event(data):
+    """
+    Find the event name of a raw frame, without json decoding it.
+
+    This looks for the first "tc" key, which tinychat puts first in the frame.
+    Quotes inside json strings are escaped, so the key can not be faked by a chat message.
+
+    :param data: The raw json frame.
+    :type data: bytes | str
+    :return: The event name as bytes, or None if the key was not found in the expected form.
+    :rtype: bytes | None
+    """
+    if not isinstance(data, bytes):
+        data = data.encode('utf-8')
+    start = data.find(_TC_KEY)
+    if start == -1:
+        return None
+    start += len(_TC_KEY)
+    end = data.find(b'"', start)
+    if end == -1:
+        return None
+    return data[start:end]
 
 
 class TinychatRTCClient(object):
@@ -69,29 +237,114 @@ class TinychatRTCClient(object):
         self.active_user = None
         self._connect_args = None
         self._ws = None
+        self._writer = None
         self._req = 1
+        self._req_lock = threading.Lock()
+        self._pending = pending.PendingRequests(max_pending=config.REQUEST_MAX_PENDING,
+                                                default_timeout=config.REQUEST_TIMEOUT)
+        self._reconnector = reconnect.Reconnector(max_attempts=config.RECONNECT_MAX_ATTEMPTS,
+                                                  base_delay=config.RECONNECT_BASE_DELAY,
+                                                  max_delay=config.RECONNECT_MAX_DELAY)
+        self._should_reconnect = False
+        self._wake = threading.Event()
+        self.enricher = enrichment.get_enricher()
+        self.flood = flood.FloodControl(config.FLOOD_RULES, max_keys=config.FLOOD_MAX_KEYS,
+                                        idle=config.FLOOD_IDLE, cooldown=config.FLOOD_COOLDOWN)
+        self.commands = command_router.CommandRouter(prefix=config.COMMAND_PREFIX,
+                                                     prefix_match=config.COMMAND_PREFIX_MATCH)
+        self.commands.on_error = self.on_command_error
+        self.commands.add_commands(self)
+        self.duplicates = None
+        if config.DUPLICATE_USERS:
+            self.duplicates = duplicates.DuplicateDetector(min_handles=config.DUPLICATE_USERS,
+                                                           window=config.DUPLICATE_WINDOW,
+                                                           similarity=config.DUPLICATE_SIMILARITY,
+                                                           min_length=config.DUPLICATE_MIN_LENGTH,
+                                                           max_messages=config.DUPLICATE_MAX_MESSAGES)
+        self.content_filter = None
+        if config.FILTER_LISTS:
+            self.content_filter = content_filter.get_filter(reload_interval=config.FILTER_RELOAD_INTERVAL)
+            for category, file_name in config.FILTER_LISTS.items():
+                if category not in self.content_filter.categories:
+                    self.content_filter.load_list(category, config.CONFIG_PATH, file_name)
+            # filter the first messages, the builder thread would build it a little later.
+            self.content_filter.build()
+        self.log_sink = log_sink.get_sink()
+        self.history = None
+        if config.CHAT_HISTORY:
+            self.history = history.get_history(config.CONFIG_PATH + room + '/history/',
+                                               block_size=config.CHAT_HISTORY_BLOCK_SIZE,
+                                               flush_interval=config.CHAT_HISTORY_FLUSH_INTERVAL)
+        self.text_index = None
+        if config.CHAT_INDEX:
+            self.text_index = text_index.get_index(config.CONFIG_PATH + 'index/',
+                                                   flush_docs=config.CHAT_INDEX_FLUSH_DOCS,
+                                                   flush_interval=config.CHAT_INDEX_FLUSH_INTERVAL)
+        self.rtc_versions = rtc_cache.get_cache()
+        self._connect_started = None
+        self._join_sent = None
+        self._connect_timings = {}
+        self.recorder = None
+        self._monitor = monitor.LagMonitor(window=config.LAG_WINDOW, max_lag=config.LAG_SATURATED,
+                                           max_pong=config.PONG_SATURATED)
+        self._frame_received = None
+        self._ping_received = None
+
+        self._event_handlers = {}
+        self._dispatch_table = {}
+        for event, method_name, extractor in EVENTS:
+            self.register_event(event, getattr(self, method_name), extractor)
+
+        self._unsubscribed = {}
+        self.frames_skipped = {}
+
+        self._event_counts = {}
+        self._event_seconds = {}
+        # frames until the next timed one, 0 when not timing.
+        self._time_next = config.EVENT_TIMING
+        self._init_metrics()
+
+    def _init_metrics(self):
+        """ Register the gauges read from the client, and serve the metrics if METRICS_PORT is set. """
+        # a weak reference, so the registry does not keep the client alive.
+        ref = weakref.ref(self)
+
+        def read(fn):
+            def value():
+                client = ref()
+                if client is None:
+                    return None
+                return fn(client)
+            return value
+
+        SEND_QUEUE_DEPTH.labels(self.room_name).set_function(
+            read(lambda client: len(client._writer) if client._writer is not None else 0))
+        USERS.labels(self.room_name).set_function(read(lambda client: len(client.users.all)))
+        BANLIST.labels(self.room_name).set_function(read(lambda client: len(client.users.banlist)))
+        self._reconnects = RECONNECTS.labels(self.room_name)
+        self._pong_seconds = PONG_SECONDS.labels(self.room_name)
+
+        if config.METRICS_PORT:
+            metrics.start_server(config.METRICS_PORT, config.METRICS_HOST)
 
     def console_write(self, color, message):
         """
         Writes message to console.
 
+        The message is queued, and printed by the log sink.
+
         :param color: the colorama color representation.
         :param message: str the message to write.
         """
         if config.USE_24HOUR:
-            ts = time.strftime('%H:%M:%S')
+            ts = log_sink.timestamp('%H:%M:%S')
         else:
-            ts = time.strftime('%I:%M:%S:%p')
+            ts = log_sink.timestamp('%I:%M:%S:%p')
         if config.CONSOLE_COLORS:
             msg = COLOR['white'] + '[' + ts + '] ' + Style.RESET_ALL + color + message
         else:
             msg = '[' + ts + '] ' + message
-        try:
-            print(msg)
-        except UnicodeEncodeError as ue:
-            log.error(ue, exc_info=True)
-            if config.DEBUG_MODE:
-                traceback.print_exc()
+        self.log_sink.console(msg)
 
         if config.CHAT_LOGGING:
             write_to_log('[' + ts + '] ' + message, self.room_name)
@@ -111,45 +364,166 @@ class TinychatRTCClient(object):
         return account.is_logged_in()
 
     def connect(self):
-        """ Initialize a websocket handshake. """
-        tc_header = {
-            'User-Agent': 'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:52.0) Gecko/20100101 Firefox/52.0',
-            'Accept-Language': 'en-US,en;q=0.5',
-            'Accept-Encoding': 'gzip, deflate, br',
-            'Sec-WebSocket-Protocol': 'tc',
-            'Sec-WebSocket-Extensions': 'permessage-deflate'
-        }
+        """
+        Connect to the room, and read events until disconnected.
 
+        A lost connection is reconnected by this loop, waiting a jittered exponential
+        backoff between attempts, until RECONNECT_MAX_ATTEMPTS failed attempts in a row.
+        """
         # Comment out next 2 lines to not
         # have debug info from websocket show in console.
         if config.DEBUG_MODE:
             websocket.enableTrace(True)
 
+        self._reconnector.start()
+        while True:
+            self._should_reconnect = False
+            if self._open():
+                self._reconnector.opened()
+                self.__callback()
+            else:
+                self._should_reconnect = True
+
+            if not self._should_reconnect:
+                break
+
+            self._close()
+            delay = self._reconnector.lost()
+            if delay is None:
+                self.console_write(COLOR['bright_red'], 'Giving up reconnecting after %s attempts.' %
+                                   self._reconnector.max_attempts)
+                break
+            self._reconnects.inc()
+            if self._reconnector.attempt > 1:
+                # the rtc version might be the reason the previous attempt failed.
+                self.rtc_versions.invalidate()
+
+            log.info('reconnecting to %s in %.2f seconds, attempt %s' %
+                     (self.room_name, delay, self._reconnector.attempt))
+            self._wake.clear()
+            self._wake.wait(delay)
+            if not self._should_reconnect:
+                # disconnect was called while waiting.
+                break
+
+        if self._ws is not None:
+            # closed by the server, e.g banned or kicked.
+            self._close()
+        if self._reconnector.is_running:
+            self._reconnector.stop()
+
+    def _open(self):
+        """
+        Get the connect token, do the websocket handshake and send the join message.
+
+        The rtc version is fetched in the background meanwhile, if it is not cached.
+
+        :return: True if the join message was sent, else False.
+        :rtype: bool
+        """
+        self._begin_connect()
+        version = self.rtc_versions.get_future(self.room_name)
+        version.add_done_callback(lambda f: self._mark_phase('version'))
+
+        started = time.time()
         self._connect_args = apis.tinychat.get_connect_token(self.room_name)
+        self._mark_phase('token', started)
 
         if self._connect_args is None:
             e = 'No connect details received. details: %s' % self._connect_args
             log.error(e)
             if config.DEBUG_MODE:
                 print(e)
-        else:
+            return False
+
+        started = time.time()
+        try:
             self._ws = websocket.create_connection(
                 self._connect_args['endpoint'],
-                header=tc_header,
+                header=TC_HEADER,
                 origin='https://tinychat.com'
             )
+        except Exception as e:
+            log.error('websocket handshake failed: %s' % e, exc_info=True)
+            return False
+        self._mark_phase('handshake', started)
 
-            if self._ws.connected:
-                log.info('connecting to: %s' % self.room_name)
-                self.send_join_msg()
-                self.is_connected = True
-                self.__callback()
+        if self._ws.connected:
+            log.info('connecting to: %s' % self.room_name)
+            self._start_writer()
+            # the fetch has its own http timeout.
+            self._send_join(version.result())
+            self.is_connected = True
+            return True
+        return False
+
+    def _send_join(self, rtc_version):
+        """
+        Send the join message, once both the websocket and the rtc version are ready.
+
+        :param rtc_version: The rtc version, None to use the fallback.
+        :type rtc_version: str | None
+        """
+        if rtc_version is None:
+            rtc_version = config.FALLBACK_RTC_VERSION
+            log.info('failed to fetch rtc version, using fallback: %s' % config.FALLBACK_RTC_VERSION)
+        self.send_join_msg(rtc_version=rtc_version)
+        self._join_sent = time.time()
+
+    def _begin_connect(self):
+        """ Reset the connect timings, and start recording if RECORD_FRAMES is enabled. """
+        self._connect_started = time.time()
+        self._join_sent = None
+        self._connect_timings = {}
+        self._monitor.reset()
+        if config.RECORD_FRAMES and self.recorder is None:
+            self.start_recording()
+
+    def _mark_phase(self, phase, started=None):
+        """
+        Record the duration of a connect phase.
+
+        :param phase: The phase name.
+        :type phase: str
+        :param started: The time the phase started, None for the time the connect started.
+        :type started: float | None
+        """
+        self._connect_timings[phase] = time.time() - (started or self._connect_started)
+
+    @property
+    def connect_timings(self):
+        """
+        Returns the duration of each phase of the last connect, in seconds.
+
+        token and handshake are the connect token request and the websocket handshake (tcp, tls and upgrade).
+        version is the time until the rtc version was known, fetched alongside the token and handshake.
+        joined is the time from sending the join message to the joined event, and total from connect to joined.
+
+        :return: A dictionary of timings, holding the phases completed so far.
+        :rtype: dict
+        """
+        return dict(self._connect_timings)
 
     def disconnect(self):
         """ Disconnect from the server. """
+        self._should_reconnect = False
+        self._wake.set()
+        self._close()
+        if self._reconnector.is_running:
+            self._reconnector.stop()
+        self.stop_recording()
+
+    def _close(self):
+        """ Close the websocket, and reset the room state. """
         self.is_connected = False
-        self._ws.send_close(status=1001, reason='GoingAway')
-        self._ws.abort()  # not sure if this is actually needed.
+        self._stop_writer()
+        self._pending.cancel_all()
+        if self._ws is not None:
+            try:
+                self._ws.send_close(status=1001, reason='GoingAway')
+                self._ws.abort()  # not sure if this is actually needed.
+            except Exception as e:
+                log.debug('error closing the websocket: %s' % e)
         self._req = 1
         self._ws = None
         self.client_id = 0
@@ -158,20 +532,53 @@ class TinychatRTCClient(object):
         self.users.clear()
         self.users.clear_banlist()
 
+    def _start_writer(self):
+        """ Start the writer sending queued messages on the websocket. """
+        self._stop_writer()
+        self._writer = writer.FrameWriter(self._ws.send, rate=config.SEND_RATE, burst=config.SEND_BURST,
+                                          max_queue=config.SEND_QUEUE_SIZE)
+        self._writer.start()
+
+    def _stop_writer(self):
+        """ Stop the writer, discarding unsent messages. """
+        if self._writer is not None:
+            self._writer.stop()
+            self._writer = None
+
     def reconnect(self):
-        """ Reconnect to the server. """
-        if self.is_connected:
-            self.disconnect()
-        self.connect()
+        """
+        Reconnect to the server.
+
+        If connect is running, the connection is closed and the connect loop reconnects,
+        so calling this from an event handler or the read loop does not add stack frames.
+        """
+        self._should_reconnect = True
+        if self._reconnector.is_running:
+            self._close()
+            # skip the backoff wait, if waiting.
+            self._wake.set()
+        else:
+            self.connect()
+
+    @property
+    def reconnect_stats(self):
+        """
+        Returns the reconnect state, attempts and the time it took to reconnect.
+
+        :return: The reconnect stats.
+        :rtype: dict
+        """
+        return self._reconnector.stats
 
     def __callback(self):
         """ The main loop reading event messages from the server. """
         log.info('starting callback, is_connected: %s' % self.is_connected)
+        self._pending.reader = threading.current_thread()
         fails = 0
 
         while self.is_connected:
             try:
-                data = self._ws.next()
+                data = self._recv_frame()
             except Exception as e:
                 log.error('data read error %s: %s' % (fails, e), exc_info=True)
                 fails += 1
@@ -184,99 +591,312 @@ class TinychatRTCClient(object):
                 fails = 0
 
                 if data:
-                    log.debug('DATA: %s' % data)
-                    json_data = json.loads(data)
+                    self._handle_frame(data)
+
+    def _recv_frame(self):
+        """
+        Read the next frame from the websocket.
+
+        The frame data is returned as received, without decoding it to text,
+        since the json codec decodes the utf-8 bytes directly.
+
+        :return: The raw frame data, or None if it was not a data frame.
+        :rtype: bytes | None
+        """
+        opcode, data = self._ws.recv_data()
+        if opcode == websocket.ABNF.OPCODE_TEXT or opcode == websocket.ABNF.OPCODE_BINARY:
+            return data
+        return None
+
+    def _handle_frame(self, data, received=None):
+        """
+        Decode a raw event frame and dispatch it.
+
+        :param data: The raw json frame as received from the server.
+        :type data: bytes | str
+        :param received: The time the read loop picked up the frame, None for now.
+        :type received: float | None
+        """
+        if received is None:
+            received = time.time()
+        if self.recorder is not None:
+            self.recorder.record(recorder.INBOUND, data)
+
+        if self._unsubscribed:
+            event = self._unsubscribed.get(peek_event(data))
+            if event is not None:
+                self.frames_skipped[event] = self.frames_skipped.get(event, 0) + 1
+                EVENTS_SKIPPED.labels(self.room_name, event).inc()
+                if self._pending.waiting:
+                    # A skipped frame can still be the reply to a request.
+                    self._resolve_pending(codec.loads(data))
+                return
+
+        log.debug('DATA: %s', data)
+        json_data = codec.loads(data)
+        self._frame_received = received
+        if self.history is not None:
+            self._record_history(json_data, received)
+        if self.text_index is not None and json_data['tc'] == 'msg':
+            self._index_message(json_data, received)
+        event = json_data['tc']
+        timed = self._time_next == 1
+        if self._time_next:
+            self._time_next = self._time_next - 1 or config.EVENT_TIMING
+        if timed:
+            started = time.time()
+            self._dispatch(json_data)
+            handled = time.time()
+            self._time_event(event, handled - started)
+        else:
+            self._dispatch(json_data)
+            handled = time.time()
+        self._count_event(event)
+        if self._monitor.frame(received, handled):
+            LOOP_SATURATED.labels(self.room_name).inc()
+            self.on_loop_saturated(self._monitor.stats)
 
-                    event = json_data['tc']
+        if config.DEBUG_MODE:
+            if isinstance(data, bytes):
+                data = data.decode('utf-8', 'replace')
+            self.console_write(COLOR['white'], data)
 
-                    if event == 'ping':
-                        self.on_ping()
+    def _record_history(self, json_data, received):
+        """
+        Append a chat event to the history.
 
-                    elif event == 'closed':
-                        self.on_closed(json_data['error'])
+        This runs before the event handler, so the nick and account of a user leaving are still known.
 
-                    elif event == 'joined':
-                        self.on_joined(json_data['self'])
-                        self.on_room_info(json_data['room'])
+        :param json_data: The decoded event frame.
+        :type json_data: dict
+        :param received: The time the frame was read.
+        :type received: float
+        """
+        event_type = history.EVENT_TYPES.get(json_data['tc'])
+        if event_type is None:
+            return
 
-                    elif event == 'room_settings':
-                        self.on_room_settings(json_data['room'])
+        if event_type == history.JOIN:
+            self.history.append(received, event_type, json_data.get('handle'),
+                                json_data.get('nick'), json_data.get('username'))
+        elif event_type in (history.BAN, history.UNBAN):
+            if json_data.get('success', True):
+                self.history.append(received, event_type, json_data.get('id'), json_data.get('nick'),
+                                    json_data.get('username'), json_data.get('moderator'))
+        else:
+            handle = json_data.get('handle')
+            _user = self.users.search(handle)
+            nick, account = ('', '') if _user is None else (_user.nick, _user.account)
+            if event_type == history.NICK:
+                # the new nick, and the old nick as the text.
+                self.history.append(received, event_type, handle, json_data.get('nick'), account, nick)
+            else:
+                self.history.append(received, event_type, handle, nick, account, json_data.get('text'))
 
-                    elif event == 'userlist':
-                        for _user in json_data['users']:
-                            self.on_userlist(_user)
+    def _index_message(self, json_data, received):
+        """
+        Add a chat message to the full text index, before on_msg handles it.
 
-                    elif event == 'join':
-                        self.on_join(json_data)
+        :param json_data: The decoded msg frame.
+        :type json_data: dict
+        :param received: The time the frame was read.
+        :type received: float
+        """
+        _user = self.users.search(json_data.get('handle'))
+        nick, account = ('', '') if _user is None else (_user.nick, _user.account)
+        self.text_index.add(self.room_name, received, nick, account, json_data.get('text'))
+
+    def _dispatch(self, json_data):
+        """
+        Look up the handler registered for an event and call it with the extracted arguments.
 
-                    elif event == 'nick':
-                        self.on_nick(json_data['handle'], json_data['nick'])
+        :param json_data: The decoded event frame.
+        :type json_data: dict
+        """
+        event = json_data['tc']
+        try:
+            call = self._dispatch_table[event]
+        except KeyError:
+            self.console_write(COLOR['bright_red'], 'Unknown command: %s %s' % (event, json_data))
+        else:
+            call(json_data)
+
+        if self._pending.waiting:
+            self._resolve_pending(json_data)
+
+    def _resolve_pending(self, json_data):
+        """
+        Resolve the request a frame replies to, if any.
+
+        :param json_data: The decoded frame.
+        :type json_data: dict
+        """
+        req = json_data.get('req')
+        if req is not None:
+            self._pending.resolve(req, json_data)
+
+    def _count_event(self, event):
+        """
+        Count a handled event in pinylib_events_total.
+
+        :param event: The event name.
+        :type event: str
+        """
+        counter = self._event_counts.get(event)
+        if counter is None:
+            if event not in self._dispatch_table:
+                return
+            counter = self._event_counts[event] = EVENTS_HANDLED.labels(self.room_name, event)
+        counter.inc()
 
-                    elif event == 'quit':
-                        self.on_quit(json_data['handle'])
+    def _time_event(self, event, seconds):
+        """
+        Count the time the handler of an event took in pinylib_event_seconds, for one in EVENT_TIMING events.
 
-                    elif event == 'ban':
-                        self.on_ban(json_data)
+        :param event: The event name.
+        :type event: str
+        :param seconds: The seconds the handler took.
+        :type seconds: float
+        """
+        timer = self._event_seconds.get(event)
+        if timer is None:
+            if event not in self._dispatch_table:
+                return
+            timer = self._event_seconds[event] = EVENT_SECONDS.labels(self.room_name, event)
+        timer.observe(seconds)
 
-                    elif event == 'unban':
-                        self.on_unban(json_data)
+    # Event Registry.
+    def register_event(self, event, handler, extractor=None):
+        """
+        Register, or replace, the handler for an event.
 
-                    elif event == 'banlist':
-                        self.on_banlist(json_data)
+        The extractor receives the decoded frame and must return a tuple,
+        which is passed as positional arguments to the handler.
+        If no extractor is given, the handler receives the whole frame.
 
-                    elif event == 'msg':
-                        self.on_msg(json_data['handle'], json_data['text'])
+        :param event: The event name (the tc value of the frame).
+        :type event: str
+        :param handler: The callable handling the event.
+        :type handler: callable
+        :param extractor: A callable returning the handler arguments from the frame.
+        :type extractor: callable | None
+        """
+        if extractor is None:
+            extractor = _frame
+        self._event_handlers[event] = (handler, extractor)
+        self._dispatch_table[event] = _bind(handler, extractor)
 
-                    elif event == 'pvtmsg':
-                        self.on_pvtmsg(json_data['handle'], json_data['text'])
+    def unregister_event(self, event):
+        """
+        Remove the handler for an event.
 
-                    elif event == 'publish':
-                        self.on_publish(json_data['handle'])
+        Frames for events with no handler will be reported as unknown.
 
-                    elif event == 'unpublish':
-                        self.on_unpublish(json_data['handle'])
+        :param event: The event name to remove.
+        :type event: str
+        :return: True if a handler was removed, else False.
+        :rtype: bool
+        """
+        if event in self._event_handlers:
+            del self._event_handlers[event]
+            del self._dispatch_table[event]
+            return True
+        return False
 
-                    elif event == 'sysmsg':
-                        self.on_sysmsg(json_data['text'])
+    @property
+    def events(self):
+        """
+        Returns the names of all registered events.
 
-                    elif event == 'password':
-                        self.on_password()
+        :return: A list of event names.
+        :rtype: list
+        """
+        return list(self._event_handlers)
 
-                    elif event == 'pending_moderation':
-                        self.on_pending_moderation(json_data)
+    # Event Subscription.
+    def unsubscribe(self, *events):
+        """
+        Skip frames for events the client does not care about.
 
-                    elif event == 'stream_moder_allow':
-                        self.on_stream_moder_allow(json_data)
+        Frames for unsubscribed events are dropped before they are json decoded,
+        and counted in frames_skipped, unless a request is waiting for a reply, in which case
+        they are decoded to resolve it but not handled. The events in REQUIRED_EVENTS, which keep
+        the connection, self.users and the banlist up to date, can not be unsubscribed.
 
-                    elif event == 'stream_moder_close':
-                        self.on_stream_moder_close(json_data)
+        :param events: The event names to skip, e.g 'yut_play', 'room_settings'
+        :type events: str
+        :raises ValueError: If an event is required for the client to work.
+        """
+        for event in events:
+            if event in REQUIRED_EVENTS:
+                raise ValueError('event %s is required and can not be unsubscribed' % event)
+        for event in events:
+            self._unsubscribed[event.encode('utf-8')] = event
 
-                    elif event == 'captcha':
-                        self.on_captcha(json_data['key'])
+    def subscribe(self, *events):
+        """
+        Handle frames for previously unsubscribed events again.
 
-                    elif event == 'yut_playlist':
-                        self.on_yut_playlist(json_data)
+        :param events: The event names.
+        :type events: str
+        """
+        for event in events:
+            self._unsubscribed.pop(event.encode('utf-8'), None)
 
-                    elif event == 'yut_play':
-                        self.on_yut_play(json_data)
+    @property
+    def unsubscribed(self):
+        """
+        Returns the names of the unsubscribed events.
 
-                    elif event == 'yut_pause':
-                        self.on_yut_pause(json_data)
+        :return: A list of event names.
+        :rtype: list
+        """
+        return list(self._unsubscribed.values())
 
-                    elif event == 'yut_stop':
-                        self.on_yut_stop(json_data)
+    def _on_ping_frame(self):
+        """ Measure the ping interval, and the time until the pong is written by send_pong. """
+        self._ping_received = self._frame_received
+        self._monitor.ping(self._ping_received)
+        self.on_ping()
 
-                    else:
-                        self.console_write(COLOR['bright_red'], 'Unknown command: %s %s' % (event, json_data))
+    def _on_joined_frame(self, client_info, room_info):
+        """ The joined frame carries both the client info and the room info. """
+        if self._join_sent is not None:
+            self._mark_phase('joined', self._join_sent)
+            self._mark_phase('total')
+            self._join_sent = None
+            CONNECT_SECONDS.labels(self.room_name).observe(self._connect_timings['total'])
+        if self._reconnector.is_running:
+            # a room accepting the connection and dropping it before the join keeps backing off.
+            self._reconnector.connected()
+        self.on_joined(client_info)
+        self.on_room_info(room_info)
 
-                    if config.DEBUG_MODE:
-                        self.console_write(COLOR['white'], data)
+    def _on_userlist_frame(self, users):
+        """ The userlist frame carries a list of users. """
+        for _user in users:
+            self.on_userlist(_user)
 
     # Chat Events.
     def on_ping(self):
         """ The server sends this every ~30 seconds, i assume to check if the client is alive. """
         self.send_pong()
 
+    def on_loop_saturated(self, stats):
+        """
+        Called when the read loop can not keep up, either the 99th percentile of the time from reading
+        a frame until its handler finished is above LAG_SATURATED, or a pong took longer than PONG_SATURATED.
+
+        This is called once when the loop becomes saturated, and again only after it recovered.
+        A slow pong risks the server closing the connection with a timeout.
+
+        :param stats: The lag stats, see lag_stats.
+        :type stats: dict
+        """
+        log.warning('read loop of %s is saturated: %s' % (self.room_name, stats))
+        self.console_write(COLOR['bright_red'], 'The read loop is saturated, frame lag p99: %.3fs, pong: %s' %
+                           (stats['lag']['p99'], stats['pong']['max']))
+
     def on_closed(self, code):
         """
         This gets sent when ever the connection gets closed by the server for what ever reason.
@@ -379,14 +999,7 @@ class TinychatRTCClient(object):
         """
         _user = self.users.add(join_info)
         if _user.account:
-            tc_info = apis.tinychat.user_info(_user.account)
-
-            if tc_info is not None:
-                _user.biography = tc_info['biography']
-                _user.gender = tc_info['gender']
-                _user.age = tc_info['age']
-                _user.location = tc_info['location']
-                _user.role = tc_info['role']
+            self.enricher.submit(_user, self._user_info_callback)
 
             if _user.is_owner:
                 _user.user_level = 1
@@ -403,6 +1016,26 @@ class TinychatRTCClient(object):
         else:
             self.console_write(COLOR['cyan'], '%s:%s joined the room' % (_user.nick, _user.id))
 
+    def _user_info_callback(self, _user, tc_info):
+        """ Called from an enrichment worker thread when profile info arrives. """
+        self.on_user_info(_user, tc_info)
+
+    def on_user_info(self, _user, tc_info):
+        """
+        Received when the profile information of a user with an account has been fetched.
+
+        The biography, gender, age, location and role of the user has been set, when this is called.
+        Note that this is called from an enrichment worker thread, not the thread reading the websocket.
+        AsyncTinychatRTCClient calls it on the loop thread.
+
+        :param _user: The user the profile info belongs to.
+        :type _user: user.User
+        :param tc_info: The profile information.
+        :type tc_info: dict
+        """
+        if config.DEBUG_MODE:
+            self.console_write(COLOR['white'], 'Profile info for %s: %s' % (_user.account, tc_info))
+
     def on_nick(self, uid, nick):
         """
         Received when a user changes nick name.
@@ -426,6 +1059,7 @@ class TinychatRTCClient(object):
         """
         _user = self.users.delete(uid)
         if _user is not None:
+            self.flood.forget(uid)
             self.console_write(COLOR['cyan'], '%s:%s Left the room.' % (_user.nick, uid))
 
     def on_ban(self, ban_info):
@@ -482,13 +1116,30 @@ class TinychatRTCClient(object):
         ts = time.time()
         if uid != self.client_id:
             self.active_user = self.users.search(uid)
-            # since spam could be an issue, only allow
-            # one message per second to be passed on to
-            # the message handler.
-            if ts - self.active_user.msg_time >= 1:
-                self.message_handler(msg)
+            # since spam could be an issue, messages over
+            # the flood control limits, sent by several
+            # users, or with words of the filter lists,
+            # are not passed on to the message handler.
+            # Commands go to their handler instead.
+            if self.flood_check(self.active_user, ts) and self.duplicate_check(self.active_user, msg, ts) \
+                    and self.filter_check(self.active_user, msg):
+                if not self.commands.dispatch(self.active_user, msg, ts):
+                    self.message_handler(msg)
             self.active_user.msg_time = ts
 
+    def on_command_error(self, _user, cmd, error):
+        """
+        Called when a command in a chat message was not run.
+
+        :param _user: The user sending the command.
+        :type _user: User
+        :param cmd: The command.
+        :type cmd: command_router.Command
+        :param error: command_router.PermissionDenied, CoolingDown or UsageError.
+        :type error: command_router.CommandError
+        """
+        self.console_write(COLOR['yellow'], '%s:%s %s: %s' % (_user.nick, _user.id, cmd.name, error))
+
     def message_handler(self, msg):
         """
         A basic handler for chat messages.
@@ -510,13 +1161,160 @@ class TinychatRTCClient(object):
         ts = time.time()
         if uid != self.client_id:
             self.active_user = self.users.search(uid)
-            # since spam could be an issue, only allow
-            # one message per second to be passed on to
-            # the private message handler.
-            if ts - self.active_user.msg_time >= 1:
+            # since spam could be an issue, messages over
+            # the flood control limits, or with words of
+            # the filter lists, are not passed on to the
+            # private message handler.
+            if self.flood_check(self.active_user, ts) and self.filter_check(self.active_user, msg):
                 self.private_message_handler(msg)
             self.active_user.msg_time = ts
 
+    def flood_check(self, _user, ts=None):
+        """
+        Check a message of a user against the flood control rules, and act on it.
+
+        :param _user: The user sending the message.
+        :type _user: User
+        :param ts: The time of the message, None for now.
+        :type ts: float | None
+        :return: True if the message should be handled, False if it should be ignored.
+        :rtype: bool
+        """
+        verdict = self.flood.check(_user.id, _user.account, ts)
+        if verdict is None:
+            return True
+        action, rule = verdict
+        FLOOD_ACTIONS.labels(self.room_name, action).inc()
+        self.on_flood(_user, action, rule)
+        return action == flood.ACTION_WARN
+
+    def on_flood(self, _user, action, rule):
+        """
+        Called when a message is over a flood control limit.
+
+        The message is ignored unless the action is a warn. Kicks and bans need the client to be a moderator.
+
+        :param _user: The user sending the message.
+        :type _user: User
+        :param action: The action of the rule, flood.ACTION_WARN, ACTION_DROP, ACTION_KICK or ACTION_BAN.
+        :type action: str
+        :param rule: The rule the message broke.
+        :type rule: flood.Rule
+        """
+        self.moderate(_user, action, 'over %s messages per %s seconds (%s)' %
+                      (rule.limit, rule.seconds, rule.scope))
+
+    def duplicate_check(self, _user, msg, ts=None):
+        """
+        Check if a chat message was also sent by other users, and act on it.
+
+        :param _user: The user sending the message.
+        :type _user: User
+        :param msg: The message.
+        :type msg: str
+        :param ts: The time of the message, None for now.
+        :type ts: float | None
+        :return: True if the message should be handled, False if it should be ignored.
+        :rtype: bool
+        """
+        if self.duplicates is None:
+            return True
+        flagged = self.duplicates.check(_user.id, msg, ts)
+        if flagged is None:
+            return True
+        cluster, handles = flagged
+        action = config.DUPLICATE_ACTION
+        DUPLICATES.labels(self.room_name, action).inc()
+        self.on_duplicate(_user, cluster, handles, action)
+        return action == flood.ACTION_WARN
+
+    def on_duplicate(self, _user, cluster, handles, action):
+        """
+        Called when a chat message, or nearly the same message, was sent by config.DUPLICATE_USERS users.
+
+        The message is ignored unless the action is a warn. The action is taken once for each user
+        who sent the message, including the users who sent it before it was flagged.
+
+        :param _user: The user sending the message.
+        :type _user: User
+        :param cluster: The messages, with the users who sent them.
+        :type cluster: duplicates.Cluster
+        :param handles: The handles of the users the action was not taken for yet.
+        :type handles: list
+        :param action: config.DUPLICATE_ACTION
+        :type action: str
+        """
+        reason = 'sent by %s users: %s' % (len(cluster.handles), cluster.text[:50])
+        if action == flood.ACTION_DROP:
+            self.moderate(_user, action, reason)
+            return
+        for handle in handles:
+            sender = self.users.search(handle)
+            if sender is not None:
+                self.moderate(sender, action, reason)
+
+    def filter_check(self, _user, msg):
+        """
+        Check a message against the word lists of the content filter, and act on it.
+
+        :param _user: The user sending the message.
+        :type _user: User
+        :param msg: The message.
+        :type msg: str
+        :return: True if the message should be handled, False if it should be ignored.
+        :rtype: bool
+        """
+        if self.content_filter is None:
+            return True
+        matches = self.content_filter.search(msg)
+        if not matches:
+            return True
+        actions = config.FILTER_ACTIONS
+        action = max((actions.get(match.category, flood.ACTION_DROP) for match in matches),
+                     key=flood.SEVERITY.get)
+        FILTER_MATCHES.labels(self.room_name, action).inc()
+        self.on_filtered(_user, msg, matches, action)
+        return action == flood.ACTION_WARN
+
+    def on_filtered(self, _user, msg, matches, action):
+        """
+        Called when a message has words of the content filter lists.
+
+        The message is ignored unless the action is a warn. Kicks and bans need the client to be a moderator.
+
+        :param _user: The user sending the message.
+        :type _user: User
+        :param msg: The message.
+        :type msg: str
+        :param matches: The words found, content_filter.Match with the position in msg and the category.
+        :type matches: list
+        :param action: The most severe action of the categories found, see config.FILTER_ACTIONS.
+        :type action: str
+        """
+        categories = sorted(set(match.category for match in matches))
+        self.moderate(_user, action, 'matched %s' % ', '.join(categories))
+
+    def moderate(self, _user, action, reason):
+        """
+        Act on a message of a user, for flood control and the content filter.
+
+        :param _user: The user sending the message.
+        :type _user: User
+        :param action: flood.ACTION_WARN, ACTION_DROP, ACTION_KICK or ACTION_BAN.
+        :type action: str
+        :param reason: Why, shown on the console.
+        :type reason: str
+        """
+        if action == flood.ACTION_DROP:
+            log.debug('dropped a message of %s:%s, %s' % (_user.nick, _user.id, reason))
+            return
+        self.console_write(COLOR['bright_yellow'], '%s %s:%s, %s.' %
+                           (action.capitalize(), _user.nick, _user.id, reason))
+        if action == flood.ACTION_KICK:
+            self.send_kick_msg(_user.id)
+        elif action == flood.ACTION_BAN:
+            self.send_ban_msg(_user.id)
+
     def private_message_handler(self, private_msg):
         """
         A basic handler for private messages.
@@ -689,19 +1487,22 @@ class TinychatRTCClient(object):
         self.console_write(COLOR['bright_magenta'], 'The youtube (%s) was stopped.' % yt_data['item']['id'])
 
     # Message Construction.
-    def send_join_msg(self):
+    def send_join_msg(self, rtc_version=None):
         """
         The initial connect message to the room.
 
         The client sends this after the websocket handshake has been established.
 
+        :param rtc_version: An already fetched rtc version, if None it is taken from the shared cache.
+        :type rtc_version: str | None
         :return: Returns True if the connect message has been sent, else False.
         :rtype: bool
         """
         if not self.nickname:
             self.nickname = string_util.create_random_string(3, 20)
 
-        rtc_version = apis.tinychat.rtc_version(self.room_name)
+        if rtc_version is None:
+            rtc_version = self.rtc_versions.get(self.room_name)
         log.info('tinychat rtc version: %s' % rtc_version)
         if rtc_version is None:
             rtc_version = config.FALLBACK_RTC_VERSION
@@ -711,7 +1512,6 @@ class TinychatRTCClient(object):
             # opera/chrome user-agent: tinychat-client-webrtc-chrome_win32-2.0.9-255
             payload = {
                 'tc': 'join',
-                'req': self._req,
                 'useragent': 'tinychat-client-webrtc-undefined_win32-' + rtc_version,
                 'token': self._connect_args['token'],
                 'room': self.room_name,
@@ -722,16 +1522,22 @@ class TinychatRTCClient(object):
     def send_pong(self):
         """ Send a response to a ping. """
         payload = {
-            'tc': 'pong',
-            'req': self._req
+            'tc': 'pong'
         }
-        self.send(payload)
+        received = self._ping_received
+        on_written = None
+        if received is not None:
+            on_written = lambda written: self._pong_written(received, written)
+        self.send(payload, on_written=on_written)
+
+    def _pong_written(self, received, written):
+        self._monitor.pong(received, written)
+        self._pong_seconds.observe(written - received)
 
     def set_nick(self):
         """ Send a nick message. """
         payload = {
             'tc': 'nick',
-            'req': self._req,
             'nick': self.nickname
         }
         self.send(payload)
@@ -745,7 +1551,6 @@ class TinychatRTCClient(object):
         """
         payload = {
             'tc': 'msg',
-            'req': self._req,
             'text': msg
         }
         self.send(payload)
@@ -761,7 +1566,6 @@ class TinychatRTCClient(object):
         """
         payload = {
             'tc': 'pvtmsg',
-            'req': self._req,
             'text': msg,
             'handle': uid
         }
@@ -776,46 +1580,63 @@ class TinychatRTCClient(object):
         """
         payload = {
             'tc': 'kick',
-            'req': self._req,
             'handle': uid
         }
         self.send(payload)
 
-    def send_ban_msg(self, uid):
+    def send_ban_msg(self, uid, future=False, timeout=None):
         """
         Send a ban message to ban a user from the room.
 
         :param uid: The ID (handle) of the user to ban.
         :type uid: int
+        :param future: Return a future, completed with the server reply.
+        :type future: bool
+        :param timeout: Seconds to wait for the reply, defaults to config.REQUEST_TIMEOUT.
+        :type timeout: int | float | None
+        :return: A future for the reply if future is True, else the req ID.
+        :rtype: util.workers.Future | int
         """
         payload = {
             'tc': 'ban',
-            'req': self._req,
             'handle': uid
         }
-        self.send(payload)
+        return self.send(payload, future=future, timeout=timeout)
 
-    def send_unban_msg(self, ban_id):
+    def send_unban_msg(self, ban_id, future=False, timeout=None):
         """
         Send a un-ban message to un-ban a banned user.
 
         :param ban_id: The ban ID of the user to un-ban.
         :type ban_id: int
+        :param future: Return a future, completed with the server reply.
+        :type future: bool
+        :param timeout: Seconds to wait for the reply, defaults to config.REQUEST_TIMEOUT.
+        :type timeout: int | float | None
+        :return: A future for the reply if future is True, else the req ID.
+        :rtype: util.workers.Future | int
         """
         payload = {
             'tc': 'unban',
-            'req': self._req,
             'id': ban_id
         }
-        self.send(payload)
+        return self.send(payload, future=future, timeout=timeout)
 
-    def send_banlist_msg(self):
-        """ Send a banlist request message. """
+    def send_banlist_msg(self, future=False, timeout=None):
+        """
+        Send a banlist request message.
+
+        :param future: Return a future, completed with the server reply.
+        :type future: bool
+        :param timeout: Seconds to wait for the reply, defaults to config.REQUEST_TIMEOUT.
+        :type timeout: int | float | None
+        :return: A future for the reply if future is True, else the req ID.
+        :rtype: util.workers.Future | int
+        """
         payload = {
-            'tc': 'banlist',
-            'req': self._req
+            'tc': 'banlist'
         }
-        self.send(payload)
+        return self.send(payload, future=future, timeout=timeout)
 
     def send_room_password_msg(self, password):
         """
@@ -826,38 +1647,47 @@ class TinychatRTCClient(object):
         """
         payload = {
             'tc': 'password',
-            'req': self._req,
             'password': password
         }
         self.send(payload)
 
-    def send_cam_approve_msg(self, uid):
+    def send_cam_approve_msg(self, uid, future=False, timeout=None):
         """
         Allow a user to broadcast in green room enabled room.
 
         :param uid: The ID of the user.
         :type uid: int
+        :param future: Return a future, completed with the server reply.
+        :type future: bool
+        :param timeout: Seconds to wait for the reply, defaults to config.REQUEST_TIMEOUT.
+        :type timeout: int | float | None
+        :return: A future for the reply if future is True, else the req ID.
+        :rtype: util.workers.Future | int
         """
         payload = {
             'tc': 'stream_moder_allow',
-            'req': self._req,
             'handle': uid
         }
-        self.send(payload)
+        return self.send(payload, future=future, timeout=timeout)
 
-    def send_close_user_msg(self, uid):
+    def send_close_user_msg(self, uid, future=False, timeout=None):
         """
         Close a users broadcast.
 
         :param uid: The ID of the user.
         :type uid: int
+        :param future: Return a future, completed with the server reply.
+        :type future: bool
+        :param timeout: Seconds to wait for the reply, defaults to config.REQUEST_TIMEOUT.
+        :type timeout: int | float | None
+        :return: A future for the reply if future is True, else the req ID.
+        :rtype: util.workers.Future | int
         """
         payload = {
             'tc': 'stream_moder_close',
-            'req': self._req,
             'handle': uid
         }
-        self.send(payload)
+        return self.send(payload, future=future, timeout=timeout)
 
     def send_captcha(self, token):
         """
@@ -868,19 +1698,26 @@ class TinychatRTCClient(object):
         """
         payload = {
             'tc': 'captcha',
-            'req': self._req,
             'token': token
         }
         self.send(payload)
 
     # Media.
-    def send_yut_playlist(self):
-        """ Send a youtube playlist request. """
+    def send_yut_playlist(self, future=False, timeout=None):
+        """
+        Send a youtube playlist request.
+
+        :param future: Return a future, completed with the server reply.
+        :type future: bool
+        :param timeout: Seconds to wait for the reply, defaults to config.REQUEST_TIMEOUT.
+        :type timeout: int | float | None
+        :return: A future for the reply if future is True, else the req ID.
+        :rtype: util.workers.Future | int
+        """
         payload = {
-            'tc': 'yut_playlist',
-            'req': self._req
+            'tc': 'yut_playlist'
         }
-        self.send(payload)
+        return self.send(payload, future=future, timeout=timeout)
 
     def send_yut_playlist_add(self, video_id, duration, title, image):
         """
@@ -899,7 +1736,6 @@ class TinychatRTCClient(object):
         """
         payload = {
             'tc': 'yut_playlist_add',
-            'req': self._req,
             'item': {
                 'id': video_id,
                 'duration': duration,
@@ -926,7 +1762,6 @@ class TinychatRTCClient(object):
         """
         payload = {
             'tc': 'yut_playlist_remove',
-            'req': self._req,
             'item': {
                 'id': video_id,
                 'duration': duration,
@@ -949,7 +1784,6 @@ class TinychatRTCClient(object):
         """
         payload = {
             'tc': 'yut_playlist_mode',
-            'req': self._req,
             'mode': {
                 'random': random_,
                 'repeat': repeat
@@ -972,7 +1806,6 @@ class TinychatRTCClient(object):
         """
         payload = {
             'tc': 'yut_play',
-            'req': self._req,
             'item': {
                 'id': video_id,
                 'duration': duration,
@@ -1001,7 +1834,6 @@ class TinychatRTCClient(object):
         """
         payload = {
             'tc': 'yut_pause',
-            'req': self._req,
             'item': {
                 'id': video_id,
                 'duration': duration,
@@ -1026,7 +1858,6 @@ class TinychatRTCClient(object):
         """
         payload = {
             'tc': 'yut_stop',
-            'req': self._req,
             'item': {
                 'id': video_id,
                 'duration': duration,
@@ -1042,23 +1873,114 @@ class TinychatRTCClient(object):
         # the sdp payload is rather large containing a lot of info.
         # Not really sure how to get this to work at this point.
         payload = {
-            'tc': 'getice',
-            'req': self._req
+            'tc': 'getice'
         }
         self.send(payload)
 
     # Message Sender Wrap.
-    def send(self, payload):
+    def send(self, payload, priority=None, future=False, timeout=None, on_written=None):
         """
         Message sender wrapper used by all methods that sends.
 
+        The payload is stamped with the next req ID and queued for the writer,
+        which sends queued messages in priority order, paced by SEND_RATE.
+        This is safe to call from any thread.
+
         :param payload: The object to send. This should be an object that can be serialized to json.
         :type payload: dict | object
+        :param priority: One of the writer priorities, if None the priority is looked up by tc in writer.PRIORITIES.
+        :type priority: int | None
+        :param future: Return a future, completed with the server reply carrying the same req ID.
+        The reply is read on the thread running the event handlers, so in a handler use add_done_callback,
+        waiting on the future there raises RuntimeError. Requests without a reply fail with RequestTimeout,
+        set from the request-expiry thread.
+        :type future: bool
+        :param timeout: Seconds to wait for the reply, defaults to config.REQUEST_TIMEOUT.
+        :type timeout: int | float | None
+        :param on_written: Called with the time the message was written to the websocket.
+        :type on_written: callable | None
+        :return: A future for the reply if future is True, else the req ID of the message.
+        :rtype: pending.RequestFuture | int
+        """
+        with self._req_lock:
+            req = self._req
+            self._req += 1
+        payload['req'] = req
+
+        reply = None
+        if future:
+            reply = self._pending.add(req, timeout)
+
+        _payload = codec.dumps(payload)
+        if self.recorder is not None:
+            self.recorder.record(recorder.OUTBOUND, _payload)
+        if priority is None:
+            priority = writer.PRIORITIES.get(payload['tc'], writer.PRIORITY_NORMAL)
+
+        _writer = self._writer
+        if _writer is None:
+            self._ws.send(_payload)
+            if on_written is not None:
+                on_written(time.time())
+        else:
+            _writer.put(_payload, priority, on_written)
+        log.debug('%s', _payload)
+
+        if reply is not None:
+            return reply
+        return req
+
+    @property
+    def lag_stats(self):
         """
-        _payload = json.dumps(payload)
-        self._ws.send(_payload)
-        self._req += 1
-        log.debug('%s' % _payload)
+        Returns the server ping interval, the time from reading a ping until the pong was written,
+        and the time from the read loop picking up a frame until its handler finished.
+
+        Each is a dict of the count, p50, p90, p99 and max in seconds, over a sliding window of recent samples.
+        pong_pending is the seconds a pong has been waiting to be written, or None.
+
+        :return: The lag stats.
+        :rtype: dict
+        """
+        return self._monitor.stats
+
+    @property
+    def send_stats(self):
+        """
+        Returns the outbound queue depth, and the time from queueing a message until it was written.
+
+        :return: The writer stats, or None if not connected.
+        :rtype: dict | None
+        """
+        if self._writer is not None:
+            return self._writer.stats
+        return None
+
+    def start_recording(self, file_name=None):
+        """
+        Record the raw inbound and outbound frames, for replaying them with bench.replay
+
+        :param file_name: The path and file name of the recording, if None
+        the recording is written to the recordings folder of the room.
+        :type file_name: str | None
+        :return: The recorder.
+        :rtype: recorder.FrameRecorder
+        """
+        self.stop_recording()
+        if file_name is None:
+            path = config.CONFIG_PATH + self.room_name + '/recordings/'
+            if not os.path.exists(path):
+                os.makedirs(path)
+            file_name = path + time.strftime('%Y-%m-%d_%H-%M-%S') + '.rec'
+        self.recorder = recorder.FrameRecorder(file_name)
+        log.info('recording frames to: %s' % file_name)
+        return self.recorder
+
+    def stop_recording(self):
+        """ Stop recording frames. """
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
 
     # Helper Methods.
     def get_runtime(self, as_milli=False):
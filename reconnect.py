@@ -0,0 +1,135 @@
+""" Reconnect state and backoff, shared by the threaded and the event loop client. """
+import time
+import random
+import logging
+
+log = logging.getLogger(__name__)
+
+STATE_IDLE = 'idle'
+STATE_CONNECTING = 'connecting'
+STATE_CONNECTED = 'connected'
+STATE_WAITING = 'waiting'
+STATE_STOPPED = 'stopped'
+
+
+class Reconnector(object):
+    """
+    Tracks the connection state of a client, and the delay before the next reconnect attempt.
+
+    The delay grows exponentially with each failed attempt, with random jitter,
+    so many rooms losing their connection at once do not reconnect in lockstep.
+    """
+
+    def __init__(self, max_attempts=10, base_delay=1.0, max_delay=60.0):
+        """
+        Create the reconnector.
+
+        :param max_attempts: Give up after this many failed attempts in a row, 0 for never.
+        :type max_attempts: int
+        :param base_delay: Seconds to wait before the first attempt.
+        :type base_delay: int | float
+        :param max_delay: The maximum seconds to wait between attempts.
+        :type max_delay: int | float
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+        self.state = STATE_IDLE
+        self.attempt = 0
+        self.reconnects = 0
+        self.failed_attempts = 0
+        self.last_duration = None
+        self.max_duration = 0.0
+        self._total_duration = 0.0
+        self._lost_at = None
+
+    @property
+    def is_running(self):
+        """ True while connecting, connected or waiting to reconnect. """
+        return self.state in (STATE_CONNECTING, STATE_CONNECTED, STATE_WAITING)
+
+    def start(self):
+        """ A new connect was started. """
+        self.state = STATE_CONNECTING
+        self.attempt = 0
+        self._lost_at = None
+
+    def opened(self):
+        """ The connection is open and the join sent, the backoff is kept until the room is joined. """
+        self.state = STATE_CONNECTING
+
+    def connected(self):
+        """
+        The room was joined, which resets the backoff.
+        If it was a reconnect, the time since the connection was lost is recorded.
+        """
+        if self._lost_at is not None:
+            duration = time.time() - self._lost_at
+            self.reconnects += 1
+            self.last_duration = duration
+            self._total_duration += duration
+            if duration > self.max_duration:
+                self.max_duration = duration
+            log.info('reconnected in %.2f seconds after %s attempts' % (duration, self.attempt))
+        self.state = STATE_CONNECTED
+        self.attempt = 0
+        self._lost_at = None
+
+    def lost(self):
+        """
+        The connection was lost, or a connect attempt failed.
+
+        :return: Seconds to wait before the next attempt, or None to give up.
+        :rtype: float | None
+        """
+        if self._lost_at is None:
+            self._lost_at = time.time()
+        else:
+            self.failed_attempts += 1
+
+        self.attempt += 1
+        if self.max_attempts and self.attempt > self.max_attempts:
+            log.warning('giving up reconnecting after %s attempts' % self.max_attempts)
+            self.state = STATE_STOPPED
+            return None
+
+        self.state = STATE_WAITING
+        return self.delay(self.attempt)
+
+    def stop(self):
+        """ The client was disconnected on purpose, or was closed by the server. """
+        self.state = STATE_STOPPED
+        self._lost_at = None
+
+    def delay(self, attempt):
+        """
+        The jittered exponential backoff delay for an attempt.
+
+        :param attempt: The attempt number, starting at 1.
+        :type attempt: int
+        :return: Seconds to wait.
+        :rtype: float
+        """
+        delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1))
+        return random.uniform(delay / 2, delay)
+
+    @property
+    def stats(self):
+        """
+        Returns the reconnect stats.
+
+        Duration is the time from losing the connection until it was up again, in seconds.
+
+        :return: A dictionary of stats.
+        :rtype: dict
+        """
+        return {
+            'state': self.state,
+            'attempt': self.attempt,
+            'reconnects': self.reconnects,
+            'failed_attempts': self.failed_attempts,
+            'duration_last': self.last_duration,
+            'duration_avg': self._total_duration / self.reconnects if self.reconnects else 0.0,
+            'duration_max': self.max_duration
+        }
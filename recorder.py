@@ -0,0 +1,96 @@
+"""
+Records raw websocket frames to an append-only file, for replaying them offline.
+
+A recording is a header followed by records. Each record is the direction,
+the seconds since the recording started, the length and the raw frame.
+"""
+import time
+import struct
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'TCREC1\n'
+
+INBOUND = 0
+OUTBOUND = 1
+
+_RECORD = struct.Struct('<BdI')
+
+# monotonic is not available on python 2.
+_clock = getattr(time, 'monotonic', time.time)
+
+
+class FrameRecorder(object):
+    """ Appends frames to a recording. This is safe to call from any thread. """
+
+    def __init__(self, file_name):
+        """
+        Open a recording. An existing recording is appended to.
+
+        :param file_name: The path and file name of the recording.
+        :type file_name: str
+        """
+        self.file_name = file_name
+        self.frames = 0
+        self._started = _clock()
+        self._lock = threading.Lock()
+        self._file = open(file_name, 'ab')
+        if self._file.tell() == 0:
+            self._file.write(MAGIC)
+
+    def record(self, direction, data):
+        """
+        Append a frame.
+
+        :param direction: INBOUND or OUTBOUND.
+        :type direction: int
+        :param data: The raw frame.
+        :type data: bytes | str
+        """
+        if not isinstance(data, bytes):
+            data = data.encode('utf-8')
+        header = _RECORD.pack(direction, _clock() - self._started, len(data))
+        with self._lock:
+            if self._file is None:
+                return
+            self._file.write(header)
+            self._file.write(data)
+            self.frames += 1
+
+    def close(self):
+        """ Flush and close the recording. """
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def read_recording(file_name):
+    """
+    Read the frames of a recording.
+
+    Appending to an existing recording restarts the time, so the
+    time of the frames of a later session start from 0 again.
+
+    :param file_name: The path and file name of the recording.
+    :type file_name: str
+    :return: A generator of (direction, seconds, raw frame) tuples.
+    :rtype: generator
+    """
+    with open(file_name, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError('not a frame recording: %s' % file_name)
+        while True:
+            header = f.read(_RECORD.size)
+            if len(header) < _RECORD.size:
+                if header:
+                    log.warning('truncated record at the end of: %s' % file_name)
+                break
+            direction, seconds, size = _RECORD.unpack(header)
+            data = f.read(size)
+            if len(data) < size:
+                log.warning('truncated record at the end of: %s' % file_name)
+                break
+            yield direction, seconds, data
@@ -0,0 +1,235 @@
+""" A process wide cache of the tinychat rtc version, shared by all rooms and persisted to disk. """
+import os
+import json
+import time
+import logging
+import threading
+
+import config
+import apis.tinychat
+from util.workers import Future
+
+log = logging.getLogger(__name__)
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def get_cache():
+    """
+    Get the process wide RtcVersionCache, shared by all clients.
+
+    :return: The shared RtcVersionCache.
+    :rtype: RtcVersionCache
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = RtcVersionCache(ttl=config.RTC_VERSION_TTL, refresh_ahead=config.RTC_VERSION_REFRESH,
+                                      file_path=config.CONFIG_PATH, file_name=config.RTC_VERSION_FILE)
+        return _shared
+
+
+class RtcVersionCache(object):
+    """
+    Caches the rtc version parsed from the room html, so it is not downloaded on every join.
+
+    Concurrent lookups of a missing or expired version wait for a single fetch.
+    A version close to expiring is refreshed by a background thread,
+    while the cached version keeps being returned.
+    """
+
+    def __init__(self, ttl=3600, refresh_ahead=300, file_path=None, file_name='rtc_version.json',
+                 min_refetch=60):
+        """
+        Create the cache, loading a persisted version if there is one.
+
+        :param ttl: Seconds a fetched version is used.
+        :type ttl: int | float
+        :param refresh_ahead: Seconds before expiry to start a background refresh.
+        :type refresh_ahead: int | float
+        :param file_path: The path of the cache file, None to not persist the version.
+        :type file_path: str | None
+        :param file_name: The name of the cache file.
+        :type file_name: str
+        :param min_refetch: invalidate() is ignored for a version fetched less than this many seconds ago.
+        :type min_refetch: int | float
+        """
+        self.ttl = ttl
+        self.refresh_ahead = refresh_ahead
+        self.file_path = file_path
+        self.file_name = file_name
+        self.min_refetch = min_refetch
+
+        self._lock = threading.Lock()
+        self._version = None
+        self._fetched_at = 0.0
+        self._inflight = None
+        self._room = None
+
+        self.hits = 0
+        self.misses = 0
+        self.fetches = 0
+        self.failed = 0
+        self._load()
+
+    def get(self, room):
+        """
+        Get the rtc version, fetching it if it is not cached or has expired.
+
+        :param room: A room name to fetch the room html of, when fetching.
+        :type room: str
+        :return: The rtc version, a stale version if the fetch failed, or None.
+        :rtype: str | None
+        """
+        # the fetch has its own http timeout.
+        return self._lookup(room, block=True).result()
+
+    def get_future(self, room):
+        """
+        Like get, without waiting for a fetch. The fetch runs in a background thread.
+
+        :param room: A room name to fetch the room html of, when fetching.
+        :type room: str
+        :return: A future completed with the rtc version, a stale version if the fetch failed, or None.
+        :rtype: Future
+        """
+        return self._lookup(room, block=False)
+
+    def peek(self, room=None):
+        """
+        Get the cached rtc version without fetching it.
+
+        A background refresh is started if the version is about to expire.
+
+        :param room: A room name to fetch the room html of, when refreshing.
+        :type room: str | None
+        :return: The rtc version, or None if not cached or expired.
+        :rtype: str | None
+        """
+        if room is not None:
+            self._room = room
+
+        refresh = None
+        with self._lock:
+            age = time.time() - self._fetched_at
+            if self._version is None or age >= self.ttl:
+                return None
+            self.hits += 1
+            version = self._version
+            if age >= self.ttl - self.refresh_ahead and self._inflight is None:
+                refresh, _ = self._flight()
+
+        if refresh is not None:
+            t = threading.Thread(target=self._fetch, args=(self._room, refresh), name='rtc-version-refresh')
+            t.daemon = True
+            t.start()
+        return version
+
+    def _lookup(self, room, block):
+        version = self.peek(room)
+        if version is not None:
+            future = Future()
+            future.set_result(version)
+            return future
+
+        with self._lock:
+            self.misses += 1
+            future, owner = self._flight()
+        if owner:
+            if block:
+                self._fetch(room, future)
+            else:
+                t = threading.Thread(target=self._fetch, args=(room, future), name='rtc-version-fetch')
+                t.daemon = True
+                t.start()
+        return future
+
+    def invalidate(self):
+        """
+        Expire the cached version, e.g when joining with it failed.
+
+        :return: True if expired, False if it was fetched less than min_refetch seconds ago.
+        :rtype: bool
+        """
+        with self._lock:
+            if time.time() - self._fetched_at < self.min_refetch:
+                return False
+            self._fetched_at = 0.0
+            return True
+
+    def _flight(self):
+        """ Returns the in-flight fetch future, and True if the caller has to do the fetch. Needs the lock. """
+        if self._inflight is not None:
+            return self._inflight, False
+        self._inflight = Future()
+        return self._inflight, True
+
+    def _fetch(self, room, future):
+        version = None
+        try:
+            version = apis.tinychat.rtc_version(room or 'tinychat')
+        except Exception as e:
+            log.error('failed to fetch the rtc version: %s' % e, exc_info=True)
+
+        with self._lock:
+            self.fetches += 1
+            if version is None:
+                self.failed += 1
+            else:
+                self._version = version
+                self._fetched_at = time.time()
+            self._inflight = None
+            # rather a stale version than the fallback.
+            result = self._version
+
+        if version is not None:
+            log.info('fetched rtc version: %s' % version)
+            self._save(version)
+        future.set_result(result)
+
+    def _load(self):
+        if self.file_path is None:
+            return
+        try:
+            with open(self.file_path + self.file_name) as f:
+                data = json.load(f)
+            self._version = data['version']
+            self._fetched_at = float(data['fetched_at'])
+        except (IOError, OSError, ValueError, KeyError, TypeError) as e:
+            log.debug('no rtc version cache file loaded: %s' % e)
+
+    def _save(self, version):
+        if self.file_path is None:
+            return
+        tmp = '%s%s.%s.tmp' % (self.file_path, self.file_name, os.getpid())
+        try:
+            if not os.path.exists(self.file_path):
+                os.makedirs(self.file_path)
+            with open(tmp, 'w') as f:
+                json.dump({'version': version, 'fetched_at': self._fetched_at}, f)
+            try:
+                os.rename(tmp, self.file_path + self.file_name)
+            except OSError:  # windows does not replace an existing file.
+                os.remove(self.file_path + self.file_name)
+                os.rename(tmp, self.file_path + self.file_name)
+        except (IOError, OSError) as e:
+            log.error('failed to write the rtc version cache file: %s' % e)
+
+    @property
+    def stats(self):
+        """
+        Returns the cached version and lookup stats.
+
+        :return: A dictionary of stats.
+        :rtype: dict
+        """
+        with self._lock:
+            return {
+                'version': self._version,
+                'age': time.time() - self._fetched_at if self._version is not None else None,
+                'hits': self.hits,
+                'misses': self.misses,
+                'fetches': self.fetches,
+                'failed': self.failed
+            }
@@ -0,0 +1,241 @@
+""" Run many rooms spread across worker processes, e.g python supervisor.py -s 4 room1 room2 room3 """
+import sys
+import zlib
+import time
+import logging
+import argparse
+import threading
+import multiprocessing
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+import pinylib
+import async_client
+
+log = logging.getLogger(__name__)
+
+
+def shard_for(room, shards):
+    """
+    Find the shard (worker) a room belongs to.
+
+    The hash is stable across processes and restarts, so a room always lands on the same worker.
+
+    :param room: The room name.
+    :type room: str | unicode
+    :param shards: The number of shards.
+    :type shards: int
+    :return: The shard number.
+    :rtype: int
+    """
+    # a byte str name is hashed as is, encoding it on python 2 would decode it as ascii first.
+    name = room.lower() if isinstance(room, bytes) else room.lower().encode('utf-8')
+    return (zlib.crc32(name) & 0xffffffff) % shards
+
+
+def _worker(shard, rooms, client_class, stats_queue, stop_event, stats_interval):
+    """ The worker process. Runs the rooms of a shard on one event loop, and reports stats. """
+    if pinylib.CONFIG.METRICS_PORT:
+        # each worker serves the metrics of its own rooms, on the port after the previous worker.
+        pinylib.CONFIG.METRICS_PORT += shard
+    loop = async_client.EventLoop()
+    for room in rooms:
+        loop.add(client_class(room=room))
+
+    t = threading.Thread(target=loop.run)
+    t.daemon = True
+    t.start()
+
+    last_frames = 0
+    last_time = time.time()
+    while not stop_event.wait(stats_interval) and t.is_alive():
+        now = time.time()
+        frames = loop.frames
+        stats_queue.put({
+            'shard': shard,
+            'pid': multiprocessing.current_process().pid,
+            'rooms': len(rooms),
+            'connected': sum(1 for client in loop.clients if client.is_connected),
+            'frames': frames,
+            'events_per_second': (frames - last_frames) / (now - last_time),
+            'time': now
+        })
+        last_frames = frames
+        last_time = now
+
+    loop.stop()
+    t.join(5)
+
+
+class Supervisor(object):
+    """ Shards rooms across worker processes, restarts crashed workers and collects their stats. """
+
+    def __init__(self, rooms, shards=None, client_class=async_client.AsyncTinychatRTCClient,
+                 stats_interval=5, restart_delay=5):
+        """
+        Create the supervisor.
+
+        :param rooms: The room names.
+        :type rooms: list
+        :param shards: The number of worker processes, defaults to the number of CPU cores.
+        :type shards: int | None
+        :param client_class: The client class each worker creates for its rooms.
+        It must be importable by the worker processes.
+        :type client_class: type
+        :param stats_interval: Seconds between worker stats reports.
+        :type stats_interval: int | float
+        :param restart_delay: Minimum seconds between restarts of the same worker.
+        :type restart_delay: int | float
+        """
+        self.shards = shards or multiprocessing.cpu_count()
+        self.client_class = client_class
+        self.stats_interval = stats_interval
+        self.restart_delay = restart_delay
+        self.rooms = dict((shard, []) for shard in range(self.shards))
+        for room in rooms:
+            self.rooms[shard_for(room, self.shards)].append(room)
+
+        self.stats = {}
+        self.restarts = dict((shard, 0) for shard in range(self.shards))
+        self._workers = {}
+        self._started = {}
+        self._stats_queue = multiprocessing.Queue()
+        self._stop_event = multiprocessing.Event()
+
+    def start(self):
+        """ Start a worker process for every shard with rooms. """
+        for shard in self.rooms:
+            if self.rooms[shard]:
+                self._start_worker(shard)
+
+    def _start_worker(self, shard):
+        p = multiprocessing.Process(target=_worker, name='shard-%s' % shard,
+                                    args=(shard, self.rooms[shard], self.client_class,
+                                          self._stats_queue, self._stop_event, self.stats_interval))
+        p.daemon = True
+        p.start()
+        self._workers[shard] = p
+        self._started[shard] = time.time()
+        log.info('started shard %s pid %s with %s rooms' % (shard, p.pid, len(self.rooms[shard])))
+
+    def check_workers(self):
+        """
+        Restart workers that have exited, or stopped reporting stats, with their rooms.
+
+        :return: The shards that were restarted.
+        :rtype: list
+        """
+        restarted = []
+        now = time.time()
+        for shard, p in list(self._workers.items()):
+            if now - self._started[shard] < self.restart_delay:
+                continue
+            last_report = self.stats.get(shard, {}).get('time', self._started[shard])
+            is_hung = now - last_report > self.stats_interval * 3
+            if not p.is_alive() or is_hung:
+                log.warning('shard %s pid %s is down (exitcode %s, hung %s), restarting' %
+                            (shard, p.pid, p.exitcode, is_hung))
+                if p.is_alive():
+                    p.terminate()
+                p.join(1)
+                self.restarts[shard] += 1
+                self.stats.pop(shard, None)
+                self._start_worker(shard)
+                restarted.append(shard)
+        return restarted
+
+    def collect_stats(self, timeout=0):
+        """
+        Read the stats reports sent by the workers.
+
+        :param timeout: Seconds to wait for the first report.
+        :type timeout: int | float
+        :return: The latest stats of each shard.
+        :rtype: dict
+        """
+        try:
+            report = self._stats_queue.get(timeout=timeout) if timeout else self._stats_queue.get_nowait()
+            while True:
+                if self._workers.get(report['shard']) is not None and \
+                        self._workers[report['shard']].pid == report['pid']:
+                    report['restarts'] = self.restarts[report['shard']]
+                    self.stats[report['shard']] = report
+                report = self._stats_queue.get_nowait()
+        except queue.Empty:
+            pass
+        return self.stats
+
+    @property
+    def events_per_second(self):
+        """ The total event rate of all workers. """
+        return sum(s['events_per_second'] for s in self.stats.values())
+
+    def run(self, report=None):
+        """
+        Start the workers and supervise them until stop is called or KeyboardInterrupt.
+
+        :param report: Optional callable receiving the supervisor after each stats interval.
+        :type report: callable | None
+        """
+        self.start()
+        try:
+            while not self._stop_event.is_set():
+                deadline = time.time() + self.stats_interval
+                while time.time() < deadline:
+                    self.collect_stats(timeout=max(0.1, deadline - time.time()))
+                self.check_workers()
+                if report is not None:
+                    report(self)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stop()
+
+    def stop(self):
+        """ Stop all workers. """
+        self._stop_event.set()
+        for p in self._workers.values():
+            p.join(self.stats_interval + 5)
+            if p.is_alive():
+                p.terminate()
+
+
+def print_stats(supervisor):
+    """ Print one line of stats for each shard. """
+    for shard in sorted(supervisor.stats):
+        s = supervisor.stats[shard]
+        print ('shard %s pid %s: %s/%s rooms connected, %.1f events/s, %s restarts' %
+               (shard, s['pid'], s['connected'], s['rooms'], s['events_per_second'], s['restarts']))
+    print ('total: %.1f events/s' % supervisor.events_per_second)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run many rooms across worker processes.')
+    parser.add_argument('rooms', nargs='*', help='room names')
+    parser.add_argument('-f', '--file', help='a file with one room name per line')
+    parser.add_argument('-s', '--shards', type=int, default=None, help='worker processes, default: cpu cores')
+    parser.add_argument('-i', '--interval', type=float, default=5, help='stats interval in seconds')
+    args = parser.parse_args()
+
+    rooms = list(args.rooms)
+    if args.file:
+        with open(args.file) as f:
+            rooms.extend(line.strip() for line in f if line.strip())
+    if not rooms:
+        parser.error('no rooms given')
+
+    Supervisor(rooms, shards=args.shards, stats_interval=args.interval).run(report=print_stats)
+
+
+if __name__ == '__main__':
+    if pinylib.CONFIG.DEBUG_TO_FILE:
+        formater = '%(asctime)s : %(levelname)s : %(filename)s : %(lineno)d : %(funcName)s() : %(name)s : %(message)s'
+        logging.basicConfig(filename=pinylib.CONFIG.DEBUG_FILE_NAME,
+                            level=pinylib.CONFIG.DEBUG_LEVEL, format=formater)
+        log.info('Starting pinylib webrtc supervisor version: %s' % pinylib.__version__)
+    else:
+        log.addHandler(logging.NullHandler())
+    sys.exit(main())
@@ -0,0 +1,985 @@
+"""
+A full text index of chat messages, for finding who said what, where and when.
+
+Messages are indexed in memory, and written to immutable segment files in the index folder by a writer thread,
+which also merges the segments of the process as they add up. A segment holds the term postings, the time, room,
+nick and account of every message, and the messages in compressed blocks. Queries run over all segments,
+newest first.
+
+Build an index of existing histories and chat logs, using several processes:
+python -m text_index build rooms/ --workers 4
+
+Search it:
+python -m text_index search rooms/index/ 'some words "or a phrase"' --days 30 --room some_room
+"""
+import os
+import re
+import sys
+import json
+import heapq
+import mmap
+import bisect
+import time
+import zlib
+import struct
+import atexit
+import logging
+import argparse
+import itertools
+import threading
+import multiprocessing
+from array import array
+
+import history
+
+log = logging.getLogger(__name__)
+
+MAGIC = b'TCIDX1\n'
+EXTENSION = '.seg'
+
+# Messages per compressed block of a segment.
+DOC_BLOCK = 32
+
+_TOKEN = re.compile(r'\w+', re.UNICODE)
+_PHRASE = re.compile(r'"([^"]*)"')
+# Segments of a process merged at a time, the smallest first.
+MERGE_FACTOR = 10
+# Seconds a segment file stays mapped after a query, and the most segment files mapped at once.
+IDLE_SECONDS = 60
+MAX_OPEN = 64
+
+# A chat message line of a chat log, e.g [18:01:02] nick: message
+_LOG_LINE = re.compile(r'^\[(\d\d):(\d\d):(\d\d)(?::(AM|PM))?\] ([^\s:]+): (.*)$')
+# Console lines of a chat log in the same form, e.g Joins: nick:1:account
+_LOG_CONSOLE_NICKS = ('Joins', 'Moderator')
+_LOG_CONSOLE_TEXT = re.compile(r'^[^\s:]+:\d+(:\S*)?$')
+# Headers of the room info lines, written as key: value lines in the same second, in debug mode.
+_LOG_INFO_HEADERS = (u'## Room Information ##', u'## Room Settings Change ##')
+
+# Offsets and lengths of the sections of a segment, the number of messages and whether they are in time order.
+_FOOTER = struct.Struct('<QQQQQQQQQQIB')
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def get_index(path, flush_docs=10000, flush_interval=300):
+    """
+    Get the InvertedIndex of a folder, shared by all clients of the process.
+
+    The indexes are flushed and closed when the process exits.
+
+    :param path: The index folder, e.g rooms/index/
+    :type path: str
+    :param flush_docs: Messages kept in memory before they are written to a segment.
+    :type flush_docs: int
+    :param flush_interval: Maximum seconds messages are kept in memory.
+    :type flush_interval: int | float
+    :return: The index of the folder.
+    :rtype: InvertedIndex
+    """
+    key = os.path.abspath(path)
+    with _shared_lock:
+        if not _shared:
+            atexit.register(close_all)
+        index = _shared.get(key)
+        if index is None:
+            index = InvertedIndex(path, flush_docs=flush_docs, flush_interval=flush_interval)
+            _shared[key] = index
+        return index
+
+
+def close_all():
+    """ Flush and close the indexes opened by get_index. """
+    with _shared_lock:
+        indexes = list(_shared.values())
+        _shared.clear()
+    for index in indexes:
+        index.close()
+
+
+def _unicode(text):
+    if isinstance(text, bytes):
+        return text.decode('utf-8', 'replace')
+    return text
+
+
+def tokenize(text):
+    """
+    Split a text into lower case terms.
+
+    :param text: The text.
+    :type text: str
+    :return: The terms, in order.
+    :rtype: list
+    """
+    return [token.lower() for token in _TOKEN.findall(_unicode(text or u''))]
+
+
+def parse_query(query):
+    """
+    Split a query into terms, and phrases in double quotes.
+
+    :param query: The query, e.g 'spam "buy now"'
+    :type query: str
+    :return: The terms (including the terms of the phrases), and a list of the phrases as lists of terms.
+    :rtype: tuple
+    """
+    query = _unicode(query)
+    phrases = [tokenize(phrase) for phrase in _PHRASE.findall(query)]
+    phrases = [phrase for phrase in phrases if len(phrase) > 1]
+    terms = tokenize(_PHRASE.sub(' ', query))
+    for phrase in phrases:
+        terms.extend(phrase)
+    return sorted(set(terms)), phrases
+
+
+def _has_phrase(tokens, phrase):
+    size = len(phrase)
+    first = phrase[0]
+    for i, token in enumerate(tokens):
+        if token == first and tokens[i:i + size] == phrase:
+            return True
+    return False
+
+
+def _array(typecode, data=b''):
+    a = array(typecode)
+    if data:
+        if hasattr(a, 'frombytes'):
+            a.frombytes(data)
+        else:
+            a.fromstring(data)
+        if sys.byteorder != 'little':
+            a.byteswap()
+    return a
+
+
+def _bytes(a):
+    if sys.byteorder != 'little':
+        a = array(a.typecode, a)
+        a.byteswap()
+    return a.tobytes() if hasattr(a, 'tobytes') else a.tostring()
+
+
+def _pack_json(value):
+    return zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+
+
+def _unpack_json(data):
+    return json.loads(zlib.decompress(data).decode('utf-8'))
+
+
+class Hit(object):
+    """ A message found by a query. """
+
+    __slots__ = ('room', 'time', 'nick', 'account', 'text')
+
+    def __init__(self, room, timestamp, nick, account, text):
+        self.room = room
+        self.time = timestamp
+        self.nick = nick
+        self.account = account
+        self.text = text
+
+    def __repr__(self):
+        return 'Hit(%r, %r, %r, %r, %r)' % (self.room, self.time, self.nick, self.account, self.text)
+
+
+class _Segment(object):
+    """
+    The parts shared by the memory and disk segments. Messages are numbered from 0 in the order added.
+
+    A segment is ordered when its messages were added in time order, as they are by a client or a merge.
+    Queries read an ordered segment from its newest message back, and stop at the limit.
+    """
+
+    def __init__(self):
+        self.times = _array('d')
+        self.room_ids = _array('I')
+        self.nick_ids = _array('I')
+        self.account_ids = _array('I')
+        self.rooms = []
+        self.nicks = []
+        self.accounts = []
+        self.ordered = True
+        self.last_time = 0
+
+    def __len__(self):
+        return len(self.times)
+
+    def postings(self, term):
+        raise NotImplementedError
+
+    def text(self, doc):
+        raise NotImplementedError
+
+    def search(self, terms, phrases, rooms=None, nick=None, account=None, start=None, end=None, limit=None):
+        """
+        Find the newest messages that have all terms and phrases, and match the filters.
+
+        The rarest term is read from the end, and the other terms are looked up by bisecting their postings.
+
+        :return: A list of (time, doc) tuples, newest first. The whole list if the segment is not ordered.
+        :rtype: list
+        """
+        if terms:
+            postings = sorted((self.postings(term) for term in terms), key=len)
+            if not postings[0]:
+                return []
+            candidates, others = postings[0], postings[1:]
+        else:
+            candidates, others = range(len(self)), []
+
+        def ids(table, values):
+            values = set(value.lower() for value in values)
+            return set(i for i, value in enumerate(table) if value.lower() in values)
+
+        room_ids = ids(self.rooms, rooms) if rooms else None
+        nick_ids = ids(self.nicks, [nick]) if nick else None
+        account_ids = ids(self.accounts, [account]) if account else None
+        if (room_ids is not None and not room_ids) or (nick_ids is not None and not nick_ids) or \
+                (account_ids is not None and not account_ids):
+            return []
+
+        times = self.times
+        ordered = self.ordered
+        matches = []
+        for doc in reversed(candidates):
+            t = times[doc]
+            if end is not None and t > end:
+                continue
+            if start is not None and t < start:
+                if ordered:
+                    break
+                continue
+            if room_ids is not None and self.room_ids[doc] not in room_ids:
+                continue
+            if nick_ids is not None and self.nick_ids[doc] not in nick_ids:
+                continue
+            if account_ids is not None and self.account_ids[doc] not in account_ids:
+                continue
+            found = True
+            for p in others:
+                i = bisect.bisect_left(p, doc)
+                if i == len(p) or p[i] != doc:
+                    found = False
+                    break
+            if not found:
+                continue
+            if phrases:
+                tokens = tokenize(self.text(doc))
+                if not all(_has_phrase(tokens, phrase) for phrase in phrases):
+                    continue
+            matches.append((t, doc))
+            if ordered and limit is not None and len(matches) >= limit:
+                break
+        if not ordered:
+            matches.sort(reverse=True)
+        return matches
+
+    def hit(self, doc):
+        """ The Hit of a message. """
+        return Hit(self.rooms[self.room_ids[doc]], self.times[doc], self.nicks[self.nick_ids[doc]],
+                   self.accounts[self.account_ids[doc]], self.text(doc))
+
+
+class MemorySegment(_Segment):
+    """ The segment messages are added to, until it is written to disk. """
+
+    def __init__(self):
+        super(MemorySegment, self).__init__()
+        self._texts = []
+        self._postings = {}
+        self._ids = ({}, {}, {})
+        self.created = time.time()
+
+    def _id(self, i, table, value):
+        ids = self._ids[i]
+        _id = ids.get(value)
+        if _id is None:
+            _id = ids[value] = len(table)
+            table.append(value)
+        return _id
+
+    def add(self, room, timestamp, nick, account, text):
+        """
+        Index a message.
+
+        :param room: The room name.
+        :type room: str
+        :param timestamp: The time of the message.
+        :type timestamp: float
+        :param nick: The nick of the sender.
+        :type nick: str
+        :param account: The account of the sender, or ''.
+        :type account: str
+        :param text: The message.
+        :type text: str
+        """
+        doc = len(self.times)
+        text = _unicode(text or u'')
+        if timestamp < self.last_time:
+            self.ordered = False
+        else:
+            self.last_time = timestamp
+        self.times.append(timestamp)
+        self.room_ids.append(self._id(0, self.rooms, _unicode(room)))
+        self.nick_ids.append(self._id(1, self.nicks, _unicode(nick or u'')))
+        self.account_ids.append(self._id(2, self.accounts, _unicode(account or u'')))
+        self._texts.append(text)
+        postings = self._postings
+        for term in set(tokenize(text)):
+            p = postings.get(term)
+            if p is None:
+                p = postings[term] = _array('I')
+            p.append(doc)
+
+    def postings(self, term):
+        return self._postings.get(term, ())
+
+    def text(self, doc):
+        return self._texts[doc]
+
+    def write(self, file_name):
+        """
+        Write the segment. The file is written under a temporary name and renamed,
+        so readers never see a partial segment.
+
+        :param file_name: The path and file name of the segment.
+        :type file_name: str
+        """
+        terms = sorted(self._postings)
+        offsets = []
+        postings = []
+        offset = 0
+        for term in terms:
+            p = self._postings[term]
+            offsets.append([term, offset, len(p)])
+            postings.append(_bytes(p))
+            offset += len(p) * 4
+
+        # a block is the utf-8 byte length of each message, followed by the messages.
+        blocks = []
+        block_offsets = _array('I')
+        offset = 0
+        for i in range(0, len(self._texts), DOC_BLOCK):
+            texts = [text.encode('utf-8') for text in self._texts[i:i + DOC_BLOCK]]
+            block = zlib.compress(_bytes(array('I', [len(text) for text in texts])) + b''.join(texts))
+            block_offsets.append(offset)
+            blocks.append(block)
+            offset += len(block)
+
+        sections = [
+            _pack_json([self.rooms, self.nicks, self.accounts]),
+            _bytes(self.times) + _bytes(self.room_ids) + _bytes(self.nick_ids) + _bytes(self.account_ids),
+            _pack_json(offsets),
+            b''.join(postings),
+            _bytes(block_offsets) + b''.join(blocks)
+        ]
+        footer = []
+        position = len(MAGIC)
+        for section in sections:
+            footer.extend([position, len(section)])
+            position += len(section)
+
+        tmp = file_name + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(MAGIC)
+            for section in sections:
+                f.write(section)
+            f.write(_FOOTER.pack(*(footer + [len(self), self.ordered])))
+        os.rename(tmp, file_name)
+
+
+class DiskSegment(_Segment):
+    """
+    A memory mapped segment file.
+
+    The term dictionary and the per message time, room, nick and account are loaded when created,
+    postings are read from the map, and message blocks are decompressed when needed.
+    The file is only mapped between open and close, which can be called again, so idle segments
+    do not hold a file descriptor.
+    """
+
+    def __init__(self, file_name):
+        super(DiskSegment, self).__init__()
+        self.file_name = file_name
+        self.used = 0
+        self._file = None
+        self._map = None
+        m = self.open()
+        try:
+            if m[:len(MAGIC)] != MAGIC:
+                raise ValueError('not an index segment: %s' % file_name)
+            footer = _FOOTER.unpack_from(m, len(m) - _FOOTER.size)
+            count = footer[10]
+            self.ordered = bool(footer[11])
+            sections = [(footer[i], footer[i] + footer[i + 1]) for i in range(0, 10, 2)]
+
+            start, end = sections[0]
+            self.rooms, self.nicks, self.accounts = _unpack_json(m[start:end])
+            start = sections[1][0]
+            arrays = []
+            for typecode, size in (('d', 8), ('I', 4), ('I', 4), ('I', 4)):
+                arrays.append(_array(typecode, m[start:start + count * size]))
+                start += count * size
+            self.times, self.room_ids, self.nick_ids, self.account_ids = arrays
+            if count:
+                self.last_time = self.times[-1] if self.ordered else max(self.times)
+
+            start, end = sections[2]
+            self._terms = dict((term, (offset, size)) for term, offset, size in _unpack_json(m[start:end]))
+            self._postings_start = sections[3][0]
+
+            start, end = sections[4]
+            blocks = (count + DOC_BLOCK - 1) // DOC_BLOCK
+            self._block_offsets = _array('I', m[start:start + blocks * 4])
+            self._blocks_start = start + blocks * 4
+            self._blocks_end = end
+            self._block_cache = (None, None, None)
+        finally:
+            self.close()
+
+    @property
+    def is_open(self):
+        return self._map is not None
+
+    def open(self):
+        """
+        Map the file, if it is not mapped.
+
+        :return: The map.
+        :rtype: mmap.mmap
+        """
+        if self._map is None:
+            self._file = open(self.file_name, 'rb')
+            try:
+                self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            except Exception:
+                self._file.close()
+                self._file = None
+                raise
+        self.used = time.time()
+        return self._map
+
+    def postings(self, term):
+        entry = self._terms.get(term)
+        if entry is None:
+            return ()
+        offset, size = entry
+        start = self._postings_start + offset
+        return _array('I', self._map[start:start + size * 4])
+
+    def text(self, doc):
+        block, i = divmod(doc, DOC_BLOCK)
+        cached, sizes, data = self._block_cache
+        if cached != block:
+            start = self._blocks_start + self._block_offsets[block]
+            if block + 1 < len(self._block_offsets):
+                end = self._blocks_start + self._block_offsets[block + 1]
+            else:
+                end = self._blocks_end
+            data = zlib.decompress(self._map[start:end])
+            sizes = _array('I', data[:min(DOC_BLOCK, len(self) - block * DOC_BLOCK) * 4])
+            self._block_cache = (block, sizes, data)
+        start = len(sizes) * 4 + sum(sizes[:i])
+        return data[start:start + sizes[i]].decode('utf-8')
+
+    @property
+    def terms(self):
+        """ The number of distinct terms. """
+        return len(self._terms)
+
+    def close(self):
+        """ Unmap the file. """
+        if self._map is not None:
+            self._map.close()
+            self._file.close()
+            self._map = self._file = None
+            self._block_cache = (None, None, None)
+
+
+class InvertedIndex(object):
+    """
+    Indexes chat messages as they arrive, and searches them by terms, phrases, room, user and time.
+
+    Full memory segments are written, and the segments of the process merged, by a writer thread,
+    so adding a message never waits on the disk. The index folder can be shared by several processes,
+    each writes and merges its own segments. This is safe to call from any thread.
+    """
+
+    def __init__(self, path, flush_docs=10000, flush_interval=300, merge_factor=MERGE_FACTOR,
+                 idle_seconds=IDLE_SECONDS, max_open=MAX_OPEN):
+        """
+        :param path: The index folder, created if it does not exist.
+        :type path: str
+        :param flush_docs: Messages kept in memory before they are written to a segment.
+        :type flush_docs: int
+        :param flush_interval: Maximum seconds messages are kept in memory.
+        :type flush_interval: int | float
+        :param merge_factor: Merge the smallest segments of the process, when it has this many, 0 to not merge.
+        :type merge_factor: int
+        :param idle_seconds: Seconds a segment file stays mapped after a query.
+        :type idle_seconds: int | float
+        :param max_open: The most segment files mapped at once, after a query.
+        :type max_open: int
+        """
+        self.path = path
+        self.flush_docs = flush_docs
+        self.flush_interval = flush_interval
+        self.merge_factor = merge_factor
+        self.idle_seconds = idle_seconds
+        self.max_open = max_open
+        self._memory = MemorySegment()
+        # full memory segments waiting to be written, searched meanwhile.
+        self._unwritten = []
+        self._segments = {}
+        self._lock = threading.Lock()
+        # held while writing and merging segments, taken before _lock.
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._writer = None
+        self._closed = False
+        self._seq = itertools.count()
+        self._pid = str(os.getpid())
+        self.added = 0
+        self.merges = 0
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def add(self, room, timestamp, nick, account, text):
+        """
+        Index a message.
+
+        :param room: The room name.
+        :type room: str
+        :param timestamp: The time of the message.
+        :type timestamp: float
+        :param nick: The nick of the sender.
+        :type nick: str
+        :param account: The account of the sender, or ''.
+        :type account: str
+        :param text: The message.
+        :type text: str
+        """
+        with self._lock:
+            self._memory.add(room, timestamp, nick, account, text)
+            self.added += 1
+            if self._writer is None and not self._closed:
+                self._start_writer()
+            if len(self._memory) < self.flush_docs:
+                return
+            self._rotate()
+        self._wake.set()
+
+    def _start_writer(self):
+        """ Start the writer thread, also flushing the memory segment after flush_interval. """
+        self._writer = threading.Thread(target=self._run, name='text-index-writer')
+        self._writer.daemon = True
+        self._writer.start()
+
+    def _run(self):
+        while not self._closed:
+            self._wake.wait(min(self.flush_interval, self.idle_seconds) or None)
+            self._wake.clear()
+            if self._closed:
+                break
+            try:
+                with self._lock:
+                    if len(self._memory) and time.time() - self._memory.created > self.flush_interval:
+                        self._rotate()
+                self._write_pending()
+                self._compact()
+                with self._lock:
+                    self._close_idle()
+            except Exception as e:
+                log.error('index writer error: %s' % e, exc_info=True)
+
+    def _rotate(self):
+        """ Queue the memory segment to be written, and start a new one. Called with the lock held. """
+        if len(self._memory):
+            self._unwritten.append(self._memory)
+            self._memory = MemorySegment()
+
+    def _new_name(self):
+        return '%d-%s-%d%s' % (time.time() * 1000, self._pid, next(self._seq), EXTENSION)
+
+    def _write_pending(self):
+        """ Write the queued memory segments, and swap each for its segment file. """
+        with self._write_lock:
+            while True:
+                with self._lock:
+                    if not self._unwritten:
+                        return
+                    memory = self._unwritten[0]
+                name = self._new_name()
+                segment = None
+                try:
+                    memory.write(os.path.join(self.path, name))
+                    segment = DiskSegment(os.path.join(self.path, name))
+                except (IOError, OSError, ValueError) as e:
+                    log.error('failed to write index segment %s: %s' % (name, e), exc_info=True)
+                with self._lock:
+                    self._unwritten.remove(memory)
+                    if segment is not None:
+                        self._segments[name] = segment
+
+    def flush(self):
+        """ Write the messages in memory to a segment, on the calling thread. """
+        with self._lock:
+            self._rotate()
+        self._write_pending()
+
+    def _compact(self):
+        """
+        Merge the smallest merge_factor segments written by this process, when it has that many.
+
+        The merge reads segment files of its own, so queries meanwhile use the segments as they were.
+        """
+        if not self.merge_factor:
+            return
+        with self._write_lock:
+            with self._lock:
+                own = sorted((len(segment), name) for name, segment in self._segments.items()
+                             if name.split('-')[1:2] == [self._pid])
+            if len(own) < self.merge_factor:
+                return
+            names = [name for _, name in own[:self.merge_factor]]
+            sources = []
+            try:
+                for name in names:
+                    sources.append(DiskSegment(os.path.join(self.path, name)))
+                for source in sources:
+                    source.open()
+                merged = MemorySegment()
+                for _, _, doc, source in heapq.merge(*[self._in_order(source) for source in sources]):
+                    hit = source.hit(doc)
+                    merged.add(hit.room, hit.time, hit.nick, hit.account, hit.text)
+                name = self._new_name()
+                merged.write(os.path.join(self.path, name))
+                segment = DiskSegment(os.path.join(self.path, name))
+            except (IOError, OSError, ValueError) as e:
+                log.error('failed to merge index segments: %s' % e, exc_info=True)
+                return
+            finally:
+                for source in sources:
+                    source.close()
+
+            with self._lock:
+                self._segments[name] = segment
+                for old in names:
+                    removed = self._segments.pop(old, None)
+                    if removed is not None:
+                        removed.close()
+            for old in names:
+                try:
+                    os.remove(os.path.join(self.path, old))
+                except OSError as e:
+                    log.error('failed to remove merged index segment %s: %s' % (old, e))
+            self.merges += 1
+            log.debug('merged %s index segments into %s, %s messages' % (len(names), name, len(segment)))
+
+    def _close_idle(self):
+        """ Unmap the segments not used for idle_seconds, and the least recently used beyond max_open. """
+        now = time.time()
+        mapped = sorted((segment for segment in self._segments.values() if segment.is_open),
+                        key=lambda segment: segment.used, reverse=True)
+        for i, segment in enumerate(mapped):
+            if i >= self.max_open or now - segment.used > self.idle_seconds:
+                segment.close()
+
+    def refresh(self):
+        """ Find the segments written since the last refresh, also by other processes, and drop removed ones. """
+        names = set(name for name in os.listdir(self.path) if name.endswith(EXTENSION))
+        for name in list(self._segments):
+            if name not in names:
+                self._segments.pop(name).close()
+        for name in names:
+            if name not in self._segments:
+                try:
+                    self._segments[name] = DiskSegment(os.path.join(self.path, name))
+                except (IOError, OSError, ValueError) as e:
+                    log.error('failed to open index segment %s: %s' % (name, e))
+
+    def query(self, query, rooms=None, nick=None, account=None, start=None, end=None, limit=100):
+        """
+        Find messages having all terms and phrases of a query, newest first.
+
+        :param query: Terms, and phrases in double quotes, e.g 'spam "buy now"'. Case insensitive.
+        :type query: str
+        :param rooms: Only messages in these rooms.
+        :type rooms: list | None
+        :param nick: Only messages of this nick.
+        :type nick: str | None
+        :param account: Only messages of this account.
+        :type account: str | None
+        :param start: The earliest time, None for no limit.
+        :type start: float | None
+        :param end: The latest time, None for no limit.
+        :type end: float | None
+        :param limit: The maximum number of messages, None for all.
+        :type limit: int | None
+        :return: A list of Hit.
+        :rtype: list
+        """
+        terms, phrases = parse_query(query)
+        if not terms and not (rooms or nick or account):
+            return []
+        with self._lock:
+            self.refresh()
+            matches = []
+            segments = [self._memory] + self._unwritten + list(self._segments.values())
+            segments.sort(key=lambda segment: segment.last_time, reverse=True)
+            try:
+                for segment in segments:
+                    # the remaining segments are older than the matches found so far.
+                    if limit is not None and len(matches) >= limit and segment.last_time < matches[limit - 1][0]:
+                        break
+                    if isinstance(segment, DiskSegment):
+                        try:
+                            segment.open()
+                        except (IOError, OSError) as e:
+                            log.error('failed to open index segment %s: %s' % (segment.file_name, e))
+                            continue
+                    for t, doc in segment.search(terms, phrases, rooms, nick, account, start, end, limit):
+                        matches.append((t, doc, segment))
+                    matches.sort(key=lambda match: match[0], reverse=True)
+                if limit is not None:
+                    matches = matches[:limit]
+                return [segment.hit(doc) for _, doc, segment in matches]
+            finally:
+                self._close_idle()
+
+    def merge(self):
+        """
+        Merge all segments of the folder into one, e.g after a bulk build.
+
+        Do not run this while other processes write to the folder.
+
+        :return: The number of segments merged.
+        :rtype: int
+        """
+        self.flush()
+        with self._write_lock:
+            with self._lock:
+                self.refresh()
+                segments = list(self._segments.items())
+            if len(segments) < 2:
+                return len(segments)
+            sources = [DiskSegment(segment.file_name) for _, segment in segments]
+            try:
+                for source in sources:
+                    source.open()
+                merged = MemorySegment()
+                for _, _, doc, source in heapq.merge(*[self._in_order(source) for source in sources]):
+                    hit = source.hit(doc)
+                    merged.add(hit.room, hit.time, hit.nick, hit.account, hit.text)
+            finally:
+                for source in sources:
+                    source.close()
+            name = self._new_name()
+            merged.write(os.path.join(self.path, name))
+            with self._lock:
+                self._segments[name] = DiskSegment(os.path.join(self.path, name))
+                for old, segment in segments:
+                    segment.close()
+                    os.remove(os.path.join(self.path, old))
+                    del self._segments[old]
+            return len(segments)
+
+    @staticmethod
+    def _in_order(segment):
+        """ The (time, segment number, doc, segment) of the messages of a segment, in time order. """
+        docs = range(len(segment))
+        if not segment.ordered:
+            docs = sorted(docs, key=segment.times.__getitem__)
+        number = id(segment)
+        for doc in docs:
+            yield segment.times[doc], number, doc, segment
+
+    def close(self):
+        """ Write the messages in memory, stop the writer thread and close the segments. """
+        self._closed = True
+        self._wake.set()
+        self.flush()
+        with self._lock:
+            for segment in self._segments.values():
+                segment.close()
+            self._segments.clear()
+
+    @property
+    def stats(self):
+        """
+        Returns the number of segments, messages and bytes of the index.
+
+        :return: The index stats.
+        :rtype: dict
+        """
+        with self._lock:
+            self.refresh()
+            size = sum(os.path.getsize(segment.file_name) for segment in self._segments.values())
+            return {
+                'segments': len(self._segments),
+                'mapped': sum(1 for segment in self._segments.values() if segment.is_open),
+                'messages': sum(len(segment) for segment in self._segments.values()),
+                'in_memory': len(self._memory) + sum(len(segment) for segment in self._unwritten),
+                'merges': self.merges,
+                'bytes': size
+            }
+
+
+def _log_messages(room, file_name):
+    """
+    The chat messages of a chat log, a [HH:MM:SS] nick: message line per message.
+
+    Console lines of the same form, the Joins and Moderator lines and the room info lines, are skipped.
+    """
+    day = os.path.basename(file_name)[:-len('.log')]
+    midnight = time.mktime(time.strptime(day, '%Y-%m-%d'))
+    info_stamp = None
+    with open(file_name, 'rb') as f:
+        for line in f:
+            line = line.decode('utf-8', 'replace').rstrip(u'\r\n')
+            stamp, _, message = line.partition(u'] ')
+            if message in _LOG_INFO_HEADERS:
+                info_stamp = stamp
+                continue
+            if stamp == info_stamp:
+                continue
+            info_stamp = None
+            match = _LOG_LINE.match(line)
+            if match is None:
+                continue
+            hours, minutes, seconds, am_pm, nick, text = match.groups()
+            if nick in _LOG_CONSOLE_NICKS and _LOG_CONSOLE_TEXT.match(text):
+                continue
+            hours = int(hours)
+            if am_pm is not None:
+                hours = hours % 12 + (12 if am_pm == 'PM' else 0)
+            yield room, midnight + hours * 3600 + int(minutes) * 60 + int(seconds), nick, u'', text
+
+
+def _history_messages(room, file_name):
+    segment = history.Segment(file_name)
+    try:
+        for record in segment.read():
+            if record.event == history.MSG:
+                yield room, record.time, record.nick, record.account, record.text
+    finally:
+        segment.close()
+
+
+def _build_one(task):
+    """ Index a history segment or chat log into a segment of its own. Runs in a worker process. """
+    room, file_name, index_path, name = task
+    messages = _history_messages if file_name.endswith(history.EXTENSION) else _log_messages
+    segment = MemorySegment()
+    for message in messages(room, file_name):
+        segment.add(*message)
+    if len(segment):
+        segment.write(os.path.join(index_path, name))
+    return len(segment)
+
+
+def find_sources(rooms_path):
+    """
+    Find the chat histories and chat logs of the rooms in a folder.
+
+    A day with a history is not indexed from its chat log as well.
+
+    :param rooms_path: The folder of the rooms, e.g rooms/
+    :type rooms_path: str
+    :return: A list of (room, file name) tuples.
+    :rtype: list
+    """
+    sources = []
+    for room in sorted(os.listdir(rooms_path)):
+        history_path = os.path.join(rooms_path, room, 'history')
+        logs_path = os.path.join(rooms_path, room, 'logs')
+        days = set()
+        if os.path.isdir(history_path):
+            for name in sorted(os.listdir(history_path)):
+                if name.endswith(history.EXTENSION):
+                    days.add(name[:-len(history.EXTENSION)])
+                    sources.append((room, os.path.join(history_path, name)))
+        if os.path.isdir(logs_path):
+            for name in sorted(os.listdir(logs_path)):
+                if name.endswith('.log') and name[:-len('.log')] not in days:
+                    sources.append((room, os.path.join(logs_path, name)))
+    return sources
+
+
+def build(rooms_path, index_path, workers=None, merge=True):
+    """
+    Index the chat histories and chat logs of all rooms, a source file per task on a pool of processes.
+
+    :param rooms_path: The folder of the rooms, e.g rooms/
+    :type rooms_path: str
+    :param index_path: The index folder.
+    :type index_path: str
+    :param workers: The number of processes, None for the number of cpus.
+    :type workers: int | None
+    :param merge: Merge the segments into one afterwards.
+    :type merge: bool
+    :return: The number of source files and messages indexed.
+    :rtype: tuple
+    """
+    if not os.path.exists(index_path):
+        os.makedirs(index_path)
+    sources = find_sources(rooms_path)
+    stamp = int(time.time() * 1000)
+    tasks = [(room, file_name, index_path, 'build-%d-%06d%s' % (stamp, i, EXTENSION))
+             for i, (room, file_name) in enumerate(sources)]
+    pool = multiprocessing.Pool(workers)
+    try:
+        messages = sum(pool.map(_build_one, tasks, chunksize=1))
+    finally:
+        pool.close()
+        pool.join()
+    if merge:
+        index = InvertedIndex(index_path)
+        index.merge()
+        index.close()
+    return len(sources), messages
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Build or search the chat message index.')
+    commands = parser.add_subparsers(dest='command')
+    build_parser = commands.add_parser('build', help='index the histories and chat logs of all rooms')
+    build_parser.add_argument('rooms', help='the folder of the rooms, e.g rooms/')
+    build_parser.add_argument('--index', help='the index folder, defaults to the index folder in rooms')
+    build_parser.add_argument('--workers', type=int, help='the number of processes, defaults to the cpu count')
+    build_parser.add_argument('--no-merge', action='store_true', help='keep a segment per source file')
+    search_parser = commands.add_parser('search', help='search the index')
+    search_parser.add_argument('index', help='the index folder, e.g rooms/index/')
+    search_parser.add_argument('query', help='terms, and phrases in double quotes')
+    search_parser.add_argument('--room', action='append', help='can be given more than once')
+    search_parser.add_argument('--nick')
+    search_parser.add_argument('--account')
+    search_parser.add_argument('--days', type=float, help='only the last number of days')
+    search_parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        started = time.time()
+        index_path = args.index or os.path.join(args.rooms, 'index')
+        files, messages = build(args.rooms, index_path, workers=args.workers, merge=not args.no_merge)
+        print ('indexed %s messages of %s files in %.1f seconds' % (messages, files, time.time() - started))
+        return
+
+    index = InvertedIndex(args.index)
+    start = time.time() - args.days * 86400 if args.days else None
+    for hit in index.query(args.query, rooms=args.room, nick=args.nick, account=args.account,
+                           start=start, limit=args.limit):
+        line = u'[%s] %s %s %s: %s' % (time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(hit.time)),
+                                       hit.room, hit.nick, hit.account, hit.text)
+        if sys.version_info[0] == 2:
+            line = line.encode('utf-8')
+        print (line)
+    index.close()
+
+
+if __name__ == '__main__':
+    main()
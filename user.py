@@ -14,23 +14,29 @@ class BannedUser:
         self.reason = kwargs.get('reason', '')
 
 
-class User:
-    """ Class representing a user. """
+class User(object):
+    """
+    Class representing a user.
+
+    The role attributes, is_mod, is_lurker, is_broadcasting and account, update the role views
+    of the Users the user was added to when set, and nick and account update its indexes.
+    """
 
     def __init__(self, **kwargs):
+        self._registry = None
         self.id = kwargs.get('handle')
-        self.nick = kwargs.get('nick', '')
-        self.account = kwargs.get('username', '')
+        self._nick = kwargs.get('nick', '')
+        self._account = kwargs.get('username', '')
         self.giftpoints = kwargs.get('giftpoints', 0)
         self.featured = kwargs.get('featured', False)
         self.subscription = kwargs.get('subscription', 0)
         self.session_id = kwargs.get('session_id', '')
         self.achievement_url = kwargs.get('achievement_url', '')
         self.avatar = kwargs.get('avatar', '')
-        self.is_lurker = kwargs.get('lurker', False)
-        self.is_mod = kwargs.get('mod', False)
+        self._is_lurker = kwargs.get('lurker', False)
+        self._is_mod = kwargs.get('mod', False)
         self.is_owner = kwargs.get('owner', False)
-        self.is_broadcasting = False
+        self._is_broadcasting = False
         self.is_waiting = False
         #
         self.user_level = 5
@@ -43,18 +49,143 @@ class User:
         self.last_msg = None
         self.msg_time = 0.0
 
+    def _set_role(self, attr, value):
+        """ Set a role attribute, and update the role views if the role changed. """
+        old = getattr(self, attr)
+        setattr(self, attr, value)
+        if self._registry is not None and bool(old) != bool(value):
+            self._registry._update_roles(self)
+
+    @property
+    def nick(self):
+        return self._nick
+
+    @nick.setter
+    def nick(self, value):
+        old = self._nick
+        self._nick = value
+        if self._registry is not None and old != value:
+            self._registry._update_nick(self, old)
+
+    @property
+    def account(self):
+        return self._account
+
+    @account.setter
+    def account(self, value):
+        old = self._account
+        self._set_role('_account', value)
+        if self._registry is not None and old != value:
+            self._registry._update_account(self, old)
+
+    @property
+    def is_mod(self):
+        return self._is_mod
+
+    @is_mod.setter
+    def is_mod(self, value):
+        self._set_role('_is_mod', value)
+
+    @property
+    def is_lurker(self):
+        return self._is_lurker
+
+    @is_lurker.setter
+    def is_lurker(self, value):
+        self._set_role('_is_lurker', value)
+
+    @property
+    def is_broadcasting(self):
+        return self._is_broadcasting
+
+    @is_broadcasting.setter
+    def is_broadcasting(self, value):
+        self._set_role('_is_broadcasting', value)
 
-class Users:
+
+# The role views of Users, and the test of each role.
+_ROLES = (
+    ('mods', lambda user: user.is_mod),
+    ('signed_in', lambda user: bool(user.account)),
+    ('lurkers', lambda user: user.is_lurker),
+    ('norms', lambda user: not user.is_mod and not user.is_lurker),
+    ('broadcaster', lambda user: user.is_broadcasting)
+)
+
+_itervalues = getattr(dict, 'itervalues', dict.values)
+
+
+def _fold(name):
+    """ A nick or account name in lower case, for the case insensitive indexes. """
+    return name.lower() if name else name
+
+
+class UserView(object):
+    """
+    A live, read only view of the users of a role.
+
+    Length and membership take constant time, and iterating does not copy the users.
+    Indexing, e.g view[0] or random.choice(view), copies the users like the lists it replaced.
+    The view changes with the room, use list(view) for a copy that does not,
+    e.g to kick users while iterating.
+    """
+
+    __slots__ = ('_users',)
+
+    def __init__(self, users):
+        self._users = users
+
+    def __len__(self):
+        return len(self._users)
+
+    def __bool__(self):
+        return bool(self._users)
+
+    __nonzero__ = __bool__
+
+    def __iter__(self):
+        return iter(_itervalues(self._users))
+
+    def __getitem__(self, index):
+        return list(_itervalues(self._users))[index]
+
+    def __contains__(self, user):
+        return self._users.get(getattr(user, 'id', None)) is user
+
+    def __repr__(self):
+        return 'UserView(%s users)' % len(self._users)
+
+    def get(self, handle_id):
+        """
+        The user of a handle, if it has the role.
+
+        :param handle_id: The ID (handle) of the user.
+        :type handle_id: int
+        :return: The User or None.
+        :rtype: User | None
+        """
+        return self._users.get(handle_id)
+
+
+class Users(object):
     """ Class for doing various user related operations. """
 
     def __init__(self):
         """
         Initialize the Users class.
 
-        Creating a dictionary for users and one for banned users.
+        Creating a dictionary for users and one for banned users,
+        a dictionary of the users of each role, and indexes of the users by nick and account,
+        kept up to date as users change.
         """
         self._users = dict()
         self._banned_users = dict()
+        # nick, lower case nick and lower case account, to the users by ID.
+        self._nicks = dict()
+        self._folded_nicks = dict()
+        self._accounts = dict()
+        self._roles = dict((name, {}) for name, _ in _ROLES)
+        self._views = dict((name, UserView(self._roles[name])) for name, _ in _ROLES)
 
     @property
     def all(self):
@@ -69,76 +200,111 @@ class Users:
     @property
     def mods(self):
         """
-        Returns a list of all the moderators.
+        Returns a view of all the moderators.
 
-        :return: A list of moderator User.
-        :rtype: list
+        :return: A live view of the moderator User.
+        :rtype: UserView
         """
-        _mods = []
-        for user in self.all:
-            if self.all[user].is_mod:
-                _mods.append(self.all[user])
-        return _mods
+        return self._views['mods']
 
     @property
     def signed_in(self):
         """
-        Returns a list of all signed in users.
+        Returns a view of all the signed in users.
 
-        :return: A list of all the signed in User
-        :rtype: list
+        :return: A live view of the signed in User.
+        :rtype: UserView
         """
-        _signed_ins = []
-        for user in self.all:
-            if self.all[user].account:
-                _signed_ins.append(self.all[user])
-        return _signed_ins
+        return self._views['signed_in']
 
     @property
     def lurkers(self):
         """
-        Returns a list of the lurkers.
+        Returns a view of all the lurkers.
 
-        :return: A list of lurkers User.
-        :rtype: list
+        :return: A live view of the lurker User.
+        :rtype: UserView
         """
-        _lurkers = []
-        for user in self.all:
-            if self.all[user].is_lurker:
-                _lurkers.append(self.all[user])
-        return _lurkers
+        return self._views['lurkers']
 
     @property
     def norms(self):
         """
-        Returns a list of all normal users, e.g users that are not moderators or lurkers.
+        Returns a view of all the normal users, e.g users that are not moderators or lurkers.
 
-        :return: A list of all normal User.
-        :rtype: list
+        :return: A live view of the normal User.
+        :rtype: UserView
         """
-        _regulars = []
-        for user in self.all:
-            if not self.all[user].is_mod and not self.all[user].is_lurker:
-                _regulars.append(self.all[user])
-        return _regulars
+        return self._views['norms']
 
     @property
     def broadcaster(self):
         """
-        Returns a list of all broadcasting users.
+        Returns a view of all the broadcasting users.
 
-        :return: A list of all the broadcasting User.
-        :rtype: list
+        :return: A live view of the broadcasting User.
+        :rtype: UserView
         """
-        _broadcasters = []
-        for user in self.all:
-            if self.all[user].is_broadcasting:
-                _broadcasters.append(self.all[user])
-        return _broadcasters
+        return self._views['broadcaster']
 
     def clear(self):
         """ Clear the user dictionary. """
+        for user in _itervalues(self._users):
+            user._registry = None
         self._users.clear()
+        for users in _itervalues(self._roles):
+            users.clear()
+        self._nicks.clear()
+        self._folded_nicks.clear()
+        self._accounts.clear()
+
+    def _update_roles(self, user):
+        """ Add a user to the views of its roles, and remove it from the others. """
+        for name, test in _ROLES:
+            if test(user):
+                self._roles[name][user.id] = user
+            else:
+                self._roles[name].pop(user.id, None)
+
+    @staticmethod
+    def _index(index, key, user):
+        """ Add a user to an index under a key, empty keys are not indexed. """
+        if key:
+            users = index.get(key)
+            if users is None:
+                users = index[key] = {}
+            users[user.id] = user
+
+    @staticmethod
+    def _unindex(index, key, user):
+        """ Remove a user from an index. """
+        users = index.get(key)
+        if users is not None:
+            users.pop(user.id, None)
+            if not users:
+                del index[key]
+
+    @staticmethod
+    def _first(index, key):
+        """ A user of a key of an index, or None. """
+        users = index.get(key)
+        if users:
+            return next(iter(_itervalues(users)))
+        return None
+
+    def _update_nick(self, user, old):
+        """ Move a user from its old nick to its nick in the nick indexes. """
+        self._unindex(self._nicks, old, user)
+        self._unindex(self._folded_nicks, _fold(old), user)
+        self._index(self._nicks, user.nick, user)
+        self._index(self._folded_nicks, _fold(user.nick), user)
+
+    def _update_account(self, user, old):
+        """ Move a user from its old account to its account in the account index. """
+        if old:
+            self._unindex(self._accounts, _fold(old), user)
+        if user.account:
+            self._index(self._accounts, _fold(user.account), user)
 
     def add(self, user_info):
         """
@@ -150,7 +316,14 @@ class Users:
         :rtype: User
         """
         if user_info['handle'] not in self.all:
-            self._users[user_info['handle']] = User(**user_info)
+            user = User(**user_info)
+            self._users[user_info['handle']] = user
+            user._registry = self
+            self._update_roles(user)
+            self._index(self._nicks, user.nick, user)
+            self._index(self._folded_nicks, _fold(user.nick), user)
+            if user.account:
+                self._index(self._accounts, _fold(user.account), user)
         return self.all[user_info['handle']]
 
     def delete(self, handle_id):
@@ -165,6 +338,13 @@ class Users:
         if handle_id in self.all:
             user = self._users[handle_id]
             del self._users[handle_id]
+            user._registry = None
+            for users in _itervalues(self._roles):
+                users.pop(handle_id, None)
+            self._unindex(self._nicks, user.nick, user)
+            self._unindex(self._folded_nicks, _fold(user.nick), user)
+            if user.account:
+                self._unindex(self._accounts, _fold(user.account), user)
             return user
         return None
 
@@ -184,19 +364,35 @@ class Users:
             return self.all[handle_id]
         return None
 
-    def search_by_nick(self, nick):
+    def search_by_nick(self, nick, ignore_case=False):
         """
         Search the user dictionary by nick name.
 
         :param nick: The nick name of the user to search for.
         :type nick: str
+        :param ignore_case: Match the nick name in any case.
+        :type ignore_case: bool
         :return: The User or None if not found.
         :rtype: User | None
         """
-        for user in self.all:
-            if self.all[user].nick == nick:
-                return self.all[user]
-        return None
+        if ignore_case:
+            return self._first(self._folded_nicks, _fold(nick))
+        return self._first(self._nicks, nick)
+
+    def search_by_account(self, account):
+        """
+        Search the user dictionary by account name, in any case.
+
+        If the account is signed in more than once, one of the users is returned.
+
+        :param account: The account name of the user to search for.
+        :type account: str
+        :return: The User or None if not found.
+        :rtype: User | None
+        """
+        if not account:
+            return None
+        return self._first(self._accounts, _fold(account))
 
     def search_containing(self, contains):
         """
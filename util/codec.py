@@ -0,0 +1,126 @@
+"""
+JSON encoding and decoding of websocket frames.
+
+The fastest available json library is picked at import time, falling back to the standard library.
+All codecs decode str and bytes (utf-8) directly, and encode to str.
+"""
+import json
+import logging
+
+log = logging.getLogger(__name__)
+
+# Codec names, fastest first.
+PREFERENCE = ('orjson', 'ujson', 'simplejson', 'json')
+
+
+class Codec(object):
+    """ A named pair of loads and dumps functions. """
+
+    def __init__(self, name, loads, dumps):
+        self.name = name
+        self.loads = loads
+        self.dumps = dumps
+
+    def __repr__(self):
+        return '<Codec %s>' % self.name
+
+
+def _orjson():
+    import orjson
+
+    def dumps(obj):
+        return orjson.dumps(obj).decode('utf-8')
+
+    return Codec('orjson', orjson.loads, dumps)
+
+
+def _ujson():
+    import ujson
+    return Codec('ujson', ujson.loads, ujson.dumps)
+
+
+def _simplejson():
+    import simplejson
+    return Codec('simplejson', simplejson.loads, simplejson.dumps)
+
+
+def _json():
+    loads = json.loads
+    try:
+        loads(b'{}')
+    except TypeError:  # python 3 before 3.6 only decodes str.
+        def loads(data):
+            if isinstance(data, bytes):
+                data = data.decode('utf-8')
+            return json.loads(data)
+    return Codec('json', loads, json.dumps)
+
+
+_FACTORIES = {
+    'orjson': _orjson,
+    'ujson': _ujson,
+    'simplejson': _simplejson,
+    'json': _json
+}
+
+
+def get_codec(name):
+    """
+    Get a codec by name.
+
+    :param name: The codec name, one of PREFERENCE.
+    :type name: str
+    :return: The codec, or None if the library is not installed.
+    :rtype: Codec | None
+    """
+    try:
+        return _FACTORIES[name]()
+    except ImportError:
+        return None
+
+
+def available():
+    """
+    Returns the codecs that can be used, fastest first.
+
+    :return: A list of Codec.
+    :rtype: list
+    """
+    codecs = []
+    for name in PREFERENCE:
+        codec = get_codec(name)
+        if codec is not None:
+            codecs.append(codec)
+    return codecs
+
+
+def use(name):
+    """
+    Switch the module level loads and dumps to another codec.
+
+    :param name: The codec name.
+    :type name: str
+    :return: True if switched, False if the codec is not installed.
+    :rtype: bool
+    """
+    global CODEC, loads, dumps
+    codec = get_codec(name)
+    if codec is None:
+        return False
+    CODEC = codec
+    loads = codec.loads
+    dumps = codec.dumps
+    log.info('using json codec: %s' % codec.name)
+    return True
+
+
+def _fastest():
+    for name in PREFERENCE:
+        codec = get_codec(name)
+        if codec is not None:
+            return codec
+
+
+CODEC = _fastest()
+loads = CODEC.loads
+dumps = CODEC.dumps
@@ -0,0 +1,586 @@
+""" Counters, gauges and latency histograms, exposed in the prometheus text format. """
+import bisect
+import logging
+import threading
+from collections import deque
+
+try:
+    from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+    from SocketServer import ThreadingMixIn
+except ImportError:
+    from http.server import HTTPServer, BaseHTTPRequestHandler
+    from socketserver import ThreadingMixIn
+
+log = logging.getLogger(__name__)
+
+# Upper bounds of the latency buckets, in seconds.
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+                   0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# The label value used for values beyond the limit of a label.
+OVERFLOW = '_other'
+
+# Label sets counted as OVERFLOW cached per metric, further ones are looked up on each labels() call.
+MAX_OVERFLOW_CACHED = 10000
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+_shared = None
+_shared_server = None
+_shared_lock = threading.Lock()
+
+
+def get_registry():
+    """
+    Get the process wide Registry, shared by all clients.
+
+    :return: The shared Registry.
+    :rtype: Registry
+    """
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = Registry()
+        return _shared
+
+
+def start_server(port, host='127.0.0.1'):
+    """
+    Serve the shared registry on http://host:port/metrics, if it is not served already.
+
+    :param port: The port to listen on.
+    :type port: int
+    :param host: The address to listen on.
+    :type host: str
+    :return: The server, or None if it could not listen on the port.
+    :rtype: MetricsServer | None
+    """
+    global _shared_server
+    registry = get_registry()
+    with _shared_lock:
+        if _shared_server is None:
+            server = MetricsServer(registry, port, host)
+            try:
+                server.start()
+            except Exception as e:
+                log.error('failed to serve metrics on %s:%s: %s' % (host, port, e))
+                return None
+            _shared_server = server
+        return _shared_server
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if value == float('inf'):
+            return '+Inf'
+        return repr(value)
+    return str(value)
+
+
+def _format_labels(names, values, extra=None):
+    pairs = ['%s="%s"' % (name, _escape(value)) for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append('%s="%s"' % extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(pairs) + '}'
+
+
+class _CounterValue(object):
+    """ A counter of one label set. """
+
+    __slots__ = ('_lock', 'value')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.value = 0
+
+    def inc(self, amount=1):
+        """
+        Increment the counter.
+
+        :param amount: The amount to add, must not be negative.
+        :type amount: int | float
+        """
+        with self._lock:
+            self.value += amount
+
+
+class _GaugeValue(object):
+    """ A gauge of one label set. The value is either set, or read from a function when collected. """
+
+    __slots__ = ('_lock', '_value', '_fn')
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._value = 0
+        self._fn = None
+
+    def set(self, value):
+        """
+        Set the gauge.
+
+        :param value: The new value.
+        :type value: int | float
+        """
+        self._value = value
+
+    def inc(self, amount=1):
+        """
+        Increment the gauge.
+
+        :param amount: The amount to add.
+        :type amount: int | float
+        """
+        with self._lock:
+            self._value += amount
+
+    def dec(self, amount=1):
+        """
+        Decrement the gauge.
+
+        :param amount: The amount to subtract.
+        :type amount: int | float
+        """
+        with self._lock:
+            self._value -= amount
+
+    def set_function(self, fn):
+        """
+        Read the value from a function when the metrics are collected, instead of setting it.
+
+        If the function returns None, the label set is removed, e.g when the object it reads from is gone.
+
+        :param fn: The callable returning the value.
+        :type fn: callable
+        """
+        self._fn = fn
+
+    @property
+    def value(self):
+        """
+        Returns the value, calling the function if there is one.
+
+        :return: The value, or None if the function returned None.
+        :rtype: int | float | None
+        """
+        if self._fn is not None:
+            return self._fn()
+        return self._value
+
+
+class _HistogramValue(object):
+    """
+    A histogram of one label set, counting observations into fixed buckets.
+
+    Observations are appended to a queue, which is cheap and thread safe without a lock,
+    and counted into the buckets in batches, or when the histogram is read.
+    """
+
+    __slots__ = ('_lock', '_upper_bounds', '_pending', '_counts', '_sum', '_count')
+
+    # Observations queued before they are counted into the buckets.
+    BATCH = 256
+
+    def __init__(self, upper_bounds):
+        self._lock = threading.Lock()
+        self._upper_bounds = upper_bounds
+        self._pending = deque()
+        # the last bucket is +Inf.
+        self._counts = [0] * (len(upper_bounds) + 1)
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value):
+        """
+        Record an observation.
+
+        :param value: The observed value, e.g a duration in seconds.
+        :type value: int | float
+        """
+        self._pending.append(value)
+        if len(self._pending) >= self.BATCH:
+            self._fold()
+
+    def _fold(self):
+        """ Count the queued observations into the buckets. """
+        pending = self._pending
+        upper_bounds = self._upper_bounds
+        with self._lock:
+            counts = self._counts
+            total = 0.0
+            n = len(pending)
+            for _ in range(n):
+                value = pending.popleft()
+                counts[bisect.bisect_left(upper_bounds, value)] += 1
+                total += value
+            self._sum += total
+            self._count += n
+
+    def snapshot(self):
+        """
+        Returns the bucket counts (not cumulative, the last is +Inf), the sum and the count of the observations.
+
+        :return: A tuple of (counts, sum, count).
+        :rtype: tuple
+        """
+        self._fold()
+        with self._lock:
+            return list(self._counts), self._sum, self._count
+
+
+class _Metric(object):
+    """ A metric family, holding a value per label set. """
+
+    kind = None
+
+    def __init__(self, registry, name, description, labels=()):
+        self._registry = registry
+        self.name = name
+        self.description = description
+        self.label_names = tuple(labels)
+        # the values by label values, and the label values as passed to labels().
+        self._series = {}
+        self._values = {}
+        self._overflow_cached = 0
+        self._lock = threading.Lock()
+
+    def _new_value(self):
+        raise NotImplementedError
+
+    def labels(self, *values):
+        """
+        Get the value of a label set, creating it on first use.
+
+        Label values beyond the limit of a label (see Registry.limit_label) are replaced by OVERFLOW.
+        Keep the returned value to skip the lookup on hot paths.
+
+        :param values: The label values, in the order of the label names.
+        :type values: str
+        :return: The counter, gauge or histogram value of the label set.
+        """
+        try:
+            return self._values[values]
+        except KeyError:
+            pass
+        if len(values) != len(self.label_names):
+            raise ValueError('%s takes the labels %s, got %s' % (self.name, self.label_names, values))
+        key = values
+        values = tuple(self._registry.admit(name, str(value)) for name, value in zip(self.label_names, values))
+        with self._lock:
+            value = self._series.get(values)
+            if value is None:
+                value = self._new_value()
+                self._series[values] = value
+            if OVERFLOW not in values:
+                self._values[key] = value
+            elif self._overflow_cached < MAX_OVERFLOW_CACHED:
+                # overflowed label values are unbounded, so only that many are cached.
+                self._overflow_cached += 1
+                self._values[key] = value
+        return value
+
+    def remove(self, *values):
+        """
+        Remove a label set.
+
+        :param values: The label values.
+        :type values: str
+        """
+        values = tuple(str(value) for value in values)
+        with self._lock:
+            value = self._series.pop(values, None)
+            if value is not None:
+                keys = [k for k, v in self._values.items() if v is value]
+                for key in keys:
+                    del self._values[key]
+                if OVERFLOW in values:
+                    self._overflow_cached -= len(keys)
+
+    def _items(self):
+        """ The label sets and their values. """
+        with self._lock:
+            return sorted(self._series.items())
+
+    def _lines(self):
+        raise NotImplementedError
+
+    def expose(self):
+        """
+        Format the metric in the prometheus text format.
+
+        :return: The lines of the metric.
+        :rtype: list
+        """
+        lines = ['# HELP %s %s' % (self.name, self.description.replace('\\', '\\\\').replace('\n', '\\n')),
+                 '# TYPE %s %s' % (self.name, self.kind)]
+        lines.extend(self._lines())
+        return lines
+
+
+class Counter(_Metric):
+    """ A value that only goes up, e.g the number of events received. """
+
+    kind = 'counter'
+
+    def _new_value(self):
+        return _CounterValue()
+
+    def inc(self, amount=1):
+        """ Increment the counter of a metric without labels. """
+        self.labels().inc(amount)
+
+    def _lines(self):
+        for values, value in self._items():
+            yield '%s%s %s' % (self.name, _format_labels(self.label_names, values), _format_value(value.value))
+
+
+class Gauge(_Metric):
+    """ A value that goes up and down, e.g the send queue depth. """
+
+    kind = 'gauge'
+
+    def _new_value(self):
+        return _GaugeValue()
+
+    def set(self, value):
+        """ Set the gauge of a metric without labels. """
+        self.labels().set(value)
+
+    def _lines(self):
+        for values, value in self._items():
+            try:
+                current = value.value
+            except Exception as e:
+                log.debug('failed to read gauge %s%s: %s' % (self.name, values, e))
+                continue
+            if current is None:
+                self.remove(*values)
+                continue
+            yield '%s%s %s' % (self.name, _format_labels(self.label_names, values), _format_value(current))
+
+
+class Histogram(_Metric):
+    """ Counts observations, e.g latencies, into buckets with fixed upper bounds. """
+
+    kind = 'histogram'
+
+    def __init__(self, registry, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(registry, name, description, labels)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def _new_value(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        """ Record an observation of a metric without labels. """
+        self.labels().observe(value)
+
+    def _lines(self):
+        bounds = self.buckets + (float('inf'),)
+        for values, value in self._items():
+            counts, total, count = value.snapshot()
+            cumulative = 0
+            for bound, bucket_count in zip(bounds, counts):
+                cumulative += bucket_count
+                yield '%s_bucket%s %s' % (self.name, _format_labels(self.label_names, values,
+                                                                    ('le', _format_value(bound))), cumulative)
+            labels = _format_labels(self.label_names, values)
+            yield '%s_sum%s %s' % (self.name, labels, _format_value(total))
+            yield '%s_count%s %s' % (self.name, labels, count)
+
+
+class Registry(object):
+    """ Holds the metrics of the process, and bounds the number of values of a label. """
+
+    def __init__(self):
+        self._metrics = {}
+        self._limits = {}
+        self._admitted = {}
+        self._overflowed = set()
+        self._lock = threading.Lock()
+
+    def limit_label(self, label, max_values):
+        """
+        Bound the number of distinct values of a label, across all metrics.
+
+        Once max_values values have been seen, further values are replaced by OVERFLOW,
+        e.g the room label of a process running many rooms.
+
+        :param label: The label name.
+        :type label: str
+        :param max_values: The maximum number of distinct values, 0 for no limit.
+        :type max_values: int
+        """
+        with self._lock:
+            self._limits[label] = max_values
+            self._admitted.setdefault(label, set())
+
+    def admit(self, label, value):
+        """
+        Get the value to use for a label value, OVERFLOW if the label is over its limit.
+
+        :param label: The label name.
+        :type label: str
+        :param value: The label value.
+        :type value: str
+        :return: The value, or OVERFLOW.
+        :rtype: str
+        """
+        limit = self._limits.get(label)
+        if not limit:
+            return value
+        with self._lock:
+            admitted = self._admitted[label]
+            if value in admitted:
+                return value
+            if len(admitted) < limit:
+                admitted.add(value)
+                return value
+            first = label not in self._overflowed
+            self._overflowed.add(label)
+        if first:
+            log.debug('label %s is over its limit of %s values, %s and further values counted as %s',
+                      label, limit, value, OVERFLOW)
+        return OVERFLOW
+
+    def _get_or_create(self, cls, name, description, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = cls(self, name, description, labels, **kwargs)
+                self._metrics[name] = metric
+            elif type(metric) is not cls or metric.label_names != tuple(labels):
+                raise ValueError('metric %s is already registered as a %s with the labels %s' %
+                                 (name, metric.kind, metric.label_names))
+            return metric
+
+    def counter(self, name, description, labels=()):
+        """
+        Get or create a counter.
+
+        :param name: The metric name, e.g pinylib_reconnects_total
+        :type name: str
+        :param description: The help text.
+        :type description: str
+        :param labels: The label names.
+        :type labels: tuple
+        :rtype: Counter
+        """
+        return self._get_or_create(Counter, name, description, labels)
+
+    def gauge(self, name, description, labels=()):
+        """
+        Get or create a gauge.
+
+        :param name: The metric name.
+        :type name: str
+        :param description: The help text.
+        :type description: str
+        :param labels: The label names.
+        :type labels: tuple
+        :rtype: Gauge
+        """
+        return self._get_or_create(Gauge, name, description, labels)
+
+    def histogram(self, name, description, labels=(), buckets=DEFAULT_BUCKETS):
+        """
+        Get or create a histogram.
+
+        :param name: The metric name, e.g pinylib_event_seconds
+        :type name: str
+        :param description: The help text.
+        :type description: str
+        :param labels: The label names.
+        :type labels: tuple
+        :param buckets: The bucket upper bounds.
+        :type buckets: tuple
+        :rtype: Histogram
+        """
+        return self._get_or_create(Histogram, name, description, labels, buckets=buckets)
+
+    def get(self, name):
+        """
+        Get a registered metric by name.
+
+        :param name: The metric name.
+        :type name: str
+        :return: The metric, or None if not registered.
+        """
+        return self._metrics.get(name)
+
+    def expose(self):
+        """
+        Format all metrics in the prometheus text format.
+
+        :return: The text to serve on /metrics.
+        :rtype: str
+        """
+        with self._lock:
+            metrics = sorted(self._metrics.values(), key=lambda m: m.name)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.expose())
+        return '\n'.join(lines) + '\n'
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split('?')[0] not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = self.server.registry.expose().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        log.debug('metrics request: %s' % (fmt % args))
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class MetricsServer(object):
+    """ Serves a registry over http, for prometheus to scrape. """
+
+    def __init__(self, registry, port, host='127.0.0.1'):
+        """
+        :param registry: The registry to serve.
+        :type registry: Registry
+        :param port: The port to listen on, 0 for any free port.
+        :type port: int
+        :param host: The address to listen on.
+        :type host: str
+        """
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self._server = None
+        self._thread = None
+
+    def start(self):
+        """ Start listening, in a daemon thread. """
+        self._server = _Server((self.host, self.port), _Handler)
+        self._server.registry = self.registry
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever, name='metrics')
+        self._thread.daemon = True
+        self._thread.start()
+        log.info('serving metrics on http://%s:%s/metrics' % (self.host, self.port))
+
+    def stop(self):
+        """ Stop listening. """
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
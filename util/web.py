@@ -2,7 +2,9 @@
 import time
 import logging
 import requests
+from requests.compat import urlparse
 from requests.utils import quote, unquote
+from util import metrics
 
 __all__ = ['quote', 'unquote']
 
@@ -12,6 +14,18 @@ log = logging.getLogger(__name__)
 #  A session that all requests will use...apparently not.
 __request_session = requests.session()
 
+_metrics = metrics.get_registry()
+_metrics.limit_label('host', 50)
+HTTP_SECONDS = _metrics.histogram('pinylib_http_request_seconds',
+                                  'Time of the requests made by http_get and http_post. '
+                                  'status is error if no response was received.', ('method', 'host', 'status'))
+
+
+def _observe(method, url, started, response):
+    """ Record the duration of a request. """
+    status = response.status_code if response is not None else 'error'
+    HTTP_SECONDS.labels(method, urlparse(url).netloc, status).observe(time.time() - started)
+
 
 def is_cookie_expired(cookie_name):
     """
@@ -90,6 +104,7 @@ def http_get(url, **kwargs):
     gr = None
     json_response = None
 
+    started = time.time()
     try:
         gr = __request_session.request(method='GET', url=url, headers=default_header, proxies=proxy, timeout=timeout)
         if json:
@@ -99,6 +114,7 @@ def http_get(url, **kwargs):
     except (requests.ConnectionError, requests.RequestException) as re:
         log.error('http_get error: %s' % re)
     finally:
+        _observe('GET', url, started, gr)
         log.debug('cookies: %s' % __request_session.cookies)
         if gr is None:
             return dict(content=None, json=None,
@@ -143,6 +159,7 @@ def http_post(post_url, post_data, **kwargs):
         pr = None
         json_response = None
 
+        started = time.time()
         try:
             pr = __request_session.request(method='POST', url=post_url, data=post_data, headers=default_header,
                                           allow_redirects=redirect, proxies=proxy, timeout=timeout, stream=stream)
@@ -153,6 +170,7 @@ def http_post(post_url, post_data, **kwargs):
         except (requests.HTTPError, requests.RequestException) as pe:
             log.error('http_post error %s' % pe)
         finally:
+            _observe('POST', post_url, started, pr)
             log.debug('cookies: %s' % __request_session.cookies)
             if pr is None:
                 return dict(content=None, json=None,
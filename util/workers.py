@@ -0,0 +1,176 @@
+""" A small thread pool and future, for running blocking calls off the calling thread. """
+import logging
+import threading
+
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+log = logging.getLogger(__name__)
+
+
+class TimeoutError(Exception):
+    """ Raised when waiting for a future times out. """
+    pass
+
+
+class Future(object):
+    """ The result of a call that has not completed yet. """
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._result = None
+        self._exception = None
+        self._callbacks = []
+
+    def done(self):
+        """
+        Check if the future has completed.
+
+        :return: True if completed, else False.
+        :rtype: bool
+        """
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """
+        Wait for the result.
+
+        :param timeout: The maximum seconds to wait, None waits forever.
+        :type timeout: int | float | None
+        :return: The result of the call.
+        :raises Exception: The exception raised by the call, or TimeoutError
+        if the call did not complete in time.
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError('future did not complete within %s seconds' % timeout)
+        if self._exception is not None:
+            raise self._exception
+        return self._result
+
+    def exception(self, timeout=None):
+        """
+        Wait for the call to complete, and return the exception it raised.
+
+        :param timeout: The maximum seconds to wait, None waits forever.
+        :type timeout: int | float | None
+        :return: The exception, or None if the call succeeded.
+        :rtype: Exception | None
+        """
+        if not self._done.wait(timeout):
+            raise TimeoutError('future did not complete within %s seconds' % timeout)
+        return self._exception
+
+    def add_done_callback(self, fn):
+        """
+        Call fn with the future when it completes.
+
+        If the future has already completed, fn is called right away.
+
+        :param fn: The callable taking the future as the only argument.
+        :type fn: callable
+        """
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(fn)
+                return
+        self._call(fn)
+
+    def set_result(self, result):
+        """ Complete the future with a result. """
+        self._complete(result, None)
+
+    def set_exception(self, exception):
+        """ Complete the future with an exception. """
+        self._complete(None, exception)
+
+    def _complete(self, result, exception):
+        with self._lock:
+            if self._done.is_set():
+                return
+            self._result = result
+            self._exception = exception
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for fn in callbacks:
+            self._call(fn)
+
+    def _call(self, fn):
+        try:
+            fn(self)
+        except Exception as e:
+            log.error('future callback error: %s' % e, exc_info=True)
+
+
+class WorkerPool(object):
+    """ A fixed number of daemon threads, executing calls from a work queue. """
+
+    def __init__(self, workers=4, max_queue=0, name='worker'):
+        """
+        Create the pool and start the worker threads.
+
+        :param workers: The number of worker threads.
+        :type workers: int
+        :param max_queue: The maximum number of queued calls, 0 for no limit.
+        :type max_queue: int
+        :param name: The name prefix of the worker threads.
+        :type name: str
+        """
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._threads = []
+        for i in range(workers):
+            t = threading.Thread(target=self._work, name='%s-%s' % (name, i))
+            t.daemon = True
+            t.start()
+            self._threads.append(t)
+
+    @property
+    def pending(self):
+        """
+        Returns the number of queued calls not yet picked up by a worker.
+
+        :return: The queue depth.
+        :rtype: int
+        """
+        return self._queue.qsize()
+
+    def submit(self, fn, *args, **kwargs):
+        """
+        Queue a call for a worker thread.
+
+        :param fn: The callable to call.
+        :type fn: callable
+        :return: A Future for the result of the call.
+        :rtype: Future
+        :raises queue.Full: If the queue is bounded and full.
+        """
+        future = Future()
+        self._queue.put_nowait((future, fn, args, kwargs))
+        return future
+
+    def shutdown(self, wait=True):
+        """
+        Stop the worker threads once the queued calls are done.
+
+        :param wait: Wait for the threads to exit.
+        :type wait: bool
+        """
+        for _ in self._threads:
+            self._queue.put(None)
+        if wait:
+            for t in self._threads:
+                t.join()
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, fn, args, kwargs = item
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                log.error('worker call %s failed: %s' % (fn, e), exc_info=True)
+                future.set_exception(e)
@@ -0,0 +1,222 @@
+""" Outbound message queue, written to the websocket by a single writer in priority order. """
+import time
+import heapq
+import logging
+import itertools
+import threading
+
+log = logging.getLogger(__name__)
+
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+
+# Priority of outbound messages by tc, pong and moderation before chat and media.
+PRIORITIES = {
+    'join': PRIORITY_HIGH,
+    'pong': PRIORITY_HIGH,
+    'password': PRIORITY_HIGH,
+    'captcha': PRIORITY_HIGH,
+    'kick': PRIORITY_HIGH,
+    'ban': PRIORITY_HIGH,
+    'unban': PRIORITY_HIGH,
+    'banlist': PRIORITY_HIGH,
+    'stream_moder_allow': PRIORITY_HIGH,
+    'stream_moder_close': PRIORITY_HIGH,
+    'msg': PRIORITY_LOW,
+    'pvtmsg': PRIORITY_LOW,
+    'yut_playlist': PRIORITY_LOW,
+    'yut_playlist_add': PRIORITY_LOW,
+    'yut_playlist_remove': PRIORITY_LOW,
+    'yut_playlist_mode': PRIORITY_LOW,
+    'yut_play': PRIORITY_LOW,
+    'yut_pause': PRIORITY_LOW,
+    'yut_stop': PRIORITY_LOW
+}
+
+
+class FrameWriter(object):
+    """
+    A priority queue of encoded frames, paced by a token bucket.
+
+    Either start() a writer thread, or call flush() from an event loop.
+    """
+
+    def __init__(self, write, rate=0, burst=1, max_queue=0):
+        """
+        Create the writer.
+
+        :param write: The callable writing an encoded frame, e.g websocket.send
+        :type write: callable
+        :param rate: The maximum frames per second, 0 for no pacing.
+        :type rate: int | float
+        :param burst: The number of frames that can be written at once, before pacing kicks in.
+        :type burst: int
+        :param max_queue: The maximum number of queued frames, 0 for no limit.
+        :type max_queue: int
+        """
+        self._write = write
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_queue = max_queue
+
+        self._heap = []
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._tokens = float(self.burst)
+        self._refilled = time.time()
+        self._thread = None
+        self._running = False
+
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._latency_total = 0.0
+        self._latency_max = 0.0
+
+    def __len__(self):
+        return len(self._heap)
+
+    def put(self, data, priority=PRIORITY_NORMAL, on_written=None):
+        """
+        Queue an encoded frame.
+
+        When the queue is full, the last queued frame of the lowest priority is dropped
+        to make room, or this frame, if no queued frame has a lower priority.
+
+        :param data: The encoded frame.
+        :type data: str
+        :param priority: One of PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW.
+        :type priority: int
+        :param on_written: Called with the time the frame was written, on the writing thread.
+        :type on_written: callable | None
+        :return: True if queued, False if the queue was full.
+        :rtype: bool
+        """
+        with self._cond:
+            if self.max_queue and len(self._heap) >= self.max_queue:
+                self.dropped += 1
+                worst = max(self._heap)
+                if worst[0] <= priority:
+                    log.warning('outbound queue full, dropping: %s' % data)
+                    return False
+                log.warning('outbound queue full, dropping: %s' % worst[3])
+                self._heap.remove(worst)
+                heapq.heapify(self._heap)
+            heapq.heappush(self._heap, (priority, next(self._seq), time.time(), data, on_written))
+            self.enqueued += 1
+            self._cond.notify()
+        return True
+
+    def next_write_delay(self):
+        """
+        Seconds until the next frame can be written.
+
+        :return: 0 if a frame can be written now, the seconds to wait for pacing, or None if the queue is empty.
+        :rtype: float | None
+        """
+        if not self._heap:
+            return None
+        self._refill()
+        if self._tokens >= 1:
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def flush(self):
+        """
+        Write the queued frames that pacing allows right now, without waiting.
+
+        :return: The number of frames written.
+        :rtype: int
+        """
+        count = 0
+        while self.next_write_delay() == 0:
+            with self._cond:
+                if not self._heap:
+                    break
+                item = heapq.heappop(self._heap)
+            self._send(item)
+            count += 1
+        return count
+
+    def start(self):
+        """ Start a writer thread, draining the queue. """
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='frame-writer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """ Stop the writer thread. Frames still queued are discarded. """
+        with self._cond:
+            self._running = False
+            del self._heap[:]
+            self._cond.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(5)
+        self._thread = None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while self._running and not self._heap:
+                    self._cond.wait()
+                if not self._running:
+                    break
+                delay = self.next_write_delay()
+                if delay:
+                    # woken early by put, or stop.
+                    self._cond.wait(delay)
+                    continue
+                item = heapq.heappop(self._heap)
+            self._send(item)
+
+    def _refill(self):
+        if self.rate:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens + (now - self._refilled) * self.rate)
+            self._refilled = now
+        else:
+            self._tokens = self.burst
+
+    def _send(self, item):
+        _, _, enqueued_at, data, on_written = item
+        try:
+            self._write(data)
+        except Exception as e:
+            self.failed += 1
+            log.error('failed to write frame: %s' % e, exc_info=True)
+        else:
+            written_at = time.time()
+            latency = written_at - enqueued_at
+            self.written += 1
+            self._latency_total += latency
+            if latency > self._latency_max:
+                self._latency_max = latency
+            if on_written is not None:
+                try:
+                    on_written(written_at)
+                except Exception as e:
+                    log.error('on_written callback error: %s' % e, exc_info=True)
+        self._tokens -= 1
+
+    @property
+    def stats(self):
+        """
+        Returns the queue depth and write stats.
+
+        Latency is the time from queueing a frame until it was written, in seconds.
+
+        :return: A dictionary of stats.
+        :rtype: dict
+        """
+        return {
+            'queue_depth': len(self._heap),
+            'enqueued': self.enqueued,
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+            'latency_avg': self._latency_total / self.written if self.written else 0.0,
+            'latency_max': self._latency_max
+        }